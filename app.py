@@ -1,14 +1,24 @@
+import logging
+import math
+import time
+from datetime import datetime
 from pathlib import Path
 from flask import Response, request, abort
 import dash
 from dash import dcc, html, Input, Output, State
 import dash_bootstrap_components as dbc
 import dash_leaflet as dl
-import pandas as pd
+from sqlalchemy import text
 from database import DatabaseManager  # Tu clase de base de datos
 from router import RouteProvider      # Tu motor de rutas con caché
-from process import procesar_rutas   # Tu función de procesamiento de rutas
-from logger import setup_logger
+from resolucion_rutas import ResolutorRutas
+from process import (  # Procesamiento de rutas, vista de flota y búsquedas
+    coordenadas_pedido, procesar_flota, agrupar_pares_flota, buscar_pedidos, buscar_plantas,
+)
+from geometry import nivel_para_zoom
+from mantenimiento_cache import estadisticas_cache
+from metrics import CALLBACK_SEGUNDOS, ETAPA_SEGUNDOS, REGISTRO
+from logger import setup_logger, leer_ultimas_lineas
 
 logger = setup_logger("app")
 
@@ -17,41 +27,70 @@ app = dash.Dash(__name__, external_stylesheets=[dbc.themes.FLATLY])
 server = app.server  # Para despliegue en plataformas como Heroku
 db = DatabaseManager()
 router = RouteProvider(db)
+# Los fallos de caché se resuelven fuera del callback (el navegador sondea)
+resolutor = ResolutorRutas(router)
+
+MAX_OPCIONES_PEDIDO = 50
+# En la vista de flota nunca se envía la geometría completa (cientos de rutas)
+NIVEL_MINIMO_FLOTA = 2
+INTERVALO_SONDEO_MS = 700
+# Pasado este tiempo se deja de esperar una ruta en segundo plano
+LIMITE_ESPERA_RUTA_S = 60
+CENTRO_INICIAL = [40.4167, -3.7037]
+OCULTO, VISIBLE = {"display": "none"}, {"display": "block"}
 
 LOG_FOLDER = Path("logs")
 LOG_FILE = LOG_FOLDER / "logs.log"
+MAX_LINEAS_LOG = 5000
 
 @app.server.route("/health")
 def health_check():
     # Intenta una consulta simple a SQLite
     try:
-        db.engine.connect()
+        with db.read_engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
         return {"status": "ok", "database": "connected"}, 200
     except Exception:
         return {"status": "error"}, 500
 
+@app.server.before_request
+def iniciar_volcado_metricas():
+    # Una vez por worker (tras el fork de Gunicorn); después es una comparación de pid
+    REGISTRO.iniciar_volcado()
+
+@app.server.route("/metrics")
+def metrics():
+    return Response(REGISTRO.exponer(), mimetype="text/plain; version=0.0.4")
+
+@app.server.route("/cache/stats")
+def cache_stats():
+    """Estado de cache_rutas (entradas, bytes, antigüedad) y aciertos de este worker."""
+    return {"cache_rutas": estadisticas_cache(db), "proceso": router.estadisticas()}
+
 @app.server.route("/view-logs")
 def view_logs():
-    
+    """Últimas líneas del log: ``?lines=`` (por defecto 100) y ``?level=`` (nivel mínimo)."""
     # Verificación con pathlib
     if not LOG_FILE.exists():
         return f"El archivo {LOG_FILE} no existe todavía.", 404
 
+    lineas = request.args.get("lines", default=100, type=int)
+    if lineas is None or not 0 < lineas <= MAX_LINEAS_LOG:
+        return f"'lines' debe estar entre 1 y {MAX_LINEAS_LOG}.", 400
+    nivel = request.args.get("level")
+    nivel_minimo = None
+    if nivel:
+        nivel_minimo = logging.getLevelName(nivel.upper())
+        if not isinstance(nivel_minimo, int):
+            return f"Nivel de log desconocido: {nivel}", 400
+
     try:
-        # Leemos el archivo de forma segura
-        lineas = LOG_FILE.read_text(encoding="utf-8").splitlines()
-        ultimas_lineas = lineas[-100:]
-        return Response("\n".join(ultimas_lineas), mimetype="text/plain")
+        # Se lee hacia atrás desde el final: el coste no depende del tamaño del log
+        ultimas_lineas = leer_ultimas_lineas(LOG_FILE, lineas, nivel_minimo)
+        return Response("".join(f"{linea}\n" for linea in ultimas_lineas), mimetype="text/plain")
     except Exception as e:
         return f"Error al leer los logs: {e}", 500
 
-# Obtener lista inicial de pedidos para el Dropdown
-def get_lista_pedidos():
-    df = db.leer_tabla("planificaciones")
-    if not df.empty:
-        return [{"label": str(p), "value": str(p)} for p in df['pedido'].unique()]
-    return []
-
 # 2. Layout (Diseño de la Interfaz)
 app.layout = dbc.Container([
     dbc.Row([
@@ -63,13 +102,29 @@ app.layout = dbc.Container([
             
             dcc.Dropdown(
                 id="selector-pedido",
-                options=get_lista_pedidos(),
+                options=[],  # se rellenan al escribir (callback buscar_opciones_pedido)
                 placeholder="Buscar pedido...",
                 className="mb-4"
             ),
             
-            html.Div(id="info-ruta-card") # Aquí irán los km y tiempo
-        ], width=3, className="bg-light p-4 shadow-sm", style={"height": "100vh"}),
+            html.Div(id="info-ruta-card"), # Aquí irán los km y tiempo
+            dbc.Button("Cancelar", id="btn-cancelar-ruta", color="secondary", size="sm",
+                       outline=True, className="mt-2", style=OCULTO),
+            dcc.Store(id="ruta-pendiente"),
+            dcc.Store(id="ruta-mostrada"),  # coords y nivel de la geometría pintada
+            dcc.Interval(id="sondeo-ruta", interval=INTERVALO_SONDEO_MS, disabled=True),
+
+            html.Hr(),
+            html.H5("Vista de flota", className="text-primary"),
+            html.P("Filtra por fecha, planta o varios pedidos:", className="mb-2"),
+            dcc.DatePickerSingle(id="filtro-fecha", display_format="DD/MM/YYYY",
+                                 placeholder="Fecha prevista", clearable=True, className="mb-2"),
+            dcc.Dropdown(id="filtro-planta", options=[], placeholder="Planta...", className="mb-2"),
+            dcc.Dropdown(id="selector-flota", options=[], multi=True,
+                         placeholder="Pedidos...", className="mb-2"),
+            dbc.Button("Ver flota", id="btn-flota", color="primary", className="w-100 mb-2"),
+            html.Div(id="info-flota-card")
+        ], width=3, className="bg-light p-4 shadow-sm", style={"height": "100vh", "overflowY": "auto"}),
 
         # Columna Principal (Mapa)
         dbc.Col([
@@ -77,6 +132,7 @@ app.layout = dbc.Container([
                 dl.TileLayer(), # Fondo de OpenStreetMap
                 dl.LayerGroup(id="capa-marcadores"), # Para los pins de origen/destino
                 dl.LayerGroup(id="capa-ruta"),       # Para la línea de la carretera
+                dl.LayerGroup(id="capa-flota"),      # Rutas y marcadores agrupados de la flota
             ], 
             id="mapa-logistico",
             center=[40.4167, -3.7037], # Centro de España
@@ -86,42 +142,128 @@ app.layout = dbc.Container([
     ], className="g-0") # g_0 elimina los espacios entre columnas
 ], fluid=True)
 
-# 3. Callback (Lógica de Interacción)
+# 3. Callbacks (Lógica de Interacción)
 @app.callback(
-    [Output("capa-marcadores", "children"),
-     Output("capa-ruta", "children"),
-     Output("info-ruta-card", "children"),
-     Output("mapa-logistico", "center")], # Para centrar el mapa al cargar],
-    [Input("selector-pedido", "value")]
+    Output("selector-pedido", "options"),
+    [Input("selector-pedido", "search_value")],
+    [State("selector-pedido", "value")]
 )
-def actualizar_mapa(cod_pedido):
-    if not cod_pedido:
-        logger.info("No se ha seleccionado ningún pedido.")
-        return [], [], "", [40.4167, -3.7037]
-    df_rutas = procesar_rutas(cod_pedido)
-    row = df_rutas.iloc[0]
-    lo_o, la_o = row['longitud_origen'], row['latitud_origen']
-    lo_d, la_d = row['longitud_destino'], row['latitud_destino']
-    cod_planta = row['codigoPlanta']
-    cod_cargadero = row['codigoCargadero']    
+def buscar_opciones_pedido(texto, seleccionado):
+    """Opciones del selector: búsqueda por prefijo en el servidor en vez de la lista completa."""
+    pedidos = buscar_pedidos(texto or "", limite=MAX_OPCIONES_PEDIDO)
+    # El pedido seleccionado debe seguir entre las opciones para no perderlo
+    if seleccionado and seleccionado not in pedidos:
+        pedidos = [seleccionado] + pedidos
+    return [{"label": p, "value": p} for p in pedidos]
 
-    # Validación robusta: pd.isna() detecta tanto None como np.nan
-    coords = [lo_o, la_o, lo_d, la_d]
-    if any(pd.isna(c) for c in coords):
-        logger.error(f"Coordenadas inválidas (NaN o None) para el pedido: {cod_pedido}")
-        return [], [], dbc.Alert("Faltan coordenadas geográficas en el maestro de orígenes/destinos.", color="danger"), [40.4167, -3.7037]
-
-    # Si pasa el filtro, procedemos
-    ruta = router.get_route(lo_o, la_o, lo_d, la_d)
-    logger.info(f"Tipo de geometría: {type(ruta['geometria'])}")
-    if not ruta:
-        logger.error(f"No se pudo obtener la ruta para el pedido: {cod_pedido}")
-        return [], [], dbc.Alert("No se pudo obtener la ruta.", color="danger"), [40.4167, -3.7037]
-    
-    # Marcadores de origen y destino
-    marcador_origen = dl.Marker(position=[la_o, lo_o], children=dl.Tooltip(f"Origen: {cod_cargadero}"))
-    marcador_destino = dl.Marker(position=[la_d, lo_d], children=dl.Tooltip(f"Destino: {cod_planta}"))
 
+@app.callback(
+    Output("selector-flota", "options"),
+    [Input("selector-flota", "search_value")],
+    [State("selector-flota", "value")]
+)
+def buscar_opciones_flota(texto, seleccionados):
+    pedidos = buscar_pedidos(texto or "", limite=MAX_OPCIONES_PEDIDO)
+    extra = [p for p in (seleccionados or []) if p not in pedidos]
+    return [{"label": p, "value": p} for p in extra + pedidos]
+
+
+@app.callback(
+    Output("filtro-planta", "options"),
+    [Input("filtro-planta", "search_value")],
+    [State("filtro-planta", "value")]
+)
+def buscar_opciones_planta(texto, seleccionada):
+    plantas = buscar_plantas(texto or "", limite=MAX_OPCIONES_PEDIDO)
+    opciones = [{"label": f"{codigo} - {nombre}" if nombre else codigo, "value": codigo} for codigo, nombre in plantas]
+    if seleccionada and all(o["value"] != seleccionada for o in opciones):
+        opciones.insert(0, {"label": seleccionada, "value": seleccionada})
+    return opciones
+
+
+@app.callback(
+    [Output("capa-flota", "children"),
+     Output("info-flota-card", "children")],
+    [Input("btn-flota", "n_clicks")],
+    [State("filtro-fecha", "date"),
+     State("filtro-planta", "value"),
+     State("selector-flota", "value"),
+     State("mapa-logistico", "zoom")],
+    prevent_initial_call=True
+)
+@CALLBACK_SEGUNDOS.tiempo(callback="actualizar_flota")
+def actualizar_flota(n_clicks, fecha, cod_planta, pedidos, zoom=None):
+    """Dibuja todas las rutas de una fecha, planta y/o lista de pedidos en una sola capa."""
+    # El DatePicker entrega aaaa-mm-dd; la API guarda dd/mm/aaaa
+    fecha_api = datetime.strptime(fecha, "%Y-%m-%d").strftime("%d/%m/%Y") if fecha else None
+    df_flota = procesar_flota(fecha_api, cod_planta, pedidos)
+    if df_flota.empty:
+        return [], dbc.Alert("No hay planificaciones para esos filtros.", color="warning")
+
+    pares = agrupar_pares_flota(df_flota)
+    nivel = max(nivel_para_zoom(zoom), NIVEL_MINIMO_FLOTA)
+    # Solo caché: los fallos se calculan en segundo plano como en la vista de un pedido
+    rutas = router.get_routes([p["coords"] for p in pares], nivel=nivel, resolver_fallos=False)
+    en_calculo = 0
+
+    lineas, puntos, vistos = [], [], set()
+    km_totales = 0.0
+    for par in pares:
+        lo_o, la_o, lo_d, la_d = par["coords"]
+        route_id = router._generar_id_ruta(*par["coords"])
+        ruta = rutas.get(route_id)
+        if ruta is None:
+            resolutor.enviar(route_id, par["coords"], nivel)
+            en_calculo += 1
+        elif ruta:
+            km_totales += (ruta["distancia_km"] or 0) * par["cargas"]
+            lineas.append({
+                "type": "Feature",
+                "geometry": ruta["geometria"],
+                "properties": {
+                    "cargas": par["cargas"],
+                    "tooltip": f"{par['codigoCargadero']} → {par['codigoPlanta']}: "
+                               f"{par['cargas']} cargas, {ruta['distancia_km']} km",
+                },
+            })
+        for codigo, lon, lat, tipo in ((par["codigoCargadero"], lo_o, la_o, "Origen"),
+                                       (par["codigoPlanta"], lo_d, la_d, "Destino")):
+            if (tipo, codigo) not in vistos:
+                vistos.add((tipo, codigo))
+                puntos.append({
+                    "type": "Feature",
+                    "geometry": {"type": "Point", "coordinates": [lon, lat]},
+                    "properties": {"tooltip": f"{tipo}: {codigo}"},
+                })
+
+    capa = [
+        dl.GeoJSON(data={"type": "FeatureCollection", "features": lineas},
+                   style={"color": "#e67e22", "weight": 3, "opacity": 0.7}, id="flota-rutas"),
+        dl.GeoJSON(data={"type": "FeatureCollection", "features": puntos},
+                   cluster=True, zoomToBoundsOnClick=True, id="flota-marcadores"),
+    ]
+    card_flota = dbc.Card([
+        dbc.CardBody([
+            html.P(f"Planificaciones: {len(df_flota)}", className="mb-1"),
+            html.P(f"Trayectos distintos: {len(pares)} ({len(lineas)} con ruta)", className="mb-1"),
+            html.P(f"Distancia total: {km_totales:,.0f} km", className="mb-0"),
+            html.Small(f"{en_calculo} trayectos calculándose en segundo plano: vuelve a pulsar para verlos.",
+                       className="text-muted") if en_calculo else None,
+        ])
+    ], color="light", className="mt-2 shadow-sm")
+    return capa, card_flota
+
+
+def _coordenada_valida(valor) -> bool:
+    try:
+        return math.isfinite(float(valor))
+    except (TypeError, ValueError):
+        return False
+
+
+def _componentes_ruta(ruta):
+    """Capa de la ruta y tarjeta de detalles a partir del dict de ``RouteProvider``."""
+    inicio_geojson = time.perf_counter()
     # 4. Crear la Polilínea de la ruta
     # OSRM devuelve GeoJSON, Dash Leaflet lo lee directamente
     geojson_data = {
@@ -136,12 +278,182 @@ def actualizar_mapa(cod_pedido):
             html.H5("Detalles del Viaje", className="card-title"),
             html.P(f"Distancia: {ruta['distancia_km']} km", className="mb-1"),
             html.P(f"Tiempo est.: {ruta['duracion_min']} min", className="mb-0"),
-            html.Small("Datos calculados vía OSRM/Caché local", className="text-muted")
+            html.Small(
+                f"Ruta aproximada: reutiliza una ruta cacheada a {ruta['desvio_m']} m" if ruta.get("aproximada")
+                else "Datos calculados vía OSRM/Caché local",
+                className="text-muted"
+            )
         ])
     ], color="light", className="mt-3 shadow-sm")
+    ETAPA_SEGUNDOS.observe(time.perf_counter() - inicio_geojson, etapa="construir_geojson")
+    return [ruta_geojson], card_info
+
+
+def _card_calculando(segundos, estado):
+    textos = {
+        "en_cola": "Ruta en cola...",
+        "calculando": "Consultando OSRM...",
+        "otro_proceso": "Otro proceso está calculando la ruta...",
+    }
+    return dbc.Card([
+        dbc.CardBody([
+            html.H5("Calculando ruta", className="card-title"),
+            html.P(f"{textos.get(estado, 'Consultando OSRM...')} ({segundos:.0f} s)", className="mb-2"),
+            dbc.Progress(value=min(100, 100 * segundos / LIMITE_ESPERA_RUTA_S), striped=True, animated=True),
+        ])
+    ], color="light", className="mt-3 shadow-sm")
+
+
+@app.callback(
+    [Output("capa-marcadores", "children"),
+     Output("capa-ruta", "children"),
+     Output("info-ruta-card", "children"),
+     Output("mapa-logistico", "center"), # Para centrar el mapa al cargar
+     Output("ruta-pendiente", "data"),
+     Output("sondeo-ruta", "disabled"),
+     Output("btn-cancelar-ruta", "style"),
+     Output("ruta-mostrada", "data")],
+    [Input("selector-pedido", "value")],
+    [State("mapa-logistico", "zoom")]
+)
+@CALLBACK_SEGUNDOS.tiempo(callback="actualizar_mapa")
+def actualizar_mapa(cod_pedido, zoom=None):
+    if not cod_pedido:
+        logger.info("No se ha seleccionado ningún pedido.")
+        return [], [], "", CENTRO_INICIAL, None, True, OCULTO, None
+    # Filas como dicts (sin pandas): es el camino de cada selección de pedido
+    with ETAPA_SEGUNDOS.tiempo(etapa="procesar_rutas"):
+        try:
+            filas = coordenadas_pedido(cod_pedido)
+        except Exception as e:
+            logger.error(f"Error al leer datos de la base de datos: {e}")
+            filas = None
+    if not filas:
+        if filas is not None:
+            logger.warning(f"No se encontraron datos para el pedido: {cod_pedido}")
+        alerta = dbc.Alert(f"No hay planificaciones para el pedido {cod_pedido}.", color="warning")
+        return [], [], alerta, CENTRO_INICIAL, None, True, OCULTO, None
+    row = filas[0]
+    lo_o, la_o = row['longitud_origen'], row['latitud_origen']
+    lo_d, la_d = row['longitud_destino'], row['latitud_destino']
+    cod_planta = row['codigoPlanta']
+    cod_cargadero = row['codigoCargadero']    
+
+    # Validación robusta: None, NaN o texto no numérico en los maestros
+    coords = [lo_o, la_o, lo_d, la_d]
+    if not all(_coordenada_valida(c) for c in coords):
+        logger.error(f"Coordenadas inválidas (NaN o None) para el pedido: {cod_pedido}")
+        alerta = dbc.Alert("Faltan coordenadas geográficas en el maestro de orígenes/destinos.", color="danger")
+        return [], [], alerta, CENTRO_INICIAL, None, True, OCULTO, None
+
+    # Marcadores de origen y destino
+    marcador_origen = dl.Marker(position=[la_o, lo_o], children=dl.Tooltip(f"Origen: {cod_cargadero}"))
+    marcador_destino = dl.Marker(position=[la_d, lo_d], children=dl.Tooltip(f"Destino: {cod_planta}"))
+    marcadores = [marcador_origen, marcador_destino]
     # Centro del mapa: El punto de origen
     nuevo_centro = [la_o, lo_o]
-    return [marcador_origen, marcador_destino], [ruta_geojson], card_info, nuevo_centro
+
+    # Si pasa el filtro, procedemos (resolución de la geometría según el zoom actual).
+    # Los aciertos de caché se devuelven directamente; los fallos van a segundo plano.
+    nivel = nivel_para_zoom(zoom)
+    coords = [float(c) for c in coords]
+    with ETAPA_SEGUNDOS.tiempo(etapa="obtener_ruta"):
+        try:
+            ruta = router.buscar_en_cache(*coords, nivel=nivel)
+        except Exception as e:
+            logger.error(f"Error consultando caché: {e}")
+            return marcadores, [], dbc.Alert("No se pudo obtener la ruta.", color="danger"), nuevo_centro, None, True, OCULTO, None
+    if ruta is not None:
+        capa_ruta, card_info = _componentes_ruta(ruta)
+        mostrada = {"coords": coords, "nivel": nivel}
+        return marcadores, capa_ruta, card_info, nuevo_centro, None, True, OCULTO, mostrada
+
+    route_id = router._generar_id_ruta(*coords)
+    resolutor.enviar(route_id, coords, nivel)
+    pendiente = {"pedido": cod_pedido, "route_id": route_id, "coords": coords,
+                 "nivel": nivel, "inicio": time.time()}
+    return marcadores, [], _card_calculando(0, "en_cola"), nuevo_centro, pendiente, False, VISIBLE, None
+
+
+@app.callback(
+    [Output("capa-ruta", "children", allow_duplicate=True),
+     Output("info-ruta-card", "children", allow_duplicate=True),
+     Output("ruta-pendiente", "data", allow_duplicate=True),
+     Output("sondeo-ruta", "disabled", allow_duplicate=True),
+     Output("btn-cancelar-ruta", "style", allow_duplicate=True),
+     Output("ruta-mostrada", "data", allow_duplicate=True)],
+    [Input("sondeo-ruta", "n_intervals")],
+    [State("ruta-pendiente", "data")],
+    prevent_initial_call=True
+)
+def sondear_ruta(n_intervals, pendiente):
+    """Comprueba si la ruta en segundo plano ya está en caché (en cualquier worker)."""
+    if not pendiente:
+        return [], dash.no_update, None, True, OCULTO, dash.no_update
+    route_id, coords, nivel = pendiente["route_id"], pendiente["coords"], pendiente["nivel"]
+    try:
+        ruta = router.buscar_en_cache(*coords, nivel=nivel)
+    except Exception as e:
+        logger.error(f"Error consultando caché: {e}")
+        ruta = None
+    if ruta is not None:
+        capa_ruta, card_info = _componentes_ruta(ruta)
+        return capa_ruta, card_info, None, True, OCULTO, {"coords": coords, "nivel": nivel}
+
+    segundos = time.time() - pendiente["inicio"]
+    estado = resolutor.estado(route_id)
+    if estado in ("error", "terminada") or segundos > LIMITE_ESPERA_RUTA_S:
+        logger.error(f"No se pudo obtener la ruta para el pedido: {pendiente['pedido']}")
+        return [], dbc.Alert("No se pudo obtener la ruta.", color="danger"), None, True, OCULTO, None
+    if estado is None:
+        # El sondeo llegó a otro worker: si nadie la está calculando, la encolamos aquí
+        if router.lease is not None and router.lease.activo(route_id):
+            estado = "otro_proceso"
+        else:
+            resolutor.enviar(route_id, coords, nivel)
+            estado = "en_cola"
+    return dash.no_update, _card_calculando(segundos, estado), dash.no_update, False, VISIBLE, dash.no_update
+
+
+@app.callback(
+    [Output("capa-ruta", "children", allow_duplicate=True),
+     Output("ruta-mostrada", "data", allow_duplicate=True)],
+    [Input("mapa-logistico", "zoom")],
+    [State("ruta-mostrada", "data")],
+    prevent_initial_call=True
+)
+def ajustar_nivel_ruta(zoom, mostrada):
+    """Sustituye la geometría pintada por la del nivel de simplificación del nuevo zoom."""
+    if not mostrada:
+        return dash.no_update, dash.no_update
+    nivel = nivel_para_zoom(zoom)
+    if nivel == mostrada["nivel"]:
+        return dash.no_update, dash.no_update
+    try:
+        ruta = router.buscar_en_cache(*mostrada["coords"], nivel=nivel)
+    except Exception as e:
+        logger.error(f"Error consultando caché: {e}")
+        ruta = None
+    if ruta is None:
+        # Sin la ruta en caché (purgada entre tanto) se deja la geometría actual
+        return dash.no_update, dash.no_update
+    return _componentes_ruta(ruta)[0], {"coords": mostrada["coords"], "nivel": nivel}
+
+
+@app.callback(
+    [Output("info-ruta-card", "children", allow_duplicate=True),
+     Output("ruta-pendiente", "data", allow_duplicate=True),
+     Output("sondeo-ruta", "disabled", allow_duplicate=True),
+     Output("btn-cancelar-ruta", "style", allow_duplicate=True)],
+    [Input("btn-cancelar-ruta", "n_clicks")],
+    [State("ruta-pendiente", "data")],
+    prevent_initial_call=True
+)
+def cancelar_ruta(n_clicks, pendiente):
+    if pendiente:
+        resolutor.cancelar(pendiente["route_id"])
+    return dbc.Alert("Cálculo de la ruta cancelado.", color="secondary"), None, True, OCULTO
+
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8040, debug=True)
\ No newline at end of file
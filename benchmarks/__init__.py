@@ -0,0 +1 @@
+"""Utilidades de benchmark y servidores simulados para pruebas locales."""
@@ -0,0 +1,137 @@
+"""Benchmark de arranque del dashboard: importación de ``app`` y workers de Gunicorn.
+
+Mide en procesos nuevos el tiempo de ``import app`` y su memoria (y si se han
+cargado pandas/pyarrow), y después arranca Gunicorn con ``gunicorn.conf.py``
+sobre una base sintética: segundos hasta que ``/health`` responde y memoria
+RSS/PSS del máster y de cada worker frente al límite del contenedor.
+
+Uso:
+    python -m benchmarks.bench_arranque --repeticiones 5 --workers 2
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import requests
+from database import DatabaseManager
+from benchmarks.synthetic_data import poblar_bd
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LIMITE_MEMORIA_MB = 512  # deploy.resources.limits.memory de docker-compose.yml
+
+_SCRIPT_IMPORTACION = """
+import json, resource, sys, time
+inicio = time.perf_counter()
+import app
+print(json.dumps({
+    "segundos": time.perf_counter() - inicio,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "pandas": "pandas" in sys.modules,
+    "pyarrow": "pyarrow" in sys.modules,
+}))
+"""
+
+
+def _entorno() -> dict:
+    return {**os.environ, "PYTHONPATH": RAIZ + os.pathsep + os.environ.get("PYTHONPATH", "")}
+
+
+def _preparar_bd(directorio: str) -> None:
+    db = DatabaseManager(os.path.join(directorio, "logistica.db"))
+    poblar_bd(db, 10000)
+    db.crear_indices()
+    db.refrescar_pedido_coordenadas()
+
+
+def medir_importacion(directorio: str, repeticiones: int) -> dict:
+    medidas = []
+    for _ in range(repeticiones):
+        salida = subprocess.run([sys.executable, "-c", _SCRIPT_IMPORTACION], cwd=directorio, env=_entorno(),
+                                capture_output=True, text=True, check=True).stdout
+        medidas.append(json.loads(salida.strip().splitlines()[-1]))
+    return {
+        "import_app_s": round(statistics.median(m["segundos"] for m in medidas), 3),
+        "import_app_rss_mb": round(statistics.median(m["rss_mb"] for m in medidas), 1),
+        "pandas_cargado": medidas[-1]["pandas"],
+        "pyarrow_cargado": medidas[-1]["pyarrow"],
+    }
+
+
+def _memoria(pid: int) -> tuple:
+    """(RSS, PSS) en MB de ``/proc/<pid>/smaps_rollup``; PSS reparte las páginas compartidas."""
+    valores = {}
+    with open(f"/proc/{pid}/smaps_rollup", encoding="utf-8") as f:
+        for linea in f:
+            partes = linea.split()
+            if partes[0] in ("Rss:", "Pss:"):
+                valores[partes[0]] = int(partes[1]) / 1024
+    return round(valores["Rss:"], 1), round(valores["Pss:"], 1)
+
+
+def _hijos(pid: int) -> list:
+    with open(f"/proc/{pid}/task/{pid}/children", encoding="utf-8") as f:
+        return [int(p) for p in f.read().split()]
+
+
+def medir_gunicorn(directorio: str, workers: int) -> dict:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        puerto = s.getsockname()[1]
+    entorno = {**_entorno(), "GUNICORN_BIND": f"127.0.0.1:{puerto}", "WEB_CONCURRENCY": str(workers),
+               "METRICS_DIR": os.path.join(directorio, "metricas")}
+    inicio = time.perf_counter()
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", os.path.join(RAIZ, "gunicorn.conf.py"), "app:server"],
+        cwd=directorio, env=entorno, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                if requests.get(f"http://127.0.0.1:{puerto}/health", timeout=1).ok:
+                    break
+            except requests.exceptions.ConnectionError:
+                pass
+            if proceso.poll() is not None or time.perf_counter() - inicio > 60:
+                raise RuntimeError("Gunicorn no llegó a responder en /health")
+            time.sleep(0.02)
+        arranque = time.perf_counter() - inicio
+        # Espera a que estén todos los workers y los calienta con la página y el layout
+        while len(_hijos(proceso.pid)) < workers:
+            time.sleep(0.05)
+        for ruta in ("/", "/_dash-layout", "/_dash-dependencies") * workers * 2:
+            requests.get(f"http://127.0.0.1:{puerto}{ruta}", timeout=10)
+        maestro = _memoria(proceso.pid)
+        por_worker = [_memoria(pid) for pid in _hijos(proceso.pid)]
+    finally:
+        proceso.terminate()
+        proceso.wait(timeout=30)
+    total_pss = maestro[1] + sum(pss for _, pss in por_worker)
+    return {
+        "workers": workers,
+        "health_s": round(arranque, 3),
+        "maestro_rss_pss_mb": maestro,
+        "workers_rss_pss_mb": por_worker,
+        "total_pss_mb": round(total_pss, 1),
+        "limite_mb": LIMITE_MEMORIA_MB,
+        "holgura_mb": round(LIMITE_MEMORIA_MB - total_pss, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        _preparar_bd(directorio)
+        print(medir_importacion(directorio, args.repeticiones))
+        print(medir_gunicorn(directorio, args.workers))
+
+
+if __name__ == "__main__":
+    main()
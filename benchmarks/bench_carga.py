@@ -0,0 +1,152 @@
+"""Prueba de carga del callback ``actualizar_mapa`` con el cliente de pruebas de Flask.
+
+Genera una base sintética con una parte de las rutas ya en cache_rutas, arranca
+un FakeOSRM para los fallos (que el dashboard resuelve en segundo plano) y lanza
+peticiones concurrentes a ``/_dash-update-component`` como las del navegador al
+elegir un pedido. La aplicación se importa en un subproceso con la base
+sintética como directorio de trabajo.
+
+Uso:
+    python -m benchmarks.bench_carga --tamanos 10000,100000 --peticiones 2000 --concurrencia 8
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentiles(tiempos: list) -> dict:
+    """p50/p95/p99 y máximo en milisegundos de una lista de segundos."""
+    cortes = statistics.quantiles(tiempos, n=100, method="inclusive")
+    return {"p50_ms": round(cortes[49] * 1000, 2), "p95_ms": round(cortes[94] * 1000, 2),
+            "p99_ms": round(cortes[98] * 1000, 2), "max_ms": round(max(tiempos) * 1000, 2)}
+
+
+def _cuerpo_callback(dependencias: list, pedido: str, zoom: int) -> dict:
+    """Petición de Dash para ``actualizar_mapa`` a partir de ``/_dash-dependencies``."""
+    dependencia = next(d for d in dependencias if "capa-ruta.children" in d["output"]
+                       and d["inputs"][0]["id"] == "selector-pedido")
+    salidas = []
+    for salida in dependencia["output"].strip(".").split("..."):
+        id_componente, propiedad = salida.rsplit(".", 1)
+        salidas.append({"id": id_componente, "property": propiedad})
+    return {
+        "output": dependencia["output"],
+        "outputs": salidas,
+        "inputs": [{"id": "selector-pedido", "property": "value", "value": pedido}],
+        "state": [{"id": "mapa-logistico", "property": "zoom", "value": zoom}],
+        "changedPropIds": ["selector-pedido.value"],
+    }
+
+
+def _lanzar(pedidos: list, peticiones: int, concurrencia: int, calentamiento: int = 50) -> dict:
+    """Se ejecuta en el subproceso, con el directorio de la base sintética como cwd."""
+    import logging
+    logging.disable(logging.WARNING)
+    import app
+
+    dependencias = app.server.test_client().get("/_dash-dependencies").get_json()
+    rng = random.Random(0)
+    # Zoom variado: mezcla la geometría completa y los niveles simplificados
+    cuerpos = [_cuerpo_callback(dependencias, rng.choice(pedidos), rng.choice((7, 10, 13, 16)))
+               for _ in range(peticiones + calentamiento)]
+
+    def _peticion(cuerpo) -> tuple:
+        cliente = app.server.test_client()
+        inicio = time.perf_counter()
+        respuesta = cliente.post("/_dash-update-component", json=cuerpo)
+        segundos = time.perf_counter() - inicio
+        pendiente = respuesta.status_code == 200 and \
+            respuesta.get_json()["response"].get("ruta-pendiente", {}).get("data") is not None
+        return segundos, respuesta.status_code, pendiente
+
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        list(pool.map(_peticion, cuerpos[:calentamiento]))
+        inicio = time.perf_counter()
+        resultados = list(pool.map(_peticion, cuerpos[calentamiento:]))
+        total = time.perf_counter() - inicio
+
+    tiempos = [s for s, estado, _ in resultados if estado == 200]
+    return {
+        "peticiones": peticiones,
+        "concurrencia": concurrencia,
+        "errores": sum(1 for _, estado, _ in resultados if estado != 200),
+        "en_segundo_plano": sum(1 for *_, pendiente in resultados if pendiente),
+        "peticiones_por_segundo": round(len(resultados) / total, 1),
+        **percentiles(tiempos),
+    }
+
+
+def preparar(tamano: int, carpeta: str, fraccion_cacheada: float = 0.9) -> tuple:
+    """Base sintética ``carpeta/logistica.db`` con ``fraccion_cacheada`` de los pares en cache_rutas.
+
+    Returns:
+        (DatabaseManager, datos generados por ``poblar_bd``).
+    """
+    from database import DatabaseManager
+    from router import RouteProvider
+    from benchmarks.synthetic_data import poblar_bd, poblar_cache_rutas
+
+    os.makedirs(carpeta, exist_ok=True)
+    db = DatabaseManager(os.path.join(carpeta, "logistica.db"))
+    datos = poblar_bd(db, tamano)
+    poblar_cache_rutas(db, RouteProvider(db), fraccion=fraccion_cacheada)
+    return db, datos
+
+
+def medir(carpeta: str, pedidos: list, peticiones: int = 2000, concurrencia: int = 8) -> dict:
+    """Prueba de carga sobre la base de ``carpeta`` (en un subproceso, con FakeOSRM para los fallos)."""
+    from benchmarks.fake_servers import FakeOSRM
+
+    ruta_pedidos = os.path.join(carpeta, "pedidos.json")
+    with open(ruta_pedidos, "w", encoding="utf-8") as f:
+        json.dump(pedidos, f)
+    with FakeOSRM(retraso=0.05) as osrm:
+        entorno = {**os.environ, "OSRM_BASE_URL": osrm.url,
+                   "PYTHONPATH": RAIZ + os.pathsep + os.environ.get("PYTHONPATH", "")}
+        salida = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_carga", "--pedidos", ruta_pedidos,
+             "--peticiones", str(peticiones), "--concurrencia", str(concurrencia)],
+            cwd=carpeta, env=entorno, capture_output=True, text=True, check=True,
+        ).stdout
+    return json.loads(salida.strip().splitlines()[-1])
+
+
+def ejecutar(tamano: int, directorio: str, peticiones: int = 2000, concurrencia: int = 8,
+             fraccion_cacheada: float = 0.9) -> dict:
+    carpeta = os.path.join(directorio, f"carga_{tamano}")
+    _, datos = preparar(tamano, carpeta, fraccion_cacheada)
+    pedidos = datos["planificaciones"]["pedido"].drop_duplicates().sample(
+        min(500, tamano), random_state=0).tolist()
+    return {"planificaciones": tamano, **medir(carpeta, pedidos, peticiones, concurrencia)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanos", default="10000,100000")
+    parser.add_argument("--peticiones", type=int, default=2000)
+    parser.add_argument("--concurrencia", type=int, default=8)
+    parser.add_argument("--pedidos", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.pedidos:
+        # Subproceso: una prueba de carga y resultado en JSON por stdout
+        with open(args.pedidos, encoding="utf-8") as f:
+            print(json.dumps(_lanzar(json.load(f), args.peticiones, args.concurrencia)))
+        return
+
+    with tempfile.TemporaryDirectory() as directorio:
+        for tamano in (int(t) for t in args.tamanos.split(",")):
+            print(ejecutar(tamano, directorio, args.peticiones, args.concurrencia))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Benchmark de la matriz de distancias geodésicas y del cargadero más cercano.
+
+Compara el cálculo vectorizado por bloques con un bucle de Python punto a punto
+(sobre una muestra, extrapolado) para maestros sintéticos de distintos tamaños,
+y comprueba que coincide con haversine.
+
+Uso:
+    python -m benchmarks.bench_distancias --tamanos 1000,5000
+"""
+import argparse
+import math
+import time
+from distancias import RADIO_TIERRA_KM, IndiceGeografico, haversine, matriz_distancias
+from benchmarks.synthetic_data import generar_destinos, generar_origenes
+
+
+def _haversine_python(lon1, lat1, lon2, lat2) -> float:
+    lon1, lat1, lon2, lat2 = map(math.radians, (lon1, lat1, lon2, lat2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * math.asin(math.sqrt(a))
+
+
+def ejecutar(tamano: int) -> dict:
+    origenes = generar_origenes(tamano)[["longitud", "latitud"]].to_numpy()
+    destinos = generar_destinos(tamano)[["longitud", "latitud"]].to_numpy()
+
+    inicio = time.perf_counter()
+    matriz = matriz_distancias(origenes, destinos)
+    t_matriz = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    indice = IndiceGeografico(origenes)
+    distancias, _ = indice.consultar(destinos, k=1)
+    t_vecinos = time.perf_counter() - inicio
+
+    # Bucle puro de Python sobre 100 filas, extrapolado a la matriz completa
+    muestra = min(100, tamano)
+    inicio = time.perf_counter()
+    for lon_o, lat_o in origenes[:muestra].tolist():
+        for lon_d, lat_d in destinos.tolist():
+            _haversine_python(lon_o, lat_o, lon_d, lat_d)
+    t_bucle = (time.perf_counter() - inicio) * tamano / muestra
+
+    # El vecino más cercano debe coincidir con el mínimo de la columna de la matriz,
+    # y la matriz con haversine
+    error = max(float(abs(distancias[:, 0] - matriz.min(axis=0)).max()),
+                float(abs(matriz[0] - haversine(*origenes[0], destinos[:, 0], destinos[:, 1])).max()))
+    return {
+        "tamano": tamano,
+        "matriz_s": round(t_matriz, 3),
+        "vecinos_s": round(t_vecinos, 3),
+        "bucle_python_s": round(t_bucle, 2),
+        "error_max_km": round(error, 4),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanos", default="1000,5000")
+    args = parser.parse_args()
+
+    print(f"{'origenes x destinos':>20} {'matriz (s)':>11} {'vecinos (s)':>12} {'bucle (s)':>10} {'error km':>9}")
+    for tamano in (int(t) for t in args.tamanos.split(",")):
+        r = ejecutar(tamano)
+        print(f"{f'{tamano} x {tamano}':>20} {r['matriz_s']:>11} {r['vecinos_s']:>12} "
+              f"{r['bucle_python_s']:>10} {r['error_max_km']:>9}")
+
+
+if __name__ == "__main__":
+    main()
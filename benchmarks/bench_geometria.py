@@ -0,0 +1,71 @@
+"""Benchmark del formato compacto de geometrías de cache_rutas.
+
+Copia la base de datos indicada (por defecto logistica.db), migra sus rutas al
+formato encoded polyline + zlib y compara tamaño de fichero, tiempo de
+decodificación y bytes enviados al navegador por nivel de simplificación.
+
+Uso:
+    python -m benchmarks.bench_geometria --db logistica.db
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from database import DatabaseManager
+from geometry import FORMATO_GEOJSON, NIVELES_SIMPLIFICACION, descomprimir_geometria
+
+
+def _medir_decodificacion(filas, repeticiones=50) -> float:
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        for geometria, formato in filas:
+            descomprimir_geometria(geometria, formato)
+    return (time.perf_counter() - inicio) / (repeticiones * len(filas)) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="logistica.db")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        copia = os.path.join(directorio, "bench.db")
+        shutil.copy(args.db, copia)
+        with sqlite3.connect(copia) as conn:
+            antes = conn.execute("SELECT geometria FROM cache_rutas").fetchall()
+            conn.execute("VACUUM")
+        filas_texto = [(g, FORMATO_GEOJSON) for (g,) in antes]
+        tamano_antes = os.path.getsize(copia)
+
+        db = DatabaseManager(copia)
+        db.crear_tablas_cache()  # migra las filas antiguas
+        db.engine.dispose()
+        with sqlite3.connect(copia) as conn:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute("VACUUM")
+            filas_compactas = conn.execute("SELECT geometria, formato FROM cache_rutas").fetchall()
+            niveles = conn.execute("SELECT nivel, geometria FROM cache_rutas_niveles").fetchall()
+            formato = filas_compactas[0][1]
+        tamano_despues = os.path.getsize(copia)
+
+        print(f"Rutas: {len(filas_compactas)}")
+        print(f"Fichero: {tamano_antes / 1024:.0f} KB -> {tamano_despues / 1024:.0f} KB")
+        print(f"Geometría en BD: {sum(len(g) for g, _ in filas_texto) / 1024:.0f} KB -> "
+              f"{sum(len(g) for g, _ in filas_compactas) / 1024:.0f} KB")
+        print(f"Decodificación por ruta: json.loads {_medir_decodificacion(filas_texto):.3f} ms -> "
+              f"polyline {_medir_decodificacion(filas_compactas):.3f} ms")
+
+        payload = {0: sum(len(json.dumps(descomprimir_geometria(g, f))) for g, f in filas_compactas)}
+        for nivel in NIVELES_SIMPLIFICACION:
+            payload[nivel] = sum(
+                len(json.dumps(descomprimir_geometria(g, formato))) for n, g in niveles if n == nivel
+            )
+        for nivel, tamano in payload.items():
+            print(f"Payload GeoJSON nivel {nivel}: {tamano / 1024:.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
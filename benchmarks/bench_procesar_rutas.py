@@ -0,0 +1,61 @@
+"""Benchmark de ``procesar_rutas``: cruce sin índices frente a lectura indexada.
+
+Uso:
+    python -m benchmarks.bench_procesar_rutas --tamanos 10000,100000,1000000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from database import DatabaseManager
+from process import procesar_rutas
+from benchmarks.synthetic_data import poblar_bd
+
+
+def _medir(funcion, pedidos) -> float:
+    """Mediana en milisegundos de ``funcion(pedido)`` sobre la muestra."""
+    tiempos = []
+    for pedido in pedidos:
+        inicio = time.perf_counter()
+        funcion(pedido)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tiempos)
+
+
+def ejecutar(tamano: int, muestras: int, directorio: str) -> dict:
+    db = DatabaseManager(os.path.join(directorio, f"bench_{tamano}.db"))
+    datos = poblar_bd(db, tamano)
+    pedidos = datos["planificaciones"]["pedido"].sample(muestras, random_state=0).tolist()
+
+    # Sin tabla materializada ni índices: procesar_rutas cae al cruce completo
+    sin_indices = _medir(lambda p: procesar_rutas(p, db), pedidos)
+
+    inicio = time.perf_counter()
+    db.crear_indices()
+    db.refrescar_pedido_coordenadas()
+    refresco = time.perf_counter() - inicio
+    con_indices = _medir(lambda p: procesar_rutas(p, db), pedidos)
+
+    return {
+        "planificaciones": tamano,
+        "join_sin_indices_ms": round(sin_indices, 3),
+        "lectura_indexada_ms": round(con_indices, 3),
+        "aceleracion": round(sin_indices / con_indices, 1),
+        "refresco_s": round(refresco, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanos", default="10000,100000,1000000")
+    parser.add_argument("--muestras", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        for tamano in (int(t) for t in args.tamanos.split(",")):
+            print(ejecutar(tamano, args.muestras, directorio))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Benchmark del informe de km por planta y día: SQLite frente al snapshot columnar.
+
+Para cada tamaño se genera una base sintética con una ruta cacheada por par
+(cargadero, planta), se exporta el snapshot (Parquet e IPC, particionado por
+fecha) y se mide el informe completo y filtrado a una semana en ambos caminos.
+
+Uso:
+    python -m benchmarks.bench_snapshot --tamanos 100000,1000000
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import date
+from database import DatabaseManager
+from router import RouteProvider
+from snapshots import exportar_snapshot, km_por_planta_dia, km_por_planta_dia_sqlite
+from benchmarks.synthetic_data import poblar_bd, poblar_cache_rutas
+
+
+def _medir(funcion, repeticiones=3) -> float:
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return min(tiempos)
+
+
+def ejecutar(tamano: int, directorio: str) -> dict:
+    db = DatabaseManager(os.path.join(directorio, f"snapshot_{tamano}.db"))
+    rp = RouteProvider(db)
+    poblar_bd(db, tamano)
+    poblar_cache_rutas(db, rp, puntos=2)  # una ruta por par (cargadero, planta)
+    semana = [("fecha", ">=", date(2026, 1, 5)), ("fecha", "<", date(2026, 1, 12))]
+
+    resultado = {"planificaciones": tamano}
+    resultado["sqlite_s"] = round(_medir(lambda: km_por_planta_dia_sqlite(db, rp), 1), 3)
+    for formato in ("parquet", "ipc"):
+        destino = os.path.join(directorio, f"snapshot_{tamano}_{formato}")
+        meta = exportar_snapshot(db, rp, destino, formato=formato)
+        resultado[f"{formato}_exportar_s"] = meta["segundos"]
+        resultado[f"{formato}_mb"] = round(meta["bytes"] / 1e6, 1)
+        resultado[f"{formato}_informe_s"] = round(_medir(lambda: km_por_planta_dia(destino)), 3)
+        resultado[f"{formato}_semana_s"] = round(_medir(lambda: km_por_planta_dia(destino, semana)), 3)
+    resultado["aceleracion_parquet"] = round(resultado["sqlite_s"] / resultado["parquet_informe_s"], 1)
+    return resultado
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanos", default="100000,1000000")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        for tamano in (int(t) for t in args.tamanos.split(",")):
+            print(ejecutar(tamano, directorio))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Benchmark de ingesta de planificaciones: JSON completo en memoria frente a streaming.
+
+Genera una respuesta sintética de varios cientos de MB, la sirve con un
+FakeMoplan local y carga cada modo en un subproceso aislado para medir su pico
+de RSS y sus filas/s.
+
+Uso:
+    python -m benchmarks.bench_streaming --registros 400000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def _cargar(modo: str, url: str, db_path: str) -> dict:
+    from data_fetcher import DataFetcher
+    from database import DatabaseManager
+
+    db = DatabaseManager(db_path)
+    fetcher = DataFetcher(base_url=url)
+    inicio = time.perf_counter()
+    if modo == "stream":
+        filas = fetcher.fetch_planificaciones_stream(db)["filas"]
+    else:
+        df = fetcher.fetch_planificaciones()
+        db.guardar_datos(df, "planificaciones", if_exists="upsert", clave="pedido")
+        filas = len(df)
+    segundos = time.perf_counter() - inicio
+    return {
+        "modo": modo,
+        "filas": filas,
+        "segundos": round(segundos, 2),
+        "filas_por_segundo": round(filas / segundos),
+        "pico_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--registros", type=int, default=400000)
+    parser.add_argument("--modo", choices=["dataframe", "stream"], help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.modo:
+        # Subproceso: una sola carga y resultado en JSON por stdout
+        import logging
+        logging.disable(logging.INFO)
+        print(json.dumps(_cargar(args.modo, args.url, args.db)))
+        return
+
+    from benchmarks.fake_servers import FakeMoplan
+    from benchmarks.synthetic_data import escribir_json_planificaciones
+
+    with tempfile.TemporaryDirectory() as directorio:
+        fichero = Path(directorio) / "planificaciones.json"
+        tamano = escribir_json_planificaciones(fichero, args.registros)
+        print(f"Respuesta sintética: {args.registros} registros, {tamano / 1e6:.0f} MB")
+        with FakeMoplan({"p_planificaciones": fichero}) as api:
+            for modo in ("dataframe", "stream"):
+                salida = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.bench_streaming", "--modo", modo,
+                     "--url", api.url, "--db", os.path.join(directorio, f"{modo}.db")],
+                    capture_output=True, text=True, check=True,
+                )
+                print(salida.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""Servidores HTTP simulados (OSRM y API moplan) para pruebas y benchmarks sin red."""
+import json
+import math
+import os
+import shutil
+from pathlib import Path
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_RUTA_OSRM = re.compile(r"^/route/v1/driving/([-\d.]+),([-\d.]+);([-\d.]+),([-\d.]+)")
+
+
+def _haversine_km(lon1, lat1, lon2, lat2) -> float:
+    lon1, lat1, lon2, lat2 = map(math.radians, (lon1, lat1, lon2, lat2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 6371.0088 * 2 * math.asin(math.sqrt(a))
+
+
+class FakeOSRM:
+    """Servidor OSRM falso que responde a ``/route/v1/driving/lon,lat;lon,lat``.
+
+    Devuelve una línea recta con ``puntos`` vértices. Permite simular latencia
+    (``retraso`` en segundos) y fallos transitorios (las primeras ``fallos``
+    peticiones responden 503). Se usa como context manager::
+
+        with FakeOSRM() as osrm:
+            router.base_url = osrm.url
+    """
+
+    def __init__(self, puntos=200, retraso=0.0, fallos=0) -> None:
+        self.puntos = puntos
+        self.retraso = retraso
+        self.fallos = fallos
+        self.peticiones = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/route/v1/driving/"
+
+    def _responder(self, path):
+        with self._lock:
+            self.peticiones += 1
+            fallar = self.peticiones <= self.fallos
+        if self.retraso:
+            time.sleep(self.retraso)
+        if fallar:
+            return 503, {"code": "ServiceUnavailable"}
+        m = _RUTA_OSRM.match(path)
+        if not m:
+            return 400, {"code": "InvalidUrl"}
+        lon1, lat1, lon2, lat2 = map(float, m.groups())
+        n = max(self.puntos, 2)
+        coords = [
+            [round(lon1 + (lon2 - lon1) * i / (n - 1), 6), round(lat1 + (lat2 - lat1) * i / (n - 1), 6)]
+            for i in range(n)
+        ]
+        distancia = _haversine_km(lon1, lat1, lon2, lat2) * 1000 * 1.3
+        return 200, {
+            "code": "Ok",
+            "routes": [{
+                "geometry": {"type": "LineString", "coordinates": coords},
+                "distance": distancia,
+                "duration": distancia / 20,
+            }],
+        }
+
+    def __enter__(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                estado, cuerpo = fake._responder(self.path)
+                datos = json.dumps(cuerpo).encode()
+                self.send_response(estado)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(datos)))
+                self.end_headers()
+                self.wfile.write(datos)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeMoplan:
+    """API moplan falsa: ``POST /login`` y ``PUT /proc/<procedimiento>``.
+
+    ``datos`` asocia cada procedimiento (p.ej. ``p_planificaciones``) con la
+    lista de registros a devolver, con bytes ya serializados o con la ruta
+    (``pathlib.Path``) de un fichero JSON que se envía por trozos. Permite simular
+    latencia por petición, fallos transitorios (503 en las primeras ``fallos``
+    peticiones a /proc) y caducidad del token tras ``token_valido_para``
+    peticiones (respondiendo 401 hasta un nuevo login).
+    """
+
+    def __init__(self, datos: dict, retraso=0.0, fallos=0, token_valido_para=None) -> None:
+        self.datos = datos
+        self.retraso = retraso
+        self.fallos = fallos
+        self.token_valido_para = token_valido_para
+        self.logins = 0
+        self.peticiones = 0
+        self._usos_token = 0
+        self._token = None
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def _login(self):
+        with self._lock:
+            self.logins += 1
+            self._token = f"token-{self.logins}"
+            self._usos_token = 0
+            return 200, json.dumps({"token": self._token}).encode()
+
+    def _proc(self, path, autorizacion):
+        with self._lock:
+            self.peticiones += 1
+            fallar = self.peticiones <= self.fallos
+            valido = self._token is not None and autorizacion == f"Bearer {self._token}"
+            if valido:
+                self._usos_token += 1
+                if self.token_valido_para is not None and self._usos_token > self.token_valido_para:
+                    self._token = None
+                    valido = False
+        if self.retraso:
+            time.sleep(self.retraso)
+        if not valido:
+            return 401, b'{"error": "token"}'
+        if fallar:
+            return 503, b'{"error": "no disponible"}'
+        datos = self.datos.get(path.rsplit("/", 1)[-1])
+        if datos is None:
+            return 404, b"[]"
+        if isinstance(datos, (bytes, Path)):
+            return 200, datos
+        return 200, json.dumps(datos).encode()
+
+    def __enter__(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _enviar(self, estado, cuerpo):
+                es_fichero = isinstance(cuerpo, Path)
+                self.send_response(estado)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(os.path.getsize(cuerpo) if es_fichero else len(cuerpo)))
+                self.end_headers()
+                if es_fichero:
+                    with open(cuerpo, "rb") as f:
+                        shutil.copyfileobj(f, self.wfile, 1024 * 1024)
+                else:
+                    self.wfile.write(cuerpo)
+
+            def _leer_cuerpo(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def do_POST(self):
+                self._leer_cuerpo()
+                self._enviar(*fake._login() if self.path == "/login" else (404, b"{}"))
+
+            def do_PUT(self):
+                self._leer_cuerpo()
+                self._enviar(*fake._proc(self.path, self.headers.get("Authorization")))
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
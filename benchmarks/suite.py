@@ -0,0 +1,222 @@
+"""Suite de benchmarks de los caminos críticos: rutas, lectura de pedidos, guardado y ETL.
+
+Para cada tamaño genera una base sintética (maestros, planificaciones y
+cache_rutas con una parte de los pares sin ruta) y mide:
+
+* ``RouteProvider.get_route``: acierto en memoria, acierto en cache_rutas y
+  fallo resuelto contra un FakeOSRM local.
+* ``coordenadas_pedido`` / ``procesar_rutas`` y la decodificación de geometrías.
+* ``guardar_datos`` (replace y upsert) e ``integrar_datos`` contra un FakeMoplan.
+* La prueba de carga de ``actualizar_mapa`` (``benchmarks/bench_carga.py``).
+
+Los resultados se guardan en JSON junto con el commit, para comparar entre
+versiones con ``--comparar``.
+
+Uso:
+    python -m benchmarks.suite --tamanos 10000,100000 --salida resultados.json
+    python -m benchmarks.suite --tamanos 10000 --comparar resultados.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from sqlalchemy import text
+from database import DatabaseManager
+from geometry import descomprimir_geometria
+from process import coordenadas_pedido, procesar_rutas
+from router import RouteProvider
+from benchmarks import bench_carga
+from benchmarks.fake_servers import FakeMoplan, FakeOSRM
+from benchmarks.synthetic_data import LAT_MAX, LAT_MIN, LON_MAX, LON_MIN, datos_moplan, poblar_cache_rutas
+
+# Por debajo de este cambio relativo una diferencia se considera ruido al comparar
+UMBRAL_COMPARACION = 0.10
+# Claves de los resultados que describen la ejecución, no miden nada
+PARAMETROS = {"planificaciones", "carga_peticiones", "carga_concurrencia"}
+
+
+def _mediana(funcion, argumentos, escala=1000) -> float:
+    """Mediana de ``funcion(*args)`` para cada ``args`` de la muestra (ms por defecto)."""
+    tiempos = []
+    for args in argumentos:
+        inicio = time.perf_counter()
+        funcion(*args)
+        tiempos.append(time.perf_counter() - inicio)
+    return round(statistics.median(tiempos) * escala, 3)
+
+
+def _segundos(funcion) -> float:
+    inicio = time.perf_counter()
+    funcion()
+    return round(time.perf_counter() - inicio, 3)
+
+
+def medir_rutas(db, pares: list, muestras: int) -> dict:
+    pares = pares[:muestras]
+    with FakeOSRM() as osrm:
+        rp = RouteProvider(db)
+        rp.base_url = osrm.url
+        resultado = {}
+        # Acierto en cache_rutas: se invalida la entrada de memoria antes de cada lectura
+        def _desde_sqlite(*par):
+            rp.cache.invalidar(rp._generar_id_ruta(*par))
+            rp.get_route(*par)
+        resultado["get_route_sqlite_ms"] = _mediana(_desde_sqlite, pares)
+        resultado["get_route_memoria_us"] = _mediana(rp.get_route, pares, escala=1e6)
+        # Fallos: pares nuevos, cada uno una petición a OSRM más su guardado
+        rng = random.Random(0)
+        nuevos = [(rng.uniform(LON_MIN, LON_MAX), rng.uniform(LAT_MIN, LAT_MAX),
+                   rng.uniform(LON_MIN, LON_MAX), rng.uniform(LAT_MIN, LAT_MAX)) for _ in pares]
+        resultado["get_route_osrm_ms"] = _mediana(rp.get_route, nuevos)
+    with db.read_engine.connect() as conn:
+        geometrias = conn.execute(text("SELECT geometria, formato FROM cache_rutas LIMIT :n"),
+                                  {"n": muestras}).all()
+    resultado["decodificar_geometria_us"] = _mediana(descomprimir_geometria, geometrias, escala=1e6)
+    return resultado
+
+
+def medir_pedidos(db, pedidos: list) -> dict:
+    argumentos = [(p, db) for p in pedidos]
+    return {"coordenadas_pedido_ms": _mediana(coordenadas_pedido, argumentos),
+            "procesar_rutas_ms": _mediana(procesar_rutas, argumentos)}
+
+
+def medir_guardado(db, datos: dict) -> dict:
+    planificaciones = datos["planificaciones"].drop_duplicates("pedido")
+    modificadas = planificaciones.copy()
+    cambios = modificadas.sample(frac=0.01, random_state=0).index
+    modificadas.loc[cambios, "estado"] = "ANULADO"
+    return {
+        "guardar_replace_s": _segundos(lambda: db.guardar_datos(planificaciones, "planificaciones")),
+        "guardar_upsert_sin_cambios_s": _segundos(lambda: db.guardar_datos(
+            planificaciones, "planificaciones", if_exists="upsert", clave="pedido")),
+        "guardar_upsert_1pct_s": _segundos(lambda: db.guardar_datos(
+            modificadas, "planificaciones", if_exists="upsert", clave="pedido")),
+    }
+
+
+def medir_etl(datos: dict, directorio: str) -> dict:
+    """``integrar_datos`` contra FakeMoplan: carga inicial, repetición sin cambios y 1 % cambiado."""
+    from data_fetcher import DataFetcher
+    from main_interfaz_datos import integrar_datos
+
+    db = DatabaseManager(os.path.join(directorio, "etl.db"))
+    # Las rutas ya están en caché: se mide la ETL, no el precálculo contra OSRM
+    for tabla, df in datos.items():
+        db.guardar_datos(df, tabla)
+    poblar_cache_rutas(db, RouteProvider(db), puntos=2)
+    # Solo queda una planificación: la primera ejecución las carga todas
+    db.guardar_datos(datos["planificaciones"].head(1), "planificaciones")
+
+    respuestas = datos_moplan(datos)
+    url_osrm = os.environ.get("OSRM_BASE_URL")
+    with FakeMoplan(respuestas) as api, FakeOSRM() as osrm:
+        os.environ["OSRM_BASE_URL"] = osrm.url
+        try:
+            fetcher = DataFetcher(base_url=api.url)
+            resultado = {"etl_carga_s": integrar_datos(fetcher=fetcher, db=db)["segundos"],
+                         "etl_sin_cambios_s": integrar_datos(fetcher=fetcher, db=db)["segundos"]}
+            for registro in respuestas["p_planificaciones"][::100]:
+                registro["estado"] = "ANULADO"
+            resultado["etl_1pct_s"] = integrar_datos(fetcher=fetcher, db=db)["segundos"]
+        finally:
+            if url_osrm is None:
+                os.environ.pop("OSRM_BASE_URL")
+            else:
+                os.environ["OSRM_BASE_URL"] = url_osrm
+    return resultado
+
+
+def ejecutar(tamano: int, directorio: str, muestras: int = 200, peticiones: int = 2000,
+             concurrencia: int = 8, fraccion_cacheada: float = 0.9) -> dict:
+    carpeta = os.path.join(directorio, f"suite_{tamano}")
+    inicio = time.perf_counter()
+    db, datos = bench_carga.preparar(tamano, carpeta, fraccion_cacheada)
+    resultado = {"planificaciones": tamano, "preparacion_s": round(time.perf_counter() - inicio, 2)}
+    pedidos = datos["planificaciones"]["pedido"].drop_duplicates().sample(
+        min(muestras, tamano), random_state=0).tolist()
+
+    # Primero la carga: las medidas siguientes modifican la base
+    carga = bench_carga.medir(carpeta, pedidos, peticiones, concurrencia)
+    resultado.update({f"carga_{k}": v for k, v in carga.items()})
+    with db.read_engine.connect() as conn:
+        pares = [tuple(f) for f in conn.execute(text(
+            "SELECT lon_origen, lat_origen, lon_destino, lat_destino FROM cache_rutas ORDER BY route_id"))]
+    resultado.update(medir_rutas(db, pares, muestras))
+    resultado.update(medir_pedidos(db, pedidos))
+    resultado.update(medir_guardado(db, datos))
+    carpeta_etl = os.path.join(carpeta, "etl")
+    os.makedirs(carpeta_etl, exist_ok=True)
+    resultado.update(medir_etl(datos, carpeta_etl))
+    return resultado
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=bench_carga.RAIZ,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconocido"
+
+
+def comparar(anterior: dict, actual: dict) -> list:
+    """Líneas con el cambio de cada métrica común a dos ficheros de resultados.
+
+    Todas las métricas son tiempos o conteos (menos es mejor) salvo
+    ``peticiones_por_segundo``. Los parámetros de la ejecución no se comparan.
+    """
+    previos = {r["planificaciones"]: r for r in anterior["resultados"]}
+    lineas = [f"{anterior['commit']} -> {actual['commit']}"]
+    for resultado in actual["resultados"]:
+        previo = previos.get(resultado["planificaciones"])
+        if previo is None:
+            continue
+        for clave, valor in resultado.items():
+            base = previo.get(clave)
+            if clave in PARAMETROS or not isinstance(valor, (int, float)) or not base:
+                continue
+            cambio = (valor - base) / base
+            peor = cambio < 0 if "por_segundo" in clave else cambio > 0
+            marca = "" if abs(cambio) < UMBRAL_COMPARACION else (" PEOR" if peor else " mejor")
+            lineas.append(f"{resultado['planificaciones']:>9} {clave:<32} {base:>10} -> {valor:<10}"
+                          f" ({cambio:+.0%}){marca}")
+    return lineas
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanos", default="10000,100000")
+    parser.add_argument("--muestras", type=int, default=200)
+    parser.add_argument("--peticiones", type=int, default=2000)
+    parser.add_argument("--concurrencia", type=int, default=8)
+    parser.add_argument("--salida", help="fichero JSON para los resultados")
+    parser.add_argument("--comparar", help="fichero JSON de una ejecución anterior")
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.WARNING)
+    informe = {"commit": _commit(), "fecha": datetime.now().isoformat(timespec="seconds"),
+               "python": platform.python_version(), "plataforma": platform.platform(),
+               "cpus": os.cpu_count(), "resultados": []}
+    with tempfile.TemporaryDirectory() as directorio:
+        for tamano in (int(t) for t in args.tamanos.split(",")):
+            resultado = ejecutar(tamano, directorio, args.muestras, args.peticiones, args.concurrencia)
+            print(resultado)
+            informe["resultados"].append(resultado)
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(informe, f, indent=2)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            print("\n".join(comparar(json.load(f), informe)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Generador de datos sintéticos con la forma de las tablas de la API moplan."""
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# Caja aproximada de la península ibérica
+LON_MIN, LON_MAX = -9.0, 3.0
+LAT_MIN, LAT_MAX = 36.5, 43.5
+
+
+def generar_origenes(n: int, seed: int = 0) -> pd.DataFrame:
+    """Maestro de cargaderos (``maestro_origenes``)."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "codigo": [f"C{i:05d}" for i in range(n)],
+        "nombre": [f"Cargadero {i}" for i in range(n)],
+        "longitud": rng.uniform(LON_MIN, LON_MAX, n).round(6),
+        "latitud": rng.uniform(LAT_MIN, LAT_MAX, n).round(6),
+    })
+
+
+def generar_destinos(n: int, seed: int = 1) -> pd.DataFrame:
+    """Maestro de plantas (``maestro_destinos``)."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "codigoPlanta": [f"{i:010d}" for i in range(n)],
+        "planta": [f"Planta {i}" for i in range(n)],
+        "longitud": rng.uniform(LON_MIN, LON_MAX, n).round(6),
+        "latitud": rng.uniform(LAT_MIN, LAT_MAX, n).round(6),
+    })
+
+
+def generar_planificaciones(n: int, n_origenes: int, n_destinos: int, dias: int = 30,
+                            seed: int = 2) -> pd.DataFrame:
+    """Planificaciones que referencian cargaderos y plantas existentes.
+
+    Aproximadamente un 10 % de los pedidos tienen más de una planificación.
+    """
+    rng = np.random.default_rng(seed)
+    pedidos = rng.integers(0, max(1, int(n * 0.9)), n)
+    fechas = pd.Timestamp("2026-01-01") + pd.to_timedelta(rng.integers(0, dias, n), unit="D")
+    return pd.DataFrame({
+        "pedido": pd.Series(pedidos).map(lambda p: f"28{p:011d}"),
+        "codigoCargadero": pd.Series(rng.integers(0, n_origenes, n)).map(lambda i: f"C{i:05d}"),
+        "codigoPlanta": pd.Series(rng.integers(0, n_destinos, n)).map(lambda i: f"{i:010d}"),
+        "fechaPrevista": fechas.strftime("%d/%m/%Y"),
+        "estado": rng.choice(["PLANIFICADO", "CARGADO", "ENTREGADO"], n),
+        "cantidadProgramada": rng.integers(5, 30, n).astype(str),
+    })
+
+
+def poblar_bd(db_manager, n_planificaciones: int, n_origenes: int = 200, n_destinos: int = 2000) -> dict:
+    """Carga maestros y planificaciones sintéticos en ``db_manager`` (modo replace)."""
+    datos = {
+        "maestro_origenes": generar_origenes(n_origenes),
+        "maestro_destinos": generar_destinos(n_destinos),
+        "planificaciones": generar_planificaciones(n_planificaciones, n_origenes, n_destinos),
+    }
+    for tabla, df in datos.items():
+        db_manager.guardar_datos(df, tabla)
+    return datos
+
+
+def poblar_cache_rutas(db_manager, route_provider, fraccion: float = 1.0, puntos: int = 100, seed: int = 3) -> int:
+    """Inserta en cache_rutas rutas ficticias (sin OSRM) para los pares de ``pedido_coordenadas``.
+
+    Args:
+        fraccion: parte de los pares distintos que queda cacheada; el resto
+            serán fallos de caché.
+        puntos: vértices de cada geometría. El coste de guardarlas crece con
+            ellos (simplificación de los niveles en ``guardar_rutas``).
+    Returns:
+        Número de rutas guardadas.
+    """
+    db_manager.crear_indices()
+    db_manager.refrescar_pedido_coordenadas()
+    with db_manager.read_engine.connect() as conn:
+        pares = conn.exec_driver_sql("""
+        SELECT DISTINCT longitud_origen, latitud_origen, longitud_destino, latitud_destino
+        FROM pedido_coordenadas WHERE longitud_origen IS NOT NULL AND longitud_destino IS NOT NULL
+        ORDER BY 1, 2, 3, 4
+        """).all()
+    rng = np.random.default_rng(seed)
+    pares = [par for par, elegido in zip(pares, rng.random(len(pares)) < fraccion) if elegido]
+    pasos = np.linspace(0.0, 1.0, max(puntos, 2))
+    rutas = []
+    for i, (lon1, lat1, lon2, lat2) in enumerate(pares):
+        # Curva suave entre los extremos, como una carretera: los niveles
+        # simplificados se quedan con una parte de los vértices
+        desvio = rng.uniform(0.02, 0.2) * np.sin(np.pi * rng.integers(1, 4) * pasos)
+        coords = np.column_stack([lon1 + (lon2 - lon1) * pasos - (lat2 - lat1) * desvio,
+                                  lat1 + (lat2 - lat1) * pasos + (lon2 - lon1) * desvio])
+        rutas.append({
+            "route_id": route_provider._generar_id_ruta(lon1, lat1, lon2, lat2),
+            "geometria": {"type": "LineString", "coordinates": coords.round(6).tolist()},
+            "distancia_km": round(100 + i % 400, 1), "duracion_min": round(60 + i % 300, 1),
+            "updated_at": datetime.now(), "extremos": (lon1, lat1, lon2, lat2),
+        })
+    return route_provider.guardar_rutas(rutas)
+
+
+def datos_moplan(datos: dict) -> dict:
+    """Respuestas de FakeMoplan (registros con valores de texto, como la API) para ``poblar_bd``."""
+    procedimientos = {"maestro_origenes": "p_manCargaderos", "maestro_destinos": "p_manPlantas",
+                      "planificaciones": "p_planificaciones"}
+    return {procedimientos[tabla]: df.astype(str).to_dict("records") for tabla, df in datos.items()}
+
+
+# Campos de texto adicionales para aproximar el tamaño real de una planificación
+_CAMPOS_EXTRA = ["observaciones", "conductor", "tractora", "cisterna", "albaran", "horario",
+                 "pactoCliente", "titulo", "producto", "poblacionPlanta", "planta", "cargadero"]
+
+
+def escribir_json_planificaciones(path, n: int, tamano_bloque: int = 20000) -> int:
+    """Escribe en ``path`` un array JSON con ``n`` planificaciones sin tenerlas todas en memoria.
+
+    Returns:
+        Tamaño del fichero en bytes.
+    """
+    import json
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[")
+        for bloque, inicio in enumerate(range(0, n, tamano_bloque)):
+            df = generar_planificaciones(min(tamano_bloque, n - inicio), 200, 2000, seed=bloque)
+            for campo in _CAMPOS_EXTRA:
+                df[campo] = f"{campo} de prueba " * 3
+            texto = json.dumps(df.to_dict("records"), ensure_ascii=False)[1:-1]
+            f.write(("," if inicio else "") + texto)
+        f.write("]")
+        return f.tell()
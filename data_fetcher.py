@@ -1,6 +1,16 @@
+import codecs
+import hashlib
+import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
+from sqlalchemy.types import Text
 from datetime import datetime
 from dotenv import load_dotenv
 from logger import setup_logger
@@ -18,12 +28,118 @@ logger = setup_logger("data_fetcher")
 # Cargar credenciales
 load_dotenv()
 
+# Tipo explícito de las columnas cargadas en streaming (la API devuelve texto)
+TipoTexto = Text()
+
+
+def iterar_registros_json(trozos):
+    """Decodifica de forma incremental un array JSON de objetos.
+
+    Args:
+        trozos: iterable de bytes (p.ej. ``response.iter_content()``).
+    Yields:
+        Cada elemento del array ya decodificado, sin cargar el cuerpo completo.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    pos = 0
+    dentro = False
+    for trozo in trozos:
+        buffer = buffer[pos:] + utf8.decode(trozo)
+        pos = 0
+        while True:
+            # Saltamos espacios y separadores entre elementos
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not dentro:
+                if buffer[pos] != "[":
+                    raise ValueError("Se esperaba un array JSON en la respuesta.")
+                dentro = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                registro, fin = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # registro incompleto: esperamos al siguiente trozo
+            yield registro
+            pos = fin
+    if dentro:
+        raise ValueError("Respuesta JSON truncada.")
+
+
+def lotes_dataframe(registros, tamano_lote: int):
+    """Agrupa registros en DataFrames de texto de ``tamano_lote`` filas.
+
+    Las columnas se fijan con el primer registro; los valores se convierten a
+    texto (o None) para que todos los lotes tengan el mismo esquema.
+    """
+    columnas = None
+    lote = []
+    for registro in registros:
+        if columnas is None:
+            columnas = list(registro)
+        lote.append(registro)
+        if len(lote) >= tamano_lote:
+            yield _lote_a_texto(lote, columnas)
+            lote = []
+    if lote:
+        yield _lote_a_texto(lote, columnas)
+
+
+def huella_contenido(datos=b"") -> "hashlib.blake2b":
+    """Hash incremental (blake2b de 128 bits) del cuerpo de una respuesta."""
+    return hashlib.blake2b(datos, digest_size=16)
+
+
+def _lote_a_texto(lote: list, columnas: list) -> pd.DataFrame:
+    filas = [[None if r.get(c) is None else str(r[c]) for c in columnas] for r in lote]
+    return pd.DataFrame(filas, columns=columnas, dtype=object)
+
+
+@dataclass
+class ResultadoDescarga:
+    """Resultado de descargar un endpoint de la API moplan."""
+    nombre: str
+    df: pd.DataFrame
+    segundos: float
+    intentos: int = 0
+    error: Optional[str] = None
+    # Hash del cuerpo de la respuesta: si no cambia entre ejecuciones, la tabla no se toca
+    huella: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
 class DataFetcher:
-    def __init__(self):
-        self.base_url = "https://moplan.esk.es:8082"
+    # Procedimientos de la API por tipo de dato
+    ENDPOINTS = {
+        "cargaderos": "/proc/p_manCargaderos",
+        "destinos": "/proc/p_manPlantas",
+        "planificaciones": "/proc/p_planificaciones",
+    }
+    # Conexiones simultáneas como máximo: fetch_all de todos los endpoints, la
+    # descarga en streaming de planificaciones y un re-login a la vez
+    POOL_CONEXIONES = len(ENDPOINTS) + 2
+
+    def __init__(self, base_url=None, reintentos=3, backoff=1.0, timeout=15):
+        self.base_url = base_url or os.getenv("MOPLAN_BASE_URL", "https://moplan.esk.es:8082")
         self.user = os.getenv("API_USER")
         self.password = os.getenv("API_PASSWORD")
+        self.reintentos = reintentos
+        self.backoff = backoff
+        self.timeout = timeout
         self.session = requests.Session()
+        # Pool suficiente para que ninguna descarga espere ni abra conexiones sin reutilizar
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=self.POOL_CONEXIONES))
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=self.POOL_CONEXIONES))
+        self._login_lock = threading.Lock()
         self.token = None
         self.headers = {
             "Content-Type": "application/json",
@@ -58,61 +174,13 @@ class DataFetcher:
         """Obtiene el maestro de destinos.
         returns: pd.DataFrame con los datos de destinos.
         """
-        if not self.token:
-            if not self.login():
-                return pd.DataFrame()
-
-        url = f"{self.base_url}/proc/p_manPlantas"
-        payload = {"accion": "SELECT_INICIO"}
-
-        try:
-            # Usamos PUT como identificaste en el navegador
-            response = self.session.put(url, json=payload, headers=self.headers, timeout=15,verify=False)
-            response.raise_for_status()
-            
-            # Convertimos la respuesta JSON directamente a DataFrame
-            df = pd.DataFrame(response.json())
-            
-            if not df.empty:
-                logger.info(f"[{datetime.now()}] Se han recuperado {len(df)} registros de destinos.")
-                return self._clean_plantas_data(df)
-            else:
-                logger.info("La API devolvió una lista vacía.")
-                return df
-
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error al obtener los destinos: {e}")
-            return pd.DataFrame()   
+        return self._fetch_dataframe("destinos")
 
     def fetch_cargaderos(self) -> pd.DataFrame:
         """Obtiene el maestro de cargaderos.
         returns: pd.DataFrame con los datos de cargaderos.
         """
-        if not self.token:
-            if not self.login():
-                return pd.DataFrame()
-
-        url = f"{self.base_url}/proc/p_manCargaderos"
-        payload = {"accion": "SELECT_INICIO"}
-
-        try:
-            # Usamos PUT como identificaste en el navegador
-            response = self.session.put(url, json=payload, headers=self.headers, timeout=15,verify=False)
-            response.raise_for_status()
-            
-            # Convertimos la respuesta JSON directamente a DataFrame
-            df = pd.DataFrame(response.json())
-            
-            if not df.empty:
-                logger.info(f"[{datetime.now()}] Se han recuperado {len(df)} registros de cargaderos.")
-                return self._clean_plantas_data(df)
-            else:
-                logger.info("La API devolvió una lista vacía.")
-                return df
-
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error al obtener cargaderos: {e}")
-            return pd.DataFrame()
+        return self._fetch_dataframe("cargaderos")
 
     def _clean_plantas_data(self, df) -> pd.DataFrame:
         """Limpieza inicial de datos (tipos y coordenadas).
@@ -131,32 +199,139 @@ class DataFetcher:
         return df
         
     def fetch_planificaciones(self) -> pd.DataFrame:
-        """Obtiene el maestro de cargaderos."""
+        """Obtiene las planificaciones."""
+        return self._fetch_dataframe("planificaciones")
+
+    def _fetch_dataframe(self, nombre: str) -> pd.DataFrame:
+        """Descarga un endpoint y devuelve un DataFrame vacío si falla (comportamiento histórico)."""
         if not self.token:
             if not self.login():
                 return pd.DataFrame()
+        return self._descargar(nombre).df
+
+    def _put(self, nombre: str, stream=False):
+        """PUT a un procedimiento con reintentos, backoff y re-login ante 401.
 
-        url = f"{self.base_url}/proc/p_planificaciones"
+        Returns:
+            tuple (registros JSON, número de intentos, huella del cuerpo). Con
+            ``stream=True`` se devuelve la respuesta sin leer el cuerpo en lugar
+            de los registros, y sin huella.
+        Raises:
+            requests.exceptions.RequestException si se agotan los reintentos.
+        """
+        url = f"{self.base_url}{self.ENDPOINTS[nombre]}"
         payload = {"accion": "SELECT_INICIO"}
+        for intento in range(1, self.reintentos + 2):
+            token_usado = self.token
+            try:
+                # Usamos PUT como identificaste en el navegador
+                response = self.session.put(url, json=payload, headers=dict(self.headers),
+                                            timeout=self.timeout, verify=False, stream=stream)
+                if response.status_code == 401:
+                    response.close()
+                    # Token caducado: un único hilo renueva el login y el resto lo reutiliza
+                    with self._login_lock:
+                        if self.token == token_usado and not self.login():
+                            response.raise_for_status()
+                    if intento <= self.reintentos:
+                        continue
+                response.raise_for_status()
+                if stream:
+                    return response, intento, None
+                return response.json(), intento, huella_contenido(response.content).hexdigest()
+            except requests.exceptions.RequestException as e:
+                status = getattr(e.response, "status_code", None)
+                reintentable = status is None or status >= 500 or status in (401, 429)
+                if not reintentable or intento > self.reintentos:
+                    raise
+                espera = self.backoff * (2 ** (intento - 1))
+                logger.warning(f"Reintentando {nombre} en {espera:.2f}s ({e})")
+                time.sleep(espera)
+        raise requests.exceptions.RetryError(f"Reintentos agotados para {nombre}")
 
+    def _descargar(self, nombre: str) -> "ResultadoDescarga":
+        inicio = time.perf_counter()
         try:
-            # Usamos PUT como identificaste en el navegador
-            response = self.session.put(url, json=payload, headers=self.headers, timeout=15,verify=False)
-            response.raise_for_status()
-            
-            # Convertimos la respuesta JSON directamente a DataFrame
-            df = pd.DataFrame(response.json())
-            
-            if not df.empty:
-                logger.info(f"[{datetime.now()}] Se han recuperado {len(df)} registros de planificaciones.")
-                return df
-            else:
-                logger.info("La API devolvió una lista vacía.")
-                return df
+            registros, intentos, huella = self._put(nombre)
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error al obtener {nombre}: {e}")
+            return ResultadoDescarga(nombre, pd.DataFrame(), time.perf_counter() - inicio, error=str(e))
 
+        # Convertimos la respuesta JSON directamente a DataFrame
+        df = pd.DataFrame(registros)
+        if not df.empty:
+            logger.info(f"[{datetime.now()}] Se han recuperado {len(df)} registros de {nombre}.")
+            if nombre in ("cargaderos", "destinos"):
+                df = self._clean_plantas_data(df)
+        else:
+            logger.info("La API devolvió una lista vacía.")
+        return ResultadoDescarga(nombre, df, time.perf_counter() - inicio, intentos, huella=huella)
+
+    def fetch_planificaciones_stream(self, db_manager, tamano_lote=5000, clave="pedido"):
+        """Descarga las planificaciones en streaming y las vuelca a SQLite por lotes.
+
+        El cuerpo de la respuesta se lee por trozos y se decodifica registro a
+        registro; cada ``tamano_lote`` registros se construye un DataFrame de
+        texto y se entrega a ``DatabaseManager.guardar_por_lotes``. El pico de
+        memoria depende del tamaño del lote y no del tamaño total de la respuesta.
+
+        Returns:
+            dict de resumen de ``guardar_por_lotes`` o None si falla.
+        """
+        if not self.token and not self.login():
+            return None
+        try:
+            response, _, _ = self._put("planificaciones", stream=True)
         except requests.exceptions.RequestException as e:
             logger.error(f"Error al obtener planificaciones: {e}")
-            return pd.DataFrame()
+            return None
+
+        inicio = time.perf_counter()
+        huella = huella_contenido()
+
+        def _trozos():
+            for trozo in response.iter_content(chunk_size=64 * 1024):
+                huella.update(trozo)
+                yield trozo
+
+        with response:
+            registros = iterar_registros_json(_trozos())
+            resumen = db_manager.guardar_por_lotes(
+                lotes_dataframe(registros, tamano_lote), "planificaciones", clave, dtype=TipoTexto,
+                huella=lambda: huella.hexdigest()
+            )
+        if resumen:
+            segundos = time.perf_counter() - inicio
+            logger.info(
+                f"[{datetime.now()}] Se han recuperado {resumen['filas']} registros de planificaciones "
+                f"en streaming ({resumen['filas'] / segundos:.0f} filas/s)."
+            )
+        return resumen
+
+    def fetch_all(self, nombres=None) -> dict:
+        """Descarga cargaderos, destinos y planificaciones en paralelo.
+
+        Hace login una sola vez y lanza las tres peticiones a la vez sobre la
+        sesión compartida, de modo que el tiempo total es aproximadamente el del
+        endpoint más lento.
+
+        Args:
+            nombres: subconjunto de ``ENDPOINTS`` a descargar (por defecto todos).
+        Returns:
+            dict nombre -> ResultadoDescarga (con el DataFrame, los segundos y el error si lo hubo).
+        """
+        nombres = list(nombres or self.ENDPOINTS)
+        inicio = time.perf_counter()
+        if not self.token and not self.login():
+            return {
+                nombre: ResultadoDescarga(nombre, pd.DataFrame(), 0.0, 0, "Error en el login")
+                for nombre in nombres
+            }
+        with ThreadPoolExecutor(max_workers=len(nombres)) as pool:
+            resultados = dict(zip(nombres, pool.map(self._descargar, nombres)))
+        tiempos = ", ".join(f"{r.nombre}={r.segundos:.2f}s" for r in resultados.values())
+        logger.info(f"Descarga completa en {time.perf_counter() - inicio:.2f}s ({tiempos}).")
+        return resultados
 
 # Ejemplo de uso rápido para probar el módulo
 if __name__ == "__main__":
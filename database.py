@@ -1,46 +1,633 @@
-from sqlalchemy import create_engine, text
-import pandas as pd
+import json
+import os
+import threading
+import time
+from sqlalchemy import create_engine, event, text
+from typing import TYPE_CHECKING
+from sqlalchemy.exc import OperationalError
+from geometry import FORMATO_GEOJSON, comprimir_geometria, niveles_simplificados
 from logger import setup_logger
+from metrics import ETL_FILAS, SQLITE_SEGUNDOS
+
+if TYPE_CHECKING:
+    # pandas (~0.5 s y decenas de MB) solo se importa en las funciones de la ETL
+    # que lo usan: el dashboard no lo necesita para arrancar
+    import pandas as pd
 
 logger = setup_logger("database_manager")
 
+# Columna de planificaciones por la que cada tabla de la ETL afecta a pedido_coordenadas
+COLUMNAS_CRUCE = {
+    "planificaciones": "pedido",
+    "maestro_origenes": "codigoCargadero",
+    "maestro_destinos": "codigoPlanta",
+}
+
+# Engines compartidos por todo el proceso, indexados por (ruta absoluta, solo_lectura)
+_ENGINES = {}
+_ENGINES_LOCK = threading.Lock()
+
+# Pragmas aplicados a cada conexión nueva. WAL permite que los lectores del
+# dashboard sigan consultando mientras la ETL escribe.
+PRAGMAS_SQLITE = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": "NORMAL",
+    "cache_size": -16000,           # ~16 MB de caché de páginas por conexión
+    "mmap_size": 128 * 1024 * 1024,  # lecturas vía memoria compartida del SO
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,            # ms de espera ante bloqueos en vez de fallar
+}
+
+
+def _aplicar_pragmas(dbapi_conn, solo_lectura: bool) -> None:
+    # Sin transacciones implícitas de pysqlite: SQLAlchemy emite BEGIN (ver "begin"),
+    # así el DDL (CREATE/DROP/RENAME) también queda dentro de la transacción.
+    dbapi_conn.isolation_level = None
+    cursor = dbapi_conn.cursor()
+    for pragma, valor in PRAGMAS_SQLITE.items():
+        cursor.execute(f"PRAGMA {pragma}={valor}")
+    if solo_lectura:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+def get_engine(db_name="logistica.db", solo_lectura=False):
+    """Devuelve el engine compartido del proceso para ``db_name``.
+
+    Se crea una sola vez por proceso (y por modo lectura/escritura) con un pool
+    de conexiones apto para los hilos de Gunicorn. El engine de solo lectura
+    rechaza cualquier escritura (``PRAGMA query_only``).
+    """
+    clave = (os.path.abspath(db_name), solo_lectura)
+    with _ENGINES_LOCK:
+        engine = _ENGINES.get(clave)
+        if engine is None:
+            engine = create_engine(
+                f"sqlite:///{db_name}",
+                pool_size=5,
+                max_overflow=10,
+                connect_args={"check_same_thread": False, "timeout": 5},
+            )
+            event.listen(engine, "connect", lambda conn, _: _aplicar_pragmas(conn, solo_lectura))
+            event.listen(engine, "begin", lambda conn: conn.exec_driver_sql("BEGIN"))
+            _instrumentar(engine, "lectura" if solo_lectura else "escritura")
+            _ENGINES[clave] = engine
+        return engine
+
+
+def _instrumentar(engine, motor: str) -> None:
+    """Registra la duración de cada sentencia en ``geo_sqlite_consulta_segundos``."""
+    def antes(conn, cursor, statement, parameters, context, executemany):
+        conn.info["inicio_consulta"] = time.perf_counter()
+
+    def despues(conn, cursor, statement, parameters, context, executemany):
+        sentencia = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+        SQLITE_SEGUNDOS.observe(time.perf_counter() - conn.info["inicio_consulta"], motor=motor, sentencia=sentencia)
+
+    event.listen(engine, "before_cursor_execute", antes)
+    event.listen(engine, "after_cursor_execute", despues)
+
+
+def _reiniciar_pools_tras_fork() -> None:
+    # Las conexiones SQLite no deben compartirse entre procesos (preload de Gunicorn)
+    for engine in _ENGINES.values():
+        engine.dispose(close=False)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reiniciar_pools_tras_fork)
+
 
 class DatabaseManager:
     def __init__(self, db_name="logistica.db") -> None:
-        # Creamos la conexión a SQLite (el archivo se creará automáticamente)
-        self.engine = create_engine(f"sqlite:///{db_name}")
+        # Engines compartidos (el archivo se creará automáticamente)
+        self.db_name = db_name
+        self.engine = get_engine(db_name)
+        # Conexiones de solo lectura para el camino del dashboard
+        self.read_engine = get_engine(db_name, solo_lectura=True)
 
     def crear_tablas_cache(self) -> None:
         query = """
         CREATE TABLE IF NOT EXISTS cache_rutas (
             route_id TEXT PRIMARY KEY,
-            geometria TEXT NOT NULL,
+            geometria BLOB NOT NULL,
             distancia_km REAL,
             duracion_min REAL,
-            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            formato TEXT,
+            lon_origen REAL,
+            lat_origen REAL,
+            lon_destino REAL,
+            lat_destino REAL,
+            celda_origen TEXT,
+            celda_destino TEXT,
+            ultimo_acceso REAL,
+            aciertos INTEGER DEFAULT 0
+        );
+        """
+        # Geometrías simplificadas (Douglas-Peucker) por nivel de zoom
+        query_niveles = """
+        CREATE TABLE IF NOT EXISTS cache_rutas_niveles (
+            route_id TEXT NOT NULL,
+            nivel INTEGER NOT NULL,
+            geometria BLOB NOT NULL,
+            PRIMARY KEY (route_id, nivel)
         );
         """
         with self.engine.begin() as conn:
             conn.execute(text(query))
+            # Bases de datos anteriores al formato compacto
+            columnas = self._columnas_tabla(conn, "cache_rutas")
+            if "formato" not in columnas:
+                conn.exec_driver_sql("ALTER TABLE cache_rutas ADD COLUMN formato TEXT")
+            # Extremos pedidos y celdas de la rejilla (modo con tolerancia)
+            for columna, tipo in (("lon_origen", "REAL"), ("lat_origen", "REAL"),
+                                  ("lon_destino", "REAL"), ("lat_destino", "REAL"),
+                                  ("celda_origen", "TEXT"), ("celda_destino", "TEXT"),
+                                  # Último acierto (epoch) para el desalojo LRU de mantenimiento_cache
+                                  ("ultimo_acceso", "REAL"), ("aciertos", "INTEGER DEFAULT 0")):
+                if columna not in columnas:
+                    conn.exec_driver_sql(f"ALTER TABLE cache_rutas ADD COLUMN {columna} {tipo}")
+            conn.exec_driver_sql(
+                "CREATE INDEX IF NOT EXISTS idx_cache_rutas_celdas ON cache_rutas (celda_origen, celda_destino)"
+            )
+            conn.execute(text(query_niveles))
             logger.info("Tabla de caché creada correctamente.")
+        self.migrar_geometrias()
+
+    def migrar_geometrias(self, lote=100) -> int:
+        """Convierte las filas de cache_rutas guardadas como texto GeoJSON al formato compacto.
+
+        Guarda la geometría como encoded polyline comprimido con zlib y calcula
+        sus niveles simplificados. Procesa por lotes en transacciones cortas y
+        es idempotente, por lo que puede ejecutarse con el dashboard en marcha.
+        El espacio liberado no se devuelve al sistema hasta el siguiente VACUUM.
+
+        Returns:
+            Número de rutas migradas.
+        """
+        migradas = 0
+        while True:
+            with self.engine.begin() as conn:
+                filas = conn.execute(text(
+                    "SELECT route_id, geometria FROM cache_rutas "
+                    "WHERE formato IS NULL OR formato = :f LIMIT :n"
+                ), {"f": FORMATO_GEOJSON, "n": lote}).all()
+                if not filas:
+                    break
+                for route_id, geometria in filas:
+                    geojson = json.loads(geometria)
+                    blob, formato = comprimir_geometria(geojson)
+                    conn.execute(
+                        text("UPDATE cache_rutas SET geometria = :g, formato = :f WHERE route_id = :rid"),
+                        {"g": blob, "f": formato, "rid": route_id},
+                    )
+                    conn.execute(
+                        text("INSERT OR REPLACE INTO cache_rutas_niveles (route_id, nivel, geometria) "
+                             "VALUES (:rid, :nivel, :g)"),
+                        [{"rid": route_id, "nivel": nivel, "g": g}
+                         for nivel, (g, _) in niveles_simplificados(geojson).items()],
+                    )
+                migradas += len(filas)
+        if migradas:
+            logger.info(f"Migradas {migradas} rutas de cache_rutas al formato compacto.")
+        return migradas
     
-    def guardar_datos(self, df: pd.DataFrame, table_name: str, if_exists='replace'):
+    def guardar_datos(self, df: "pd.DataFrame", table_name: str, if_exists='replace', clave=None, huella=None):
         """
         Guarda un DataFrame en una tabla específica.
-        if_exists: 'replace' para sobrescribir, 'append' para añadir datos nuevos.
+        if_exists: 'replace' para sobrescribir, 'append' para añadir datos nuevos,
+            'upsert' para aplicar solo las diferencias según la columna ``clave``.
+        huella: en modo 'upsert', hash de la respuesta de la API de la que sale
+            ``df``. Si coincide con el de la carga anterior la tabla ni se compara.
+        Returns:
+            En modo 'upsert', dict con el resumen de cambios (ver ``_upsert``).
         """
         if df.empty:
             logger.warning(f"Advertencia: El DataFrame para {table_name} está vacío. No se guardará nada.")
             return
         
+        if if_exists == 'upsert':
+            if clave is None:
+                raise ValueError("El modo 'upsert' necesita la columna clave.")
+            if huella is not None and huella == self.huella_tabla(table_name):
+                return self._sin_cambios(table_name)
+            try:
+                return self._upsert(df, table_name, clave, huella)
+            except Exception as e:
+                logger.error(f"Error al actualizar '{table_name}' de forma incremental: {e}")
+                return None
+
         try:
             # .to_sql es la magia de Pandas + SQLAlchemy
             # index=False evita que se cree una columna extra con los índices de Pandas
-            df.to_sql(table_name, con=self.engine, if_exists=if_exists, index=False)
+            with self.engine.begin() as conn:
+                df.to_sql(table_name, con=conn, if_exists=if_exists, index=False)
+                self._incrementar_version(conn, table_name)
+            ETL_FILAS.inc(len(df), tabla=table_name, operacion=if_exists)
             logger.info(f"Éxito: Tabla '{table_name}' actualizada con {len(df)} registros.")
         except Exception as e:
             logger.error(f"Error al guardar en la base de datos: {e}")
 
-    def leer_tabla(self, table_name) -> pd.DataFrame:
+    @staticmethod
+    def _incrementar_version(conn, table_name: str) -> None:
+        """Marca ``table_name`` como modificada para invalidar las cachés que dependen de ella."""
+        conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS etl_versiones (
+            tabla TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        conn.execute(text("""
+        INSERT INTO etl_versiones (tabla, version) VALUES (:t, 1)
+        ON CONFLICT (tabla) DO UPDATE SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+        """), {"t": table_name})
+
+    def huella_tabla(self, table_name: str):
+        """Huella de la respuesta de la API con la que se cargó ``table_name`` por última vez."""
+        try:
+            with self.read_engine.connect() as conn:
+                if not self._existe_tabla(conn, table_name):
+                    return None
+                return conn.execute(
+                    text("SELECT huella FROM etl_huellas WHERE tabla = :t"), {"t": table_name}
+                ).scalar()
+        except OperationalError:
+            return None  # aún no se ha guardado ninguna huella
+
+    @staticmethod
+    def _guardar_huella(conn, table_name: str, huella) -> None:
+        conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS etl_huellas (
+            tabla TEXT PRIMARY KEY,
+            huella TEXT NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        if huella is None:
+            # Sin huella (p.ej. carga de un DataFrame local): la próxima carga no se puede omitir
+            conn.execute(text("DELETE FROM etl_huellas WHERE tabla = :t"), {"t": table_name})
+            return
+        conn.execute(text("""
+        INSERT INTO etl_huellas (tabla, huella) VALUES (:t, :h)
+        ON CONFLICT (tabla) DO UPDATE SET huella = excluded.huella, updated_at = CURRENT_TIMESTAMP
+        """), {"t": table_name, "h": huella})
+
+    @staticmethod
+    def _sin_cambios(table_name: str) -> dict:
+        logger.info(f"Tabla '{table_name}' sin cambios en la API (misma huella): se omite.")
+        return {"nuevas": 0, "actualizadas": 0, "eliminadas": 0, "filas_cambiadas": 0,
+                "claves_afectadas": set(), "omitida": True}
+
+    def version_tabla(self, table_name: str) -> int:
+        """Versión de los datos de ``table_name`` (cambia cada vez que la ETL la modifica)."""
+        try:
+            with self.read_engine.connect() as conn:
+                version = conn.execute(
+                    text("SELECT version FROM etl_versiones WHERE tabla = :t"), {"t": table_name}
+                ).scalar()
+        except OperationalError:
+            return 0  # aún no se ha cargado nada
+        return version or 0
+
+    def _existe_tabla(self, conn, table_name: str) -> bool:
+        return conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :t"), {"t": table_name}
+        ).first() is not None
+
+    def crear_indices(self) -> None:
+        """Crea los índices de las columnas usadas en los cruces del dashboard.
+
+        Es idempotente y se llama tras cada carga, ya que una sustitución completa
+        de la tabla (primera carga o cambio de columnas) elimina sus índices.
+        """
+        indices = [
+            ("planificaciones", "pedido"),
+            ("maestro_origenes", "codigo"),
+            ("maestro_destinos", "codigoPlanta"),
+            # Filtros de la vista de flota
+            ("planificaciones", "fechaPrevista"),
+            ("planificaciones", "codigoPlanta"),
+        ]
+        with self.engine.begin() as conn:
+            for tabla, columna in indices:
+                if self._existe_tabla(conn, tabla) and columna in self._columnas_tabla(conn, tabla):
+                    conn.exec_driver_sql(
+                        f'CREATE INDEX IF NOT EXISTS "idx_{tabla}_{columna}" ON "{tabla}" ("{columna}")'
+                    )
+        logger.info("Índices de planificaciones y maestros verificados.")
+
+    def filtro_afectadas(self, conn, afectadas: dict, alias="p") -> str:
+        """Condición SQL sobre planificaciones (``alias``) para las claves que cambiaron.
+
+        Carga en tablas temporales de ``conn`` las claves de ``afectadas``
+        (tabla de la ETL -> claves, como el ``claves_afectadas`` de ``_upsert``)
+        y devuelve la condición que selecciona las planificaciones que dependen
+        de ellas; "0" si no hay ninguna.
+        """
+        condiciones = []
+        for tabla, claves in afectadas.items():
+            if not claves:
+                continue
+            temporal = f"_afectadas_{tabla}"
+            self._cargar_claves(conn, temporal, claves)
+            columna = COLUMNAS_CRUCE[tabla]
+            condiciones.append(f'CAST({alias}."{columna}" AS TEXT) IN (SELECT clave FROM "{temporal}")')
+        return " OR ".join(condiciones) or "0"
+
+    def refrescar_pedido_coordenadas(self, afectadas: dict = None) -> int:
+        """Recalcula la tabla materializada ``pedido_coordenadas``.
+
+        Guarda el cruce de planificaciones con los maestros (coordenadas de
+        origen y destino por pedido) para que el dashboard resuelva un pedido
+        con una única lectura indexada. El refresco ocurre en una transacción.
+
+        Args:
+            afectadas: dict tabla -> claves cambiadas en la última carga. Si se
+                indica, solo se recalculan los pedidos que dependen de ellas.
+        Returns:
+            Número de filas de la tabla tras el refresco (completo) o filas
+            recalculadas (parcial).
+        """
+        if afectadas is not None:
+            with self.engine.begin() as conn:
+                if self._existe_tabla(conn, "pedido_coordenadas"):
+                    return self._refrescar_pedido_coordenadas_parcial(conn, afectadas)
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql("""
+            CREATE TABLE IF NOT EXISTS pedido_coordenadas (
+                pedido TEXT,
+                codigoPlanta TEXT,
+                codigoCargadero TEXT,
+                longitud_origen REAL,
+                latitud_origen REAL,
+                longitud_destino REAL,
+                latitud_destino REAL
+            )
+            """)
+            conn.exec_driver_sql(
+                "CREATE INDEX IF NOT EXISTS idx_pedido_coordenadas_pedido ON pedido_coordenadas (pedido)"
+            )
+            conn.exec_driver_sql("DELETE FROM pedido_coordenadas")
+            filas = conn.exec_driver_sql("""
+            INSERT INTO pedido_coordenadas
+            SELECT p.pedido, p.codigoPlanta, p.codigoCargadero,
+                   o.longitud, o.latitud, d.longitud, d.latitud
+            FROM planificaciones p
+            LEFT JOIN maestro_origenes o ON p.codigoCargadero = o.codigo
+            LEFT JOIN maestro_destinos d ON p.codigoPlanta = d.codigoPlanta
+            """).rowcount
+        logger.info(f"Tabla pedido_coordenadas refrescada con {filas} registros.")
+        return filas
+
+    def _refrescar_pedido_coordenadas_parcial(self, conn, afectadas: dict) -> int:
+        filtro_p = self.filtro_afectadas(conn, afectadas, alias="p")
+        if filtro_p == "0":
+            return 0
+        # Mismas tablas temporales: la condición vale para pedido_coordenadas (mismas columnas)
+        conn.exec_driver_sql(f"DELETE FROM pedido_coordenadas AS p WHERE {filtro_p}")
+        filas = conn.exec_driver_sql(f"""
+        INSERT INTO pedido_coordenadas
+        SELECT p.pedido, p.codigoPlanta, p.codigoCargadero,
+               o.longitud, o.latitud, d.longitud, d.latitud
+        FROM planificaciones p
+        LEFT JOIN maestro_origenes o ON p.codigoCargadero = o.codigo
+        LEFT JOIN maestro_destinos d ON p.codigoPlanta = d.codigoPlanta
+        WHERE {filtro_p}
+        """).rowcount
+        logger.info(f"Tabla pedido_coordenadas: {filas} registros recalculados (refresco parcial).")
+        return filas
+
+    @staticmethod
+    def _sumas_por_clave(df: "pd.DataFrame", clave: str) -> "pd.Series":
+        """Suma (uint64, con desbordamiento) de los hashes de fila por valor de clave.
+
+        Una clave puede agrupar varias filas (p.ej. un pedido con varias
+        planificaciones): al sumar los hashes de fila, cualquier alta, baja o
+        cambio dentro del grupo cambia el hash de la clave, y las sumas de
+        distintos lotes de una misma carga se pueden acumular.
+        """
+        import pandas as pd
+
+        filas = pd.util.hash_pandas_object(df[sorted(df.columns)], index=False)
+        return filas.groupby(df[clave].astype(str).values).sum()
+
+    @staticmethod
+    def _formatear_hashes(sumas: "pd.Series") -> dict:
+        return {clave: format(int(h) & 0xFFFFFFFFFFFFFFFF, "016x") for clave, h in sumas.items()}
+
+    @staticmethod
+    def _sin_claves_nulas(df: "pd.DataFrame", table_name: str, clave: str) -> tuple:
+        """Quita las filas sin ``clave``: no se pueden comparar ni borrar por clave.
+
+        Returns:
+            (DataFrame sin esas filas, número de filas descartadas).
+        """
+        nulas = df[clave].isna()
+        descartadas = int(nulas.sum())
+        if descartadas:
+            logger.warning(f"{descartadas} registros de '{table_name}' sin '{clave}' descartados.")
+            df = df[~nulas]
+        return df, descartadas
+
+    def _hashes_por_clave(self, df: "pd.DataFrame", clave: str) -> dict:
+        """Hash de contenido por valor de clave (independiente del orden de filas y columnas)."""
+        return self._formatear_hashes(self._sumas_por_clave(df, clave))
+
+    def _columnas_tabla(self, conn, table_name: str) -> list:
+        return [fila[1] for fila in conn.exec_driver_sql(f'PRAGMA table_info("{table_name}")')]
+
+    def _upsert(self, df: "pd.DataFrame", table_name: str, clave: str, huella=None) -> dict:
+        """Sincroniza ``table_name`` con ``df`` aplicando solo altas, cambios y bajas.
+
+        Los hashes por clave de la última carga se guardan en ``etl_hashes``. Las
+        filas nuevas o modificadas se cargan en una tabla de staging y todo el
+        intercambio (borrados + inserciones) ocurre en una única transacción, por
+        lo que los lectores nunca ven una tabla a medio cargar. Si la tabla no
+        existe, cambia de columnas o no tiene hashes previos, se sustituye
+        completa dentro de la misma transacción.
+
+        Las filas sin clave se descartan antes de comparar.
+
+        Returns:
+            dict con nuevas, actualizadas y eliminadas (claves), filas_cambiadas,
+            claves_afectadas (set de claves como texto) y descartadas (filas sin
+            clave), o None si ninguna fila tiene clave.
+        """
+        df, descartadas = self._sin_claves_nulas(df, table_name, clave)
+        if df.empty:
+            logger.warning(f"Advertencia: Ningún registro de {table_name} tiene '{clave}'. No se guardará nada.")
+            return None
+        hashes = self._hashes_por_clave(df, clave)
+        with self.engine.begin() as conn:
+            resumen = self._sincronizar(conn, table_name, clave, hashes, list(df.columns), df)
+            self._guardar_huella(conn, table_name, huella)
+        resumen["descartadas"] = descartadas
+        return resumen
+
+    def guardar_por_lotes(self, lotes, table_name: str, clave: str, dtype=None, huella=None):
+        """Carga incremental a partir de un iterable de DataFrames (p.ej. una descarga en streaming).
+
+        Cada lote se escribe en la tabla de staging en su propia transacción
+        corta, sin retener el lote en memoria. Al final se aplica el mismo merge
+        atómico que en el modo 'upsert'. En memoria solo se acumula un hash por
+        clave, no los registros.
+
+        Args:
+            lotes: iterable de DataFrames con las mismas columnas.
+            dtype: tipos SQLAlchemy por columna para la tabla de staging.
+            huella: función que, consumidos los lotes, devuelve la huella de la
+                respuesta. Si coincide con la anterior se descarta el staging sin merge.
+        Returns:
+            dict de resumen como ``_upsert`` (más ``filas``), o None si no hubo datos o falló.
+            Las filas sin clave se descartan como en ``_upsert``.
+        """
+        import pandas as pd
+
+        staging = f"_staging_{table_name}"
+        columnas = None
+        sumas = []
+        filas = 0
+        descartadas = 0
+        try:
+            for lote in lotes:
+                lote, nulas = self._sin_claves_nulas(lote, table_name, clave)
+                descartadas += nulas
+                if lote.empty:
+                    continue
+                with self.engine.begin() as conn:
+                    lote.to_sql(staging, con=conn, if_exists='replace' if columnas is None else 'append',
+                                index=False, dtype=dtype)
+                columnas = columnas or list(lote.columns)
+                sumas.append(self._sumas_por_clave(lote, clave))
+                if len(sumas) >= 20:
+                    # Compactamos para que la memoria dependa del nº de claves, no de lotes
+                    sumas = [pd.concat(sumas).groupby(level=0).sum()]
+                filas += len(lote)
+                logger.info(f"Lote de {len(lote)} registros cargado en staging de '{table_name}' ({filas} en total).")
+
+            if columnas is None:
+                logger.warning(f"Advertencia: No se recibieron registros para {table_name}. No se guardará nada.")
+                return None
+            huella_final = huella() if huella else None
+            if huella_final is not None and huella_final == self.huella_tabla(table_name):
+                with self.engine.begin() as conn:
+                    conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{staging}"')
+                resumen = self._sin_cambios(table_name)
+            else:
+                hashes = self._formatear_hashes(pd.concat(sumas).groupby(level=0).sum())
+                with self.engine.begin() as conn:
+                    resumen = self._sincronizar(conn, table_name, clave, hashes, columnas, staging)
+                    self._guardar_huella(conn, table_name, huella_final)
+            resumen["filas"] = filas
+            resumen["descartadas"] = descartadas
+            return resumen
+        except Exception as e:
+            logger.error(f"Error al cargar '{table_name}' por lotes: {e}")
+            with self.engine.begin() as conn:
+                conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{staging}"')
+            return None
+
+    def _sincronizar(self, conn, table_name: str, clave: str, hashes: dict, columnas_nuevas: list, origen) -> dict:
+        """Aplica el diff de claves sobre ``table_name`` dentro de la transacción ``conn``.
+
+        ``origen`` es un DataFrame con todos los registros nuevos o el nombre de
+        una tabla de staging que ya los contiene (se elimina al terminar).
+        """
+        staging = f"_staging_{table_name}"
+        conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS etl_hashes (
+            tabla TEXT NOT NULL,
+            clave TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            PRIMARY KEY (tabla, clave)
+        )
+        """)
+        anteriores = dict(conn.execute(
+            text("SELECT clave, hash FROM etl_hashes WHERE tabla = :t"), {"t": table_name}
+        ).all())
+        columnas = self._columnas_tabla(conn, table_name)
+        en_staging = isinstance(origen, str)
+
+        if not anteriores or set(columnas) != set(columnas_nuevas):
+            # Carga completa: staging + intercambio atómico
+            if not en_staging:
+                origen.to_sql(staging, con=conn, if_exists='replace', index=False)
+            conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{table_name}"')
+            conn.exec_driver_sql(f'ALTER TABLE "{staging}" RENAME TO "{table_name}"')
+            nuevas, cambiadas = set(hashes), set()
+            eliminadas = set(anteriores) - nuevas
+            conn.execute(text("DELETE FROM etl_hashes WHERE tabla = :t"), {"t": table_name})
+            filas_cambiadas = conn.exec_driver_sql(f'SELECT COUNT(*) FROM "{table_name}"').scalar()
+        else:
+            nuevas = set(hashes) - set(anteriores)
+            cambiadas = {c for c in set(hashes) & set(anteriores) if hashes[c] != anteriores[c]}
+            eliminadas = set(anteriores) - set(hashes)
+            a_borrar = cambiadas | eliminadas
+            a_escribir = nuevas | cambiadas
+            filas_cambiadas = 0
+            lista = ", ".join(f'"{c}"' for c in columnas_nuevas)
+
+            if a_borrar:
+                self._cargar_claves(conn, f"{staging}_claves", a_borrar)
+                filas_cambiadas += conn.exec_driver_sql(
+                    f'DELETE FROM "{table_name}" WHERE "{clave}" IN (SELECT clave FROM "{staging}_claves")'
+                ).rowcount
+                conn.exec_driver_sql(f'DROP TABLE "{staging}_claves"')
+                conn.execute(
+                    text("DELETE FROM etl_hashes WHERE tabla = :t AND clave = :c"),
+                    [{"t": table_name, "c": c} for c in a_borrar],
+                )
+            if a_escribir and en_staging:
+                self._cargar_claves(conn, f"{staging}_claves", a_escribir)
+                filas_cambiadas += conn.exec_driver_sql(
+                    f'INSERT INTO "{table_name}" ({lista}) SELECT {lista} FROM "{staging}" '
+                    f'WHERE "{clave}" IN (SELECT clave FROM "{staging}_claves")'
+                ).rowcount
+                conn.exec_driver_sql(f'DROP TABLE "{staging}_claves"')
+            elif a_escribir:
+                filas_escribir = origen[origen[clave].astype(str).isin(a_escribir)]
+                filas_escribir.to_sql(staging, con=conn, if_exists='replace', index=False)
+                filas_cambiadas += conn.exec_driver_sql(
+                    f'INSERT INTO "{table_name}" ({lista}) SELECT {lista} FROM "{staging}"'
+                ).rowcount
+            conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{staging}"')
+
+        escribir = nuevas | cambiadas
+        if escribir:
+            conn.execute(
+                text("INSERT INTO etl_hashes (tabla, clave, hash) VALUES (:t, :c, :h)"),
+                [{"t": table_name, "c": c, "h": hashes[c]} for c in escribir],
+            )
+        if filas_cambiadas:
+            self._incrementar_version(conn, table_name)
+
+        resumen = {
+            "nuevas": len(nuevas),
+            "actualizadas": len(cambiadas),
+            "eliminadas": len(eliminadas),
+            "filas_cambiadas": filas_cambiadas,
+            "claves_afectadas": nuevas | cambiadas | eliminadas,
+        }
+        for operacion in ("nuevas", "actualizadas", "eliminadas"):
+            if resumen[operacion]:
+                ETL_FILAS.inc(resumen[operacion], tabla=table_name, operacion=operacion)
+        logger.info(
+            f"Éxito: Tabla '{table_name}' sincronizada: {resumen['nuevas']} nuevas, "
+            f"{resumen['actualizadas']} actualizadas, {resumen['eliminadas']} eliminadas "
+            f"({filas_cambiadas} filas cambiadas)."
+        )
+        return resumen
+
+    @staticmethod
+    def _cargar_claves(conn, tabla: str, claves) -> None:
+        conn.exec_driver_sql(f'CREATE TEMP TABLE IF NOT EXISTS "{tabla}" (clave TEXT PRIMARY KEY)')
+        conn.exec_driver_sql(f'DELETE FROM "{tabla}"')
+        conn.exec_driver_sql(f'INSERT INTO "{tabla}" (clave) VALUES (?)', [(c,) for c in claves])
+
+    def leer_tabla(self, table_name) -> "pd.DataFrame":
         """Recupera una tabla completa como DataFrame."""
-        return pd.read_sql(f"SELECT * FROM {table_name}", con=self.engine)
\ No newline at end of file
+        import pandas as pd
+
+        return pd.read_sql(f"SELECT * FROM {table_name}", con=self.read_engine)
\ No newline at end of file
@@ -0,0 +1,234 @@
+import math
+from typing import TYPE_CHECKING
+import numpy as np
+from sqlalchemy import text
+from logger import setup_logger
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = setup_logger("distancias")
+
+RADIO_TIERRA_KM = 6371.0088
+
+# Una ruta por carretera nunca es más corta que la distancia geodésica (salvo
+# redondeos) y rara vez supera varias veces esa distancia: fuera de este rango
+# lo más probable es que las coordenadas del maestro estén mal.
+FACTOR_DESVIACION_MIN = 0.95
+FACTOR_DESVIACION_MAX = 3.0
+# En trayectos cortos el factor se dispara sin que haya error: se exige además
+# una diferencia absoluta mínima
+DIFERENCIA_MIN_KM = 5.0
+
+# Lado de la celda de la rejilla de extremos de cache_rutas (~110 m en latitud)
+TAMANO_CELDA_GRADOS = 0.001
+METROS_POR_GRADO = 111320.0
+
+
+def _a_radianes(coords) -> np.ndarray:
+    """Array (n, 2) de [lon, lat] en grados a radianes."""
+    return np.radians(np.asarray(coords, dtype=float).reshape(-1, 2))
+
+
+def haversine(lon1, lat1, lon2, lat2) -> np.ndarray:
+    """Distancia geodésica en km, elemento a elemento (admite escalares o arrays)."""
+    lon1, lat1, lon2, lat2 = map(np.radians, map(np.asarray, (lon1, lat1, lon2, lat2)))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def _unitarios(coords) -> np.ndarray:
+    """Vectores unitarios 3D de una lista de [lon, lat] en grados."""
+    rad = _a_radianes(coords)
+    lon, lat = rad[:, 0], rad[:, 1]
+    return np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+
+def _distancia_desde_producto(productos: np.ndarray, dtype=np.float64) -> np.ndarray:
+    """Distancia sobre la esfera (km) a partir del producto escalar de vectores unitarios."""
+    # Con la cuerda en lugar de arccos se conserva la precisión en distancias cortas;
+    # la resta se hace en float64 y el resto puede ir en float32
+    media_cuerda = np.sqrt(np.maximum(0.5 - 0.5 * productos, 0.0).astype(dtype, copy=False))
+    return (2 * RADIO_TIERRA_KM) * np.arcsin(np.minimum(media_cuerda, 1.0))
+
+
+def celda_grid(lon, lat) -> str:
+    """Celda de la rejilla fija que contiene el punto, como texto ``"ix:iy"``."""
+    return f"{math.floor(lon / TAMANO_CELDA_GRADOS)}:{math.floor(lat / TAMANO_CELDA_GRADOS)}"
+
+
+def celdas_vecinas(lon, lat, radio_m) -> list:
+    """Celdas de la rejilla que pueden contener puntos a menos de ``radio_m`` metros."""
+    ix = math.floor(lon / TAMANO_CELDA_GRADOS)
+    iy = math.floor(lat / TAMANO_CELDA_GRADOS)
+    anillo_y = math.ceil(radio_m / METROS_POR_GRADO / TAMANO_CELDA_GRADOS)
+    # Los grados de longitud encogen con la latitud
+    metros_lon = METROS_POR_GRADO * max(math.cos(math.radians(lat)), 0.01)
+    anillo_x = math.ceil(radio_m / metros_lon / TAMANO_CELDA_GRADOS)
+    return [f"{x}:{y}" for x in range(ix - anillo_x, ix + anillo_x + 1)
+            for y in range(iy - anillo_y, iy + anillo_y + 1)]
+
+
+def matriz_distancias(origenes, destinos, tamano_bloque=256) -> np.ndarray:
+    """Matriz (n_origenes, n_destinos) de distancias geodésicas en km.
+
+    Equivale a haversine par a par, pero cada bloque de ``tamano_bloque``
+    orígenes se resuelve con una multiplicación de matrices sobre vectores
+    unitarios, y los intermedios no pasan de un bloque (el resultado es float32).
+    """
+    o = _unitarios(origenes)
+    d_t = _unitarios(destinos).T
+    matriz = np.empty((len(o), d_t.shape[1]), dtype=np.float32)
+    for i in range(0, len(o), tamano_bloque):
+        matriz[i:i + tamano_bloque] = _distancia_desde_producto(o[i:i + tamano_bloque] @ d_t, np.float32)
+    return matriz
+
+
+class IndiceGeografico:
+    """Índice de vecinos más cercanos sobre la esfera (interfaz tipo BallTree).
+
+    Los puntos se guardan como vectores unitarios 3D: el vecino más cercano es el
+    de mayor producto escalar, así que cada consulta es una multiplicación de
+    matrices por bloques (BLAS) seguida de ``argpartition``, sin dependencias
+    extra y con memoria acotada a ``tamano_bloque`` x n_puntos.
+    """
+
+    def __init__(self, coords, tamano_bloque=256) -> None:
+        self.n = len(coords)
+        self.tamano_bloque = tamano_bloque
+        self._vectores = _unitarios(coords)
+
+    def consultar(self, coords, k=1):
+        """Los ``k`` puntos del índice más cercanos a cada punto de ``coords``.
+
+        Returns:
+            tuple (distancias_km, indices), ambos de forma (n_consultas, k) y
+            ordenados de más cercano a más lejano.
+        """
+        k = min(k, self.n)
+        consultas = _unitarios(coords)
+        distancias = np.empty((len(consultas), k))
+        indices = np.empty((len(consultas), k), dtype=np.int64)
+        for i in range(0, len(consultas), self.tamano_bloque):
+            productos = consultas[i:i + self.tamano_bloque] @ self._vectores.T
+            if k < self.n:
+                candidatos = np.argpartition(-productos, k - 1, axis=1)[:, :k]
+            else:
+                candidatos = np.broadcast_to(np.arange(self.n), productos.shape)
+            cercanos = np.take_along_axis(productos, candidatos, axis=1)
+            orden = np.argsort(-cercanos, axis=1)
+            indices[i:i + self.tamano_bloque] = np.take_along_axis(candidatos, orden, axis=1)
+            distancias[i:i + self.tamano_bloque] = _distancia_desde_producto(
+                np.take_along_axis(cercanos, orden, axis=1))
+        return distancias, indices
+
+
+def _leer_maestro(db_manager, tabla, codigo) -> "pd.DataFrame":
+    """Códigos y coordenadas válidas (numéricas y en rango) de un maestro."""
+    import pandas as pd
+
+    df = pd.read_sql(f"SELECT {codigo}, longitud, latitud FROM {tabla}", con=db_manager.read_engine)
+    df["longitud"] = pd.to_numeric(df["longitud"], errors="coerce")
+    df["latitud"] = pd.to_numeric(df["latitud"], errors="coerce")
+    validas = df["longitud"].between(-180, 180) & df["latitud"].between(-90, 90)
+    return df[validas].reset_index(drop=True)
+
+
+def cargadero_mas_cercano(db_manager, k=1) -> "pd.DataFrame":
+    """Para cada planta de ``maestro_destinos``, sus ``k`` cargaderos más cercanos.
+
+    Returns:
+        DataFrame con codigoPlanta, codigoCargadero, orden (1 = el más cercano) y distancia_km.
+    """
+    import pandas as pd
+
+    origenes = _leer_maestro(db_manager, "maestro_origenes", "codigo")
+    destinos = _leer_maestro(db_manager, "maestro_destinos", "codigoPlanta")
+    if origenes.empty or destinos.empty:
+        return pd.DataFrame(columns=["codigoPlanta", "codigoCargadero", "orden", "distancia_km"])
+
+    indice = IndiceGeografico(origenes[["longitud", "latitud"]].to_numpy())
+    distancias, indices = indice.consultar(destinos[["longitud", "latitud"]].to_numpy(), k=k)
+    k = indices.shape[1]
+    return pd.DataFrame({
+        "codigoPlanta": np.repeat(destinos["codigoPlanta"].to_numpy(), k),
+        "codigoCargadero": origenes["codigo"].to_numpy()[indices.ravel()],
+        "orden": np.tile(np.arange(1, k + 1), len(destinos)),
+        "distancia_km": np.round(distancias.ravel(), 3),
+    })
+
+
+def _distancias_cache(db_manager, route_ids, bloque=500) -> dict:
+    """route_id -> distancia_km de cache_rutas, solo para los ``route_ids`` pedidos."""
+    distancias = {}
+    with db_manager.read_engine.connect() as conn:
+        for inicio in range(0, len(route_ids), bloque):
+            ids = route_ids[inicio:inicio + bloque]
+            params = {f"r{i}": rid for i, rid in enumerate(ids)}
+            marcadores = ", ".join(f":r{i}" for i in range(len(ids)))
+            distancias.update(conn.execute(text(
+                f"SELECT route_id, distancia_km FROM cache_rutas WHERE route_id IN ({marcadores})"), params).all())
+    return distancias
+
+
+def detectar_desviaciones(db_manager, route_provider, factor_min=FACTOR_DESVIACION_MIN,
+                          factor_max=FACTOR_DESVIACION_MAX, afectadas=None) -> "pd.DataFrame":
+    """Planificaciones cuya distancia OSRM cacheada no cuadra con la geodésica.
+
+    Compara ``cache_rutas.distancia_km`` con la distancia en línea recta de cada
+    pedido de ``pedido_coordenadas``. Un factor (OSRM / geodésica) por debajo de
+    ``factor_min`` o por encima de ``factor_max`` suele indicar coordenadas
+    erróneas en los maestros.
+
+    Args:
+        afectadas: dict tabla -> claves cambiadas en la ETL; si se indica solo
+            se revisan los pedidos que dependen de ellas.
+    Returns:
+        DataFrame con pedido, codigoCargadero, codigoPlanta, distancia_osrm_km,
+        distancia_geodesica_km y factor.
+    """
+    import pandas as pd
+
+    query = """
+        SELECT pedido, codigoCargadero, codigoPlanta,
+               longitud_origen, latitud_origen, longitud_destino, latitud_destino
+        FROM pedido_coordenadas pc
+        WHERE longitud_origen IS NOT NULL AND latitud_origen IS NOT NULL
+          AND longitud_destino IS NOT NULL AND latitud_destino IS NOT NULL
+    """
+    # Las claves afectadas van a tablas temporales: misma conexión, de escritura
+    with db_manager.engine.connect() as conn:
+        if afectadas is not None:
+            query += f" AND ({db_manager.filtro_afectadas(conn, afectadas, alias='pc')})"
+        pedidos = pd.read_sql(text(query), con=conn)
+    columnas = ["pedido", "codigoCargadero", "codigoPlanta",
+                "distancia_osrm_km", "distancia_geodesica_km", "factor"]
+    if pedidos.empty:
+        return pd.DataFrame(columns=columnas)
+
+    coords = ["longitud_origen", "latitud_origen", "longitud_destino", "latitud_destino"]
+    # route_id por par distinto, no por pedido (muchos pedidos repiten trayecto)
+    pares = pedidos[coords].drop_duplicates()
+    pares["route_id"] = [route_provider._generar_id_ruta(*fila) for fila in pares.itertuples(index=False)]
+    pares["distancia_osrm_km"] = pares["route_id"].map(_distancias_cache(db_manager, pares["route_id"].tolist()))
+
+    df = pedidos.merge(pares.dropna(subset=["distancia_osrm_km"]), on=coords)
+    df["distancia_geodesica_km"] = np.round(haversine(*(df[c].to_numpy() for c in coords)), 3)
+    # Origen y destino en el mismo punto: el factor queda sin definir (NaN)
+    df["factor"] = np.round(df["distancia_osrm_km"] / df["distancia_geodesica_km"].replace(0, np.nan), 3)
+    fuera = ~df["factor"].between(factor_min, factor_max)
+    fuera &= (df["distancia_osrm_km"] - df["distancia_geodesica_km"]).abs() > DIFERENCIA_MIN_KM
+    desviadas = df.loc[fuera, columnas].reset_index(drop=True)
+    if not desviadas.empty:
+        logger.warning(f"{len(desviadas)} planificaciones con distancia OSRM anómala "
+                       f"(fuera de {factor_min}-{factor_max} veces la geodésica).")
+    return desviadas
+
+
+if __name__ == "__main__":
+    from database import DatabaseManager
+    from router import RouteProvider
+
+    db = DatabaseManager()
+    print(cargadero_mas_cercano(db).head(20).to_string(index=False))
+    print(detectar_desviaciones(db, RouteProvider(db)).to_string(index=False))
@@ -0,0 +1,131 @@
+import json
+import zlib
+import numpy as np
+
+# Formatos de cache_rutas.geometria
+FORMATO_GEOJSON = "geojson"          # texto GeoJSON (filas antiguas)
+FORMATO_POLYLINE = "polyline6"       # encoded polyline con 6 decimales
+FORMATO_POLYLINE_ZLIB = "polyline6+zlib"
+
+PRECISION = 6
+
+# Tolerancias de Douglas-Peucker (grados) de los niveles simplificados.
+# Nivel 0 = geometría completa.
+NIVELES_SIMPLIFICACION = {
+    1: 0.00005,  # ~5 m
+    2: 0.0003,   # ~30 m
+    3: 0.0015,   # ~150 m
+}
+
+
+def nivel_para_zoom(zoom) -> int:
+    """Nivel de simplificación adecuado para un zoom de Leaflet."""
+    if zoom is None:
+        return 0
+    if zoom >= 13:
+        return 0
+    if zoom >= 11:
+        return 1
+    if zoom >= 8:
+        return 2
+    return 3
+
+
+def codificar_polyline(coords, precision=PRECISION) -> str:
+    """Codifica una lista de [lon, lat] en formato encoded polyline (orden lat, lon)."""
+    pares = np.round(np.asarray(coords, dtype=float)[:, ::-1] * 10 ** precision).astype(np.int64)
+    deltas = np.diff(pares, axis=0, prepend=[[0, 0]]).ravel()
+    # Zigzag: los negativos pasan a impares
+    valores = np.where(deltas < 0, ~(deltas << 1), deltas << 1).tolist()
+    salida = []
+    for v in valores:
+        while v >= 0x20:
+            salida.append(chr((0x20 | (v & 0x1F)) + 63))
+            v >>= 5
+        salida.append(chr(v + 63))
+    return "".join(salida)
+
+
+def decodificar_polyline(texto, precision=PRECISION) -> list:
+    """Decodifica un encoded polyline a una lista de [lon, lat] (vectorizado con NumPy)."""
+    if isinstance(texto, str):
+        texto = texto.encode("ascii")
+    if not texto:
+        return []
+    b = np.frombuffer(texto, dtype=np.uint8).astype(np.int64) - 63
+    fin = (b & 0x20) == 0
+    # Índice de valor al que pertenece cada byte y posición del byte dentro del valor
+    grupo = np.concatenate(([0], np.cumsum(fin)[:-1]))
+    inicios = np.flatnonzero(np.concatenate(([True], fin[:-1])))
+    posicion = np.arange(len(b)) - inicios[grupo]
+    valores = np.bincount(grupo, weights=(b & 0x1F) << (5 * posicion)).astype(np.int64)
+    deltas = np.where(valores & 1, ~(valores >> 1), valores >> 1)
+    pares = np.cumsum(deltas.reshape(-1, 2), axis=0) / 10 ** precision
+    return np.round(pares[:, ::-1], precision).tolist()
+
+
+def douglas_peucker(coords, tolerancia: float) -> np.ndarray:
+    """Simplifica una polilínea conservando los puntos a más de ``tolerancia`` del segmento."""
+    puntos = np.asarray(coords, dtype=float)
+    n = len(puntos)
+    if n < 3:
+        return puntos
+    conservar = np.zeros(n, dtype=bool)
+    conservar[[0, -1]] = True
+    pila = [(0, n - 1)]
+    while pila:
+        i, j = pila.pop()
+        if j <= i + 1:
+            continue
+        a, b = puntos[i], puntos[j]
+        tramo = puntos[i + 1:j]
+        ab = b - a
+        largo = np.hypot(*ab)
+        if largo == 0:
+            distancias = np.hypot(*(tramo - a).T)
+        else:
+            distancias = np.abs(ab[0] * (tramo[:, 1] - a[1]) - ab[1] * (tramo[:, 0] - a[0])) / largo
+        k = int(np.argmax(distancias))
+        if distancias[k] > tolerancia:
+            idx = i + 1 + k
+            conservar[idx] = True
+            pila.append((i, idx))
+            pila.append((idx, j))
+    return puntos[conservar]
+
+
+def comprimir_geometria(geometria: dict, comprimir=True):
+    """Serializa una geometría GeoJSON LineString para cache_rutas.
+
+    Returns:
+        tuple (bytes, formato).
+    """
+    codificada = codificar_polyline(geometria["coordinates"]).encode("ascii")
+    if comprimir:
+        return zlib.compress(codificada, 6), FORMATO_POLYLINE_ZLIB
+    return codificada, FORMATO_POLYLINE
+
+
+def descomprimir_geometria(valor, formato) -> dict:
+    """Reconstruye el diccionario GeoJSON guardado con ``comprimir_geometria``."""
+    if formato in (None, FORMATO_GEOJSON):
+        return json.loads(valor)
+    if formato == FORMATO_POLYLINE_ZLIB:
+        valor = zlib.decompress(valor)
+    return {"type": "LineString", "coordinates": decodificar_polyline(valor)}
+
+
+def niveles_simplificados(geometria: dict, comprimir=True) -> dict:
+    """Geometrías simplificadas por nivel, ya serializadas: nivel -> (bytes, formato)."""
+    coords = geometria["coordinates"]
+    niveles = {}
+    for nivel, tolerancia in NIVELES_SIMPLIFICACION.items():
+        simplificada = douglas_peucker(coords, tolerancia).tolist()
+        niveles[nivel] = comprimir_geometria({"coordinates": simplificada}, comprimir)
+    return niveles
+
+
+def tamano_en_memoria(geometria: dict) -> int:
+    """Estimación de bytes que ocupa la geometría decodificada como listas de Python."""
+    # lista interna (~72 B) + dos float (~24 B cada uno) por vértice
+    return 120 * len(geometria.get("coordinates", ()))
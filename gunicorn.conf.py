@@ -0,0 +1,50 @@
+"""Configuración recomendada de Gunicorn para el dashboard.
+
+Workers con hilos (gthread): mientras un hilo espera a SQLite u OSRM los demás
+siguen atendiendo peticiones, y los fallos de caché se resuelven en el pool de
+``resolucion_rutas`` sin bloquear a nadie. Con ``preload_app`` la aplicación se
+importa una vez en el máster y los workers la heredan (pools de conexiones,
+hilos de logging y métricas se recrean tras el fork).
+
+Uso:
+    gunicorn -c gunicorn.conf.py app:server
+"""
+import gc
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8050")
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+preload_app = True
+# Ninguna petición espera a OSRM (los fallos de la ruta de un pedido y de la
+# flota van a ``resolucion_rutas``): un timeout corto detecta workers colgados
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+# Recicla los workers de vez en cuando para acotar la memoria a largo plazo
+max_requests = 2000
+max_requests_jitter = 200
+
+# Métricas compartidas entre workers (ver metrics.py)
+raw_env = [f"METRICS_DIR={os.getenv('METRICS_DIR', '/tmp/metricas')}"]
+
+
+def on_starting(server):
+    # Descarta los ficheros de métricas de workers de un arranque anterior
+    from metrics import REGISTRO
+    REGISTRO.limpiar()
+
+
+def child_exit(server, worker):
+    # Las métricas del worker que termina (p.ej. reciclado por max_requests)
+    # pasan al fichero acumulado y su fichero por pid se borra
+    from metrics import REGISTRO
+    REGISTRO.retirar(worker.pid)
+
+
+def when_ready(server):
+    # Con preload_app la aplicación ya está importada en el máster: se congela
+    # su heap para que el GC de los workers no lo recorra ni lo copie (copy-on-write)
+    gc.collect()
+    gc.freeze()
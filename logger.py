@@ -1,24 +1,154 @@
-import logging
-import os
-
-def setup_logger(name:str) -> logging.Logger:
-    """Configurar el sistema de logging"""
-    
-    # Crear directorio de logs si no existe
-    if not os.path.exists('logs'):
-        os.makedirs('logs')
-    
-    # Nombre del archivo con fecha
-    log_filename = "logs/logs.log"
-    
-    # Configurar logging
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_filename, encoding='utf-8'),
-            logging.StreamHandler()  # También muestra en consola
-        ]
-    )    
-    return logging.getLogger(name)
-
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+LOG_FOLDER = "logs"
+LOG_FILENAME = os.path.join(LOG_FOLDER, "logs.log")
+FORMATO = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Rotación. Por defecto ("externa") el fichero lo rota logrotate u otro proceso y
+# cada proceso lo reabre al ver que ha cambiado: es lo único seguro con varios
+# workers de Gunicorn más la ETL escribiendo en el mismo fichero. "tamano"
+# (LOG_MAX_BYTES) y "diaria" rotan desde Python y solo valen con un único proceso.
+LOG_ROTACION = os.getenv("LOG_ROTACION", "externa")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "5"))
+
+# Como mucho se leen estos bytes desde el final al hacer tail, aunque el filtro
+# de nivel no llegue a reunir todas las líneas pedidas
+MAX_BYTES_TAIL = 4 * 1024 * 1024
+
+_lock = threading.Lock()
+_cola_handler = None
+_listener = None
+
+
+def _handlers_destino() -> list:
+    if LOG_ROTACION == "tamano":
+        archivo = logging.handlers.RotatingFileHandler(
+            LOG_FILENAME, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8")
+    elif LOG_ROTACION == "diaria":
+        archivo = logging.handlers.TimedRotatingFileHandler(
+            LOG_FILENAME, when="midnight", backupCount=LOG_BACKUPS, encoding="utf-8")
+    else:
+        archivo = logging.handlers.WatchedFileHandler(LOG_FILENAME, encoding="utf-8")
+    consola = logging.StreamHandler()  # También muestra en consola
+    formato = logging.Formatter(FORMATO)
+    for handler in (archivo, consola):
+        handler.setFormatter(formato)
+    return [archivo, consola]
+
+
+def _iniciar_listener() -> None:
+    global _listener
+    _listener = logging.handlers.QueueListener(
+        _cola_handler.queue, *_handlers_destino(), respect_handler_level=True)
+    _listener.start()
+
+
+def _detener_listener() -> None:
+    if _listener is not None:
+        _listener.stop()  # vacía la cola antes de terminar
+        for handler in _listener.handlers:
+            handler.close()
+
+
+def _reiniciar_tras_fork() -> None:
+    # El hilo del listener no sobrevive al fork (preload de Gunicorn): cada
+    # worker necesita su propia cola, su hilo y sus descriptores de fichero
+    if _cola_handler is not None:
+        _cola_handler.queue = queue.SimpleQueue()
+        _iniciar_listener()
+
+
+def _configurar() -> None:
+    """Configura una sola vez por proceso el logging asíncrono.
+
+    Los registros se encolan (``QueueHandler``) y un hilo (``QueueListener``)
+    los escribe en ``logs/logs.log`` y en consola, de forma que las
+    peticiones del dashboard no esperan a la E/S de disco. La rotación depende
+    de ``LOG_ROTACION`` (por defecto externa, ver arriba).
+    """
+    global _cola_handler
+    with _lock:
+        if _cola_handler is not None:
+            return
+        # Crear directorio de logs si no existe
+        os.makedirs(LOG_FOLDER, exist_ok=True)
+        _cola_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+        raiz = logging.getLogger()
+        raiz.setLevel(logging.INFO)
+        raiz.addHandler(_cola_handler)
+        _iniciar_listener()
+        atexit.register(_detener_listener)
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=_reiniciar_tras_fork)
+
+
+def setup_logger(name: str) -> logging.Logger:
+    """Configurar el sistema de logging"""
+    _configurar()
+    return logging.getLogger(name)
+
+
+def _nivel_linea(linea: str):
+    """Nivel (int) de una línea con el formato del log, o None si es una continuación."""
+    partes = linea.split(" - ", 3)
+    if len(partes) < 4:
+        return None
+    nivel = logging.getLevelName(partes[2])
+    return nivel if isinstance(nivel, int) else None
+
+
+def leer_ultimas_lineas(ruta, lineas=100, nivel_minimo=None, tamano_bloque=64 * 1024) -> list:
+    """Últimas ``lineas`` del log leyendo hacia atrás desde el final del fichero.
+
+    El coste depende de las líneas pedidas, no del tamaño del log (como mucho
+    ``MAX_BYTES_TAIL`` bytes). Con ``nivel_minimo`` solo se devuelven los
+    registros de ese nivel o superior, junto con sus líneas de continuación
+    (p.ej. trazas de excepciones).
+
+    Returns:
+        list de líneas (sin salto de línea) en orden cronológico.
+    """
+    seleccion = []   # en orden inverso
+    pendientes = []  # continuaciones aún sin su cabecera (también en orden inverso)
+    with open(ruta, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        posicion = f.tell()
+        resto = b""
+        leidos = 0
+        while len(seleccion) < lineas:
+            paso = min(tamano_bloque, posicion)
+            posicion -= paso
+            f.seek(posicion)
+            bloque = f.read(paso) + resto
+            leidos += paso
+            # La primera línea del bloque puede estar cortada: se completa con el siguiente
+            resto, *trozos = bloque.split(b"\n")
+            if posicion == 0:
+                trozos.insert(0, resto)
+                resto = b""
+            for crudo in reversed(trozos):
+                linea = crudo.decode("utf-8", errors="replace").rstrip("\r")
+                if not linea:
+                    continue
+                if nivel_minimo is None:
+                    seleccion.append(linea)
+                else:
+                    nivel = _nivel_linea(linea)
+                    if nivel is None:
+                        pendientes.append(linea)
+                        continue
+                    if nivel >= nivel_minimo:
+                        seleccion.extend(pendientes)
+                        seleccion.append(linea)
+                    pendientes = []
+                if len(seleccion) >= lineas:
+                    break
+            if posicion == 0 or leidos >= MAX_BYTES_TAIL:
+                break
+    return list(reversed(seleccion[:lineas]))
@@ -1,28 +1,200 @@
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from data_fetcher import DataFetcher
 from database import DatabaseManager
+from router import RouteProvider
+from warmup import precalcular_rutas
+from distancias import detectar_desviaciones
+from mantenimiento_cache import compactar, purgar_lru
+from snapshots import exportar_snapshot
+from metrics import ETL_SEGUNDOS, ETL_ULTIMA_EJECUCION, REGISTRO
 from logger import setup_logger
 
 logger = setup_logger("main_interfaz_datos")
 
-def integrar_datos() -> None:
-    """Función principal para integrar la obtención y almacenamiento de datos."""
+# Clave natural de cada tabla para la carga incremental
+CLAVES_TABLAS = {
+    "maestro_origenes": "codigo",
+    "maestro_destinos": "codigoPlanta",
+    "planificaciones": "pedido",
+}
+# Endpoint de DataFetcher del que sale cada tabla
+ENDPOINT_TABLAS = {
+    "maestro_origenes": "cargaderos",
+    "maestro_destinos": "destinos",
+    "planificaciones": "planificaciones",
+}
+# Con --cada, la purga LRU y la compactación de cache_rutas van aparte, con este intervalo
+INTERVALO_MANTENIMIENTO = float(os.getenv("ETL_INTERVALO_MANTENIMIENTO", "3600"))
+
+def integrar_datos(streaming: bool = False, fetcher: DataFetcher = None, db: DatabaseManager = None,
+                   route_provider: RouteProvider = None) -> dict:
+    """Función principal para integrar la obtención y almacenamiento de datos.
+
+    Cada respuesta de la API se identifica por su huella: una tabla cuya
+    respuesta no ha cambiado no se compara ni se escribe, y de las que cambian
+    solo se aplican las claves afectadas. Lo que depende de ellas
+    (``pedido_coordenadas``, precálculo de rutas, control de distancias) se
+    recalcula solo para esas claves, y nada si no cambió ninguna.
+
+    Args:
+        streaming: si es True, las planificaciones se descargan en streaming y se
+            vuelcan a SQLite por lotes (memoria acotada) mientras se descargan los maestros.
+        fetcher, db, route_provider: reutilizables entre ejecuciones (modo
+            programado) para conservar la sesión HTTP, el token, los engines y
+            la sesión con OSRM.
+    Returns:
+        dict con segundos, tablas (resumen por tabla, ``omitida`` si no cambió)
+        y claves_afectadas por tabla; o None si la integración falló.
+    """
+    inicio_total = time.perf_counter()
+    resumenes = {}
     try:
-        # 1. Traer los datos (lo que ya lograste)
-        fetcher = DataFetcher()
-        df_origenes = fetcher.fetch_cargaderos()
-        df_destinos = fetcher.fetch_destinos()
-        df_planificaciones = fetcher.fetch_planificaciones()
+        fetcher = fetcher or DataFetcher()
+        # 1. Inicializar la base de datos
+        db = db or DatabaseManager()
 
-        # 2. Inicializar la base de datos
-        db = DatabaseManager()
+        # 2. Traer los datos (las descargas en paralelo)
+        if streaming:
+            fetcher.login()
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                inicio = time.perf_counter()
+                futuro = pool.submit(fetcher.fetch_planificaciones_stream, db)
+                resultados = fetcher.fetch_all(["cargaderos", "destinos"])
+                resumenes["planificaciones"] = futuro.result()
+                if resumenes["planificaciones"] is None:
+                    logger.error("No se actualizará 'planificaciones' (descarga en streaming fallida).")
+                # Descarga y guardado van juntos en streaming
+                ETL_SEGUNDOS.observe(time.perf_counter() - inicio, tabla="planificaciones")
+        else:
+            resultados = fetcher.fetch_all()
+        for resultado in resultados.values():
+            if not resultado.ok:
+                logger.error(f"No se actualizará '{resultado.nombre}': {resultado.error}")
 
-        # 3. Guardar todo
-        db.guardar_datos(df_origenes, "maestro_origenes")
-        db.guardar_datos(df_destinos, "maestro_destinos")
-        db.guardar_datos(df_planificaciones, "planificaciones")
+        # 3. Guardar todo (solo se escriben las diferencias)
+        tablas = ["maestro_origenes", "maestro_destinos"] + ([] if streaming else ["planificaciones"])
+        for tabla in tablas:
+            resultado = resultados[ENDPOINT_TABLAS[tabla]]
+            inicio = time.perf_counter()
+            resumenes[tabla] = db.guardar_datos(resultado.df, tabla, if_exists='upsert',
+                                                clave=CLAVES_TABLAS[tabla], huella=resultado.huella)
+            ETL_SEGUNDOS.observe(resultado.segundos + time.perf_counter() - inicio, tabla=tabla)
+
+        afectadas = {tabla: r["claves_afectadas"] for tabla, r in resumenes.items()
+                     if r and r["claves_afectadas"]}
+        if afectadas:
+            # Índices y cruce materializado para las consultas del dashboard
+            db.crear_indices()
+            db.refrescar_pedido_coordenadas(afectadas)
+        ETL_ULTIMA_EJECUCION.set(time.time())
         logger.info("Todos los datos se han integrado y almacenado correctamente.")
     except Exception as e:
         logger.error(f"Error en la integración de datos: {e}")
+        return None
+
+    resumen = {
+        "tablas": {tabla: r and {k: v for k, v in r.items() if k != "claves_afectadas"}
+                   for tabla, r in resumenes.items()},
+        "claves_afectadas": {tabla: len(claves) for tabla, claves in afectadas.items()},
+    }
+    if afectadas:
+        _actualizar_derivados(db, afectadas, route_provider or RouteProvider(db))
+    resumen["segundos"] = round(time.perf_counter() - inicio_total, 3)
+    omitidas = [tabla for tabla, r in resumenes.items() if r and r.get("omitida")]
+    logger.info(f"ETL terminada en {resumen['segundos']}s; sin cambios: {omitidas or 'ninguna'}; "
+                f"claves afectadas: {resumen['claves_afectadas'] or 'ninguna'}.")
+    return resumen
+
+
+def _actualizar_derivados(db: DatabaseManager, afectadas: dict, route_provider: RouteProvider) -> None:
+    """Rutas, control de distancias y snapshot tras una carga con cambios."""
+    # 4. Precalcular las rutas nuevas para que el dashboard no espere a OSRM
+    try:
+        precalcular_rutas(db, route_provider, afectadas=afectadas)
+    except Exception as e:
+        logger.error(f"Error en el precálculo de rutas: {e}")
+        return
+
+    # 5. Avisar de coordenadas sospechosas (OSRM muy lejos de la línea recta)
+    try:
+        detectar_desviaciones(db, route_provider, afectadas=afectadas)
+    except Exception as e:
+        logger.error(f"Error al comprobar las distancias: {e}")
+
+    # 6. Snapshot columnar para análisis (solo si se ha configurado SNAPSHOT_DIR)
+    if os.getenv("SNAPSHOT_DIR"):
+        try:
+            exportar_snapshot(db, route_provider, destino=os.environ["SNAPSHOT_DIR"])
+        except Exception as e:
+            logger.error(f"Error al exportar el snapshot: {e}")
+
+
+def mantener_cache(db: DatabaseManager) -> None:
+    """Recorta cache_rutas a CACHE_MAX_FILAS/CACHE_MAX_BYTES y refresca sus estadísticas."""
+    try:
+        purgar_lru(db)
+        compactar(db)
+    except Exception as e:
+        logger.error(f"Error en el mantenimiento de la caché de rutas: {e}")
+
+
+def ejecutar_programado(intervalo: float, streaming: bool = False, parada: threading.Event = None,
+                        max_ejecuciones: int = None) -> None:
+    """Ejecuta ``integrar_datos`` cada ``intervalo`` segundos hasta que se active ``parada``.
+
+    El intervalo se cuenta desde el inicio de cada ejecución (si una tarda más,
+    la siguiente empieza al terminar). Sesión HTTP, base de datos y
+    ``RouteProvider`` se reutilizan. El mantenimiento de cache_rutas se hace
+    cada ``INTERVALO_MANTENIMIENTO`` segundos, no en cada ejecución.
+    """
+    parada = parada or threading.Event()
+    fetcher, db = DataFetcher(), DatabaseManager()
+    route_provider = RouteProvider(db)
+    ultimo_mantenimiento = time.monotonic()
+    ejecuciones = 0
+    while not parada.is_set():
+        inicio = time.monotonic()
+        integrar_datos(streaming=streaming, fetcher=fetcher, db=db, route_provider=route_provider)
+        if inicio - ultimo_mantenimiento >= INTERVALO_MANTENIMIENTO:
+            mantener_cache(db)
+            ultimo_mantenimiento = inicio
+        REGISTRO.volcar("etl")
+        ejecuciones += 1
+        if max_ejecuciones is not None and ejecuciones >= max_ejecuciones:
+            break
+        parada.wait(max(0.0, intervalo - (time.monotonic() - inicio)))
+
+
+def iniciar_programador(intervalo: float, streaming: bool = False) -> threading.Event:
+    """Lanza ``ejecutar_programado`` en un hilo del proceso actual.
+
+    Returns:
+        threading.Event que detiene el programador al activarlo.
+    """
+    parada = threading.Event()
+    threading.Thread(target=ejecutar_programado, args=(intervalo, streaming, parada),
+                     name="etl-programada", daemon=True).start()
+    return parada
 
 if __name__ == "__main__":
-    integrar_datos()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="ETL de la API moplan a logistica.db")
+    parser.add_argument("--streaming", action="store_true",
+                        help="descarga las planificaciones en streaming (memoria acotada)")
+    parser.add_argument("--cada", type=float, default=None, metavar="SEGUNDOS",
+                        help="se queda en marcha y repite la ETL con este intervalo")
+    args = parser.parse_args()
+    if args.cada:
+        try:
+            ejecutar_programado(args.cada, streaming=args.streaming)
+        except KeyboardInterrupt:
+            logger.info("ETL programada detenida.")
+    else:
+        db = DatabaseManager()
+        integrar_datos(streaming=args.streaming, db=db)
+        mantener_cache(db)
+        # La ETL corre en su propio proceso: deja sus métricas para el /metrics del dashboard
+        REGISTRO.volcar("etl")
\ No newline at end of file
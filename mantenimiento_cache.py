@@ -0,0 +1,220 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import text
+from database import DatabaseManager
+from router import RouteProvider, TTL_RUTAS_DIAS
+from route_cache import RouteCache
+from warmup import LimitadorTasa, _consultar_con_reintentos
+from metrics import RUTAS_CACHE, REGISTRO
+from logger import setup_logger
+
+logger = setup_logger("mantenimiento_cache")
+
+# Límites por defecto de cache_rutas (0 = sin límite)
+MAX_FILAS_CACHE = int(os.getenv("CACHE_MAX_FILAS", "0"))
+MAX_BYTES_CACHE = int(os.getenv("CACHE_MAX_BYTES", "0"))
+
+# Tramos (en días) del histograma de antigüedad de las rutas
+TRAMOS_ANTIGUEDAD = ((1, "<1d"), (7, "1-7d"), (30, "7-30d"), (90, "30-90d"), (float("inf"), ">90d"))
+
+# Filas de cache_rutas (más sus niveles) que se borran por transacción: lotes
+# cortos para no bloquear las escrituras del dashboard
+LOTE_PURGA = 500
+
+
+def _filas_cache(conn) -> list:
+    """route_id, bytes (geometría + niveles), updated_at, último acceso y aciertos de cada ruta."""
+    return conn.execute(text("""
+    SELECT c.route_id,
+           LENGTH(c.geometria) + COALESCE(n.bytes, 0),
+           c.updated_at, c.ultimo_acceso, COALESCE(c.aciertos, 0)
+    FROM cache_rutas c
+    LEFT JOIN (SELECT route_id, SUM(LENGTH(geometria)) AS bytes
+               FROM cache_rutas_niveles GROUP BY route_id) n ON n.route_id = c.route_id
+    """)).all()
+
+
+def estadisticas_cache(db_manager, ttl_dias=TTL_RUTAS_DIAS) -> dict:
+    """Resumen de cache_rutas: entradas, bytes, antigüedad y uso.
+
+    Returns:
+        dict con entradas, bytes_geometria, bytes_fichero, antiguedad (entradas
+        por tramo de días), caducadas, sin_accesos, aciertos (acumulados en
+        cache_rutas), resoluciones (exacto/aproximado/fallo de todos los
+        procesos desde que arrancaron, como en /metrics) y tasa_aciertos.
+    """
+    with db_manager.read_engine.connect() as conn:
+        filas = _filas_cache(conn)
+    ahora = time.time()
+    antiguedad = {etiqueta: 0 for _, etiqueta in TRAMOS_ANTIGUEDAD}
+    caducadas = 0
+    for _, _, updated_at, _, _ in filas:
+        dias = (ahora - RouteCache._a_timestamp(updated_at)) / 86400
+        antiguedad[next(e for limite, e in TRAMOS_ANTIGUEDAD if dias < limite)] += 1
+        caducadas += bool(ttl_dias) and dias > ttl_dias
+
+    ruta_db = db_manager.engine.url.database
+    bytes_fichero = sum(os.path.getsize(ruta_db + sufijo) for sufijo in ("", "-wal")
+                        if ruta_db and os.path.exists(ruta_db + sufijo))
+    return {
+        "entradas": len(filas),
+        "bytes_geometria": sum(f[1] for f in filas),
+        "bytes_fichero": bytes_fichero,
+        "antiguedad": antiguedad,
+        "caducadas": caducadas,
+        "sin_accesos": sum(1 for f in filas if f[3] is None),
+        "aciertos": sum(f[4] for f in filas),
+        **_tasa_aciertos(),
+    }
+
+
+def _tasa_aciertos() -> dict:
+    resoluciones = {"exacto": 0, "aproximado": 0, "fallo": 0}
+    for (resultado,), valor in REGISTRO.valores(RUTAS_CACHE.nombre).items():
+        resoluciones[resultado] = int(valor)
+    total = sum(resoluciones.values())
+    aciertos = resoluciones["exacto"] + resoluciones["aproximado"]
+    return {"resoluciones": resoluciones, "tasa_aciertos": round(aciertos / total, 4) if total else 0.0}
+
+
+def purgar_lru(db_manager, max_filas=MAX_FILAS_CACHE, max_bytes=MAX_BYTES_CACHE, lote=LOTE_PURGA) -> int:
+    """Recorta cache_rutas a ``max_filas`` rutas y ``max_bytes`` de geometría.
+
+    Se borran primero las rutas usadas hace más tiempo (``ultimo_acceso``; las
+    nunca usadas cuentan desde su ``updated_at``), junto con sus niveles
+    simplificados. Los borrados van en lotes de ``lote`` rutas.
+
+    Returns:
+        Número de rutas eliminadas.
+    """
+    if not max_filas and not max_bytes:
+        return 0
+    with db_manager.read_engine.connect() as conn:
+        filas = _filas_cache(conn)
+    # Las más recientes primero: se conservan mientras quepan en los límites
+    filas.sort(key=lambda f: f[3] if f[3] is not None else RouteCache._a_timestamp(f[2]), reverse=True)
+    conservadas, total_bytes = 0, 0
+    for _, tamano, _, _, _ in filas:
+        if (max_filas and conservadas >= max_filas) or (max_bytes and total_bytes + tamano > max_bytes):
+            break
+        conservadas += 1
+        total_bytes += tamano
+    sobrantes = [f[0] for f in filas[conservadas:]]
+
+    for inicio in range(0, len(sobrantes), lote):
+        parametros = [{"rid": rid} for rid in sobrantes[inicio:inicio + lote]]
+        with db_manager.engine.begin() as conn:
+            conn.execute(text("DELETE FROM cache_rutas_niveles WHERE route_id = :rid"), parametros)
+            conn.execute(text("DELETE FROM cache_rutas WHERE route_id = :rid"), parametros)
+    if sobrantes:
+        logger.info(f"Purgadas {len(sobrantes)} rutas de cache_rutas (quedan {conservadas}, {total_bytes} bytes).")
+    return len(sobrantes)
+
+
+def refrescar_caducadas(db_manager, route_provider=None, ttl_dias=TTL_RUTAS_DIAS, limite=None,
+                        max_workers=4, peticiones_por_segundo=5.0, reintentos=3, backoff=0.5) -> dict:
+    """Vuelve a pedir a OSRM las rutas con más de ``ttl_dias`` días.
+
+    Complementa el refresco en segundo plano del dashboard (que solo alcanza a
+    las rutas que se consultan): primero las más usadas, con el mismo límite de
+    tasa y reintentos que el precálculo. Solo se pueden refrescar las rutas con
+    extremos conocidos (``lon_origen``...).
+
+    Returns:
+        dict con caducadas, refrescadas y fallidas.
+    """
+    if not ttl_dias:
+        return {"caducadas": 0, "refrescadas": 0, "fallidas": 0}
+    route_provider = route_provider or RouteProvider(db_manager)
+    with db_manager.read_engine.connect() as conn:
+        filas = conn.execute(text("""
+        SELECT route_id, lon_origen, lat_origen, lon_destino, lat_destino, updated_at
+        FROM cache_rutas WHERE lon_origen IS NOT NULL
+        ORDER BY COALESCE(aciertos, 0) DESC
+        """)).all()
+    limite_ts = time.time() - ttl_dias * 86400
+    pares = [tuple(f[:5]) for f in filas if RouteCache._a_timestamp(f[5]) < limite_ts][:limite]
+
+    rutas = []
+    if pares:
+        limitador = LimitadorTasa(peticiones_por_segundo)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for ruta in pool.map(lambda par: _consultar_con_reintentos(route_provider, limitador, par,
+                                                                       reintentos, backoff), pares):
+                if ruta is not None:
+                    rutas.append(ruta)
+        route_provider.guardar_rutas(rutas)
+        for ruta in rutas:
+            route_provider.cache.invalidar(ruta["route_id"])
+    resumen = {"caducadas": len(pares), "refrescadas": len(rutas), "fallidas": len(pares) - len(rutas)}
+    logger.info(f"Refresco de rutas caducadas: {resumen}")
+    return resumen
+
+
+def compactar(db_manager, vacuum=False) -> None:
+    """Actualiza las estadísticas del planificador y recorta el WAL.
+
+    ``VACUUM`` reescribe el fichero entero y bloquea las escrituras mientras
+    dura: solo con ``vacuum=True`` (p.ej. tras una purga grande, fuera de horas).
+    """
+    # Conexión DBAPI directa: VACUUM no admite el BEGIN que emite SQLAlchemy
+    conn = db_manager.engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        for sentencia in ("ANALYZE cache_rutas", "ANALYZE cache_rutas_niveles", "PRAGMA optimize"):
+            cursor.execute(sentencia)
+        if vacuum:
+            cursor.execute("VACUUM")
+        # Con lectores activos el checkpoint puede quedarse a medias: no es un error
+        cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+    logger.info(f"cache_rutas compactada{' (VACUUM)' if vacuum else ''}.")
+
+
+def mantener(db_manager=None, route_provider=None, max_filas=MAX_FILAS_CACHE, max_bytes=MAX_BYTES_CACHE,
+             ttl_dias=TTL_RUTAS_DIAS, refrescar=True, vacuum=False) -> dict:
+    """Mantenimiento completo: refresco de caducadas, purga LRU y compactación.
+
+    Returns:
+        dict con el resumen del refresco, las rutas purgadas y las estadísticas finales.
+    """
+    db_manager = db_manager or DatabaseManager()
+    route_provider = route_provider or RouteProvider(db_manager)
+    # Los accesos aún en memoria cuentan para decidir qué se purga
+    route_provider.volcar_accesos()
+    refresco = refrescar_caducadas(db_manager, route_provider, ttl_dias) if refrescar else None
+    purgadas = purgar_lru(db_manager, max_filas, max_bytes)
+    compactar(db_manager, vacuum=vacuum)
+    return {"refresco": refresco, "purgadas": purgadas, "estadisticas": estadisticas_cache(db_manager, ttl_dias)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mantenimiento de cache_rutas")
+    parser.add_argument("accion", choices=["stats", "purgar", "refrescar", "compactar", "todo"])
+    parser.add_argument("--max-filas", type=int, default=MAX_FILAS_CACHE, help="rutas a conservar (0 = sin límite)")
+    parser.add_argument("--max-bytes", type=int, default=MAX_BYTES_CACHE,
+                        help="bytes de geometría a conservar (0 = sin límite)")
+    parser.add_argument("--ttl-dias", type=float, default=TTL_RUTAS_DIAS, help="antigüedad para refrescar")
+    parser.add_argument("--limite", type=int, default=None, help="máximo de rutas a refrescar")
+    parser.add_argument("--vacuum", action="store_true", help="reescribe el fichero al compactar")
+    args = parser.parse_args()
+
+    db = DatabaseManager()
+    if args.accion == "stats":
+        resultado = estadisticas_cache(db, args.ttl_dias)
+    elif args.accion == "purgar":
+        resultado = {"purgadas": purgar_lru(db, args.max_filas, args.max_bytes)}
+    elif args.accion == "refrescar":
+        resultado = refrescar_caducadas(db, ttl_dias=args.ttl_dias, limite=args.limite)
+    elif args.accion == "compactar":
+        compactar(db, vacuum=args.vacuum)
+        resultado = estadisticas_cache(db, args.ttl_dias)
+    else:
+        resultado = mantener(db, max_filas=args.max_filas, max_bytes=args.max_bytes,
+                             ttl_dias=args.ttl_dias, vacuum=args.vacuum)
+    print(json.dumps(resultado, indent=2, ensure_ascii=False))
@@ -0,0 +1,344 @@
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from logger import setup_logger
+
+logger = setup_logger("metrics")
+
+# Con varios workers de Gunicorn cada proceso vuelca sus valores a
+# ``METRICS_DIR/metricas_<pid>.json`` y /metrics suma los de todos, más los de
+# los workers ya terminados (``metricas_acumuladas.json``). Sin METRICS_DIR las
+# métricas son solo del proceso actual.
+INTERVALO_VOLCADO = 2.0
+# Sufijo del fichero con los valores de los workers ya terminados
+ACUMULADO = "acumuladas"
+
+CUBETAS_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, registro, nombre, ayuda, etiquetas=()) -> None:
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = registro._lock
+        registro._registrar(self)
+
+    def _clave(self, etiquetas: dict) -> tuple:
+        return tuple(str(etiquetas.get(e, "")) for e in self.etiquetas)
+
+    def exportar(self) -> dict:
+        """Valores serializables a JSON: lista de [etiquetas, valor]."""
+        with self._lock:
+            return {"tipo": self.tipo, "valores": [[list(k), v] for k, v in self._valores.items()]}
+
+
+class Counter(_Metrica):
+    """Contador monótono; entre procesos se suman."""
+
+    tipo = "counter"
+
+    def inc(self, valor=1.0, **etiquetas) -> None:
+        clave = self._clave(etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0.0) + valor
+
+
+class Gauge(_Metrica):
+    """Valor puntual; entre procesos se toma el máximo (p.ej. marcas de tiempo)."""
+
+    tipo = "gauge"
+
+    def set(self, valor, **etiquetas) -> None:
+        with self._lock:
+            self._valores[self._clave(etiquetas)] = float(valor)
+
+
+class Histogram(_Metrica):
+    """Histograma de cubetas fijas (acumulables entre procesos)."""
+
+    tipo = "histogram"
+
+    def __init__(self, registro, nombre, ayuda, etiquetas=(), cubetas=CUBETAS_LATENCIA) -> None:
+        super().__init__(registro, nombre, ayuda, etiquetas)
+        self.cubetas = tuple(cubetas)
+
+    def observe(self, valor, **etiquetas) -> None:
+        clave = self._clave(etiquetas)
+        indice = bisect.bisect_left(self.cubetas, valor)
+        with self._lock:
+            datos = self._valores.get(clave)
+            if datos is None:
+                # conteos por cubeta (la última es +Inf), suma
+                datos = self._valores[clave] = [[0] * (len(self.cubetas) + 1), 0.0]
+            datos[0][indice] += 1
+            datos[1] += valor
+
+    @contextmanager
+    def tiempo(self, **etiquetas):
+        """Mide en segundos la duración del bloque ``with``."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - inicio, **etiquetas)
+
+    def percentil(self, p: float, **etiquetas) -> float:
+        """Aproximación del percentil ``p`` (0-100) por el límite superior de su cubeta."""
+        with self._lock:
+            conteos = list(self._valores.get(self._clave(etiquetas), [[]])[0])
+        total = sum(conteos)
+        if not total:
+            return 0.0
+        objetivo = total * p / 100
+        acumulado = 0
+        for limite, conteo in zip(self.cubetas + (float("inf"),), conteos):
+            acumulado += conteo
+            if acumulado >= objetivo:
+                return limite
+        return float("inf")
+
+    def resumen(self, **etiquetas) -> dict:
+        """Observaciones, media y p50/p95/p99 (en segundos) de este proceso."""
+        with self._lock:
+            conteos, suma = self._valores.get(self._clave(etiquetas), [[0], 0.0])
+            total = sum(conteos)
+        return {
+            "peticiones": total,
+            "media_s": round(suma / total, 4) if total else 0.0,
+            "p50_s": self.percentil(50, **etiquetas),
+            "p95_s": self.percentil(95, **etiquetas),
+            "p99_s": self.percentil(99, **etiquetas),
+        }
+
+    def exportar(self) -> dict:
+        with self._lock:
+            valores = [[list(k), [list(conteos), suma]] for k, (conteos, suma) in self._valores.items()]
+        return {"tipo": self.tipo, "cubetas": list(self.cubetas), "valores": valores}
+
+
+class Registro:
+    """Conjunto de métricas del proceso y su volcado para multiproceso."""
+
+    def __init__(self, directorio=None) -> None:
+        self.directorio = directorio
+        self._metricas = {}
+        self._lock = threading.Lock()
+        self._pid_volcador = None
+
+    def _registrar(self, metrica: _Metrica) -> None:
+        self._metricas[metrica.nombre] = metrica
+
+    def counter(self, nombre, ayuda, etiquetas=()) -> Counter:
+        return Counter(self, nombre, ayuda, etiquetas)
+
+    def gauge(self, nombre, ayuda, etiquetas=()) -> Gauge:
+        return Gauge(self, nombre, ayuda, etiquetas)
+
+    def histogram(self, nombre, ayuda, etiquetas=(), cubetas=CUBETAS_LATENCIA) -> Histogram:
+        return Histogram(self, nombre, ayuda, etiquetas, cubetas)
+
+    def _ruta_fichero(self, sufijo=None) -> str:
+        return os.path.join(self.directorio, f"metricas_{sufijo or os.getpid()}.json")
+
+    def instantanea(self) -> dict:
+        return {nombre: m.exportar() for nombre, m in self._metricas.items()}
+
+    def volcar(self, nombre=None) -> None:
+        """Escribe de forma atómica los valores de este proceso en su fichero.
+
+        Args:
+            nombre: sustituye al pid en el nombre del fichero (p.ej. ``"etl"``
+                para que cada ejecución de la ETL reemplace a la anterior).
+        """
+        if not self.directorio:
+            return
+        os.makedirs(self.directorio, exist_ok=True)
+        ruta = self._ruta_fichero(nombre)
+        temporal = f"{ruta}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(self.instantanea(), f)
+        os.replace(temporal, ruta)
+
+    def iniciar_volcado(self) -> None:
+        """Arranca (una vez por proceso, también tras un fork) el hilo de volcado periódico."""
+        if not self.directorio or self._pid_volcador == os.getpid():
+            return
+        self._pid_volcador = os.getpid()
+        os.makedirs(self.directorio, exist_ok=True)
+
+        def _bucle():
+            while True:
+                time.sleep(INTERVALO_VOLCADO)
+                try:
+                    self.volcar()
+                except OSError as e:
+                    logger.warning(f"No se pudieron volcar las métricas: {e}")
+
+        threading.Thread(target=_bucle, name="volcado-metricas", daemon=True).start()
+        atexit.register(self.volcar)
+
+    def limpiar(self) -> None:
+        """Borra los ficheros de workers anteriores (al arrancar el servidor); conserva el de la ETL."""
+        if self.directorio:
+            for ruta in glob.glob(os.path.join(self.directorio, "metricas_[0-9]*.json")):
+                os.remove(ruta)
+            if os.path.exists(self._ruta_fichero(ACUMULADO)):
+                os.remove(self._ruta_fichero(ACUMULADO))
+
+    def retirar(self, pid) -> None:
+        """Pasa al fichero acumulado los valores de un worker terminado y borra su fichero.
+
+        Lo llama el máster de Gunicorn al terminar cada worker (``child_exit``):
+        los ficheros de workers reciclados no se acumulan y un pid reutilizado
+        no pisa los contadores del anterior.
+        """
+        if not self.directorio:
+            return
+        ruta = self._ruta_fichero(pid)
+        acumulado = self._ruta_fichero(ACUMULADO)
+        instantaneas = [i for i in (_leer_instantanea(acumulado), _leer_instantanea(ruta)) if i is not None]
+        if instantaneas:
+            temporal = f"{acumulado}.tmp"
+            with open(temporal, "w", encoding="utf-8") as f:
+                json.dump(_a_instantanea(_sumar(instantaneas)), f)
+            os.replace(temporal, acumulado)
+        if os.path.exists(ruta):
+            os.remove(ruta)
+
+    def reiniciar(self) -> None:
+        """Pone a cero los valores del proceso (tras un fork, para no duplicar los del padre)."""
+        with self._lock:
+            for metrica in self._metricas.values():
+                metrica._valores.clear()
+
+    def _combinar(self) -> dict:
+        """Suma las instantáneas de todos los procesos (la propia, siempre al día)."""
+        instantaneas = [self.instantanea()]
+        if self.directorio:
+            propio = self._ruta_fichero()
+            for ruta in glob.glob(os.path.join(self.directorio, "metricas_*.json")):
+                if ruta == propio:
+                    continue
+                instantanea = _leer_instantanea(ruta)
+                if instantanea is not None:
+                    instantaneas.append(instantanea)
+        return _sumar(instantaneas)
+
+    def valores(self, nombre) -> dict:
+        """Valores de una métrica sumados entre procesos: tupla de etiquetas -> valor."""
+        datos = self._combinar().get(nombre)
+        return dict(datos["valores"]) if datos else {}
+
+    def exponer(self) -> str:
+        """Métricas de todos los workers en formato de texto de Prometheus."""
+        lineas = []
+        combinadas = self._combinar()
+        for nombre, metrica in self._metricas.items():
+            datos = combinadas.get(nombre)
+            lineas.append(f"# HELP {nombre} {metrica.ayuda}")
+            lineas.append(f"# TYPE {nombre} {metrica.tipo}")
+            if datos is None:
+                continue
+            for clave, valor in sorted(datos["valores"].items()):
+                base = list(zip(metrica.etiquetas, clave))
+                if metrica.tipo != "histogram":
+                    lineas.append(f"{nombre}{_etiquetas(base)} {_numero(valor)}")
+                    continue
+                conteos, suma = valor
+                acumulado = 0
+                for limite, conteo in zip(list(datos["cubetas"]) + ["+Inf"], conteos):
+                    acumulado += conteo
+                    lineas.append(f"{nombre}_bucket{_etiquetas(base + [('le', limite)])} {acumulado}")
+                lineas.append(f"{nombre}_sum{_etiquetas(base)} {_numero(suma)}")
+                lineas.append(f"{nombre}_count{_etiquetas(base)} {acumulado}")
+        return "\n".join(lineas) + "\n"
+
+
+def _leer_instantanea(ruta):
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None  # fichero a medio escribir o borrado mientras tanto
+
+
+def _sumar(instantaneas) -> dict:
+    """Combina instantáneas: los contadores e histogramas se suman, de los gauges el máximo."""
+    combinadas = {}
+    for instantanea in instantaneas:
+        for nombre, datos in instantanea.items():
+            destino = combinadas.setdefault(nombre, {"tipo": datos["tipo"], "cubetas": datos.get("cubetas"),
+                                                     "valores": {}})
+            for etiquetas, valor in datos["valores"]:
+                clave = tuple(etiquetas)
+                previo = destino["valores"].get(clave)
+                if previo is None:
+                    destino["valores"][clave] = valor
+                elif datos["tipo"] == "counter":
+                    destino["valores"][clave] = previo + valor
+                elif datos["tipo"] == "gauge":
+                    destino["valores"][clave] = max(previo, valor)
+                else:
+                    conteos = [a + b for a, b in zip(previo[0], valor[0])]
+                    destino["valores"][clave] = [conteos, previo[1] + valor[1]]
+    return combinadas
+
+
+def _a_instantanea(combinadas: dict) -> dict:
+    """Formato de ``Registro.instantanea`` a partir del resultado de ``_sumar``."""
+    return {nombre: {"tipo": datos["tipo"], "cubetas": datos["cubetas"],
+                     "valores": [[list(k), v] for k, v in datos["valores"].items()]}
+            for nombre, datos in combinadas.items()}
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etiquetas(pares) -> str:
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{_escapar(v)}"' for k, v in pares) + "}"
+
+
+def _numero(valor) -> str:
+    return repr(float(valor)) if not float(valor).is_integer() else str(int(valor))
+
+
+REGISTRO = Registro(os.getenv("METRICS_DIR") or None)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=REGISTRO.reiniciar)
+
+# Dashboard
+CALLBACK_SEGUNDOS = REGISTRO.histogram(
+    "geo_callback_segundos", "Duración de los callbacks del dashboard.", ("callback",))
+ETAPA_SEGUNDOS = REGISTRO.histogram(
+    "geo_etapa_segundos", "Duración de cada etapa de la obtención y pintado de rutas.", ("etapa",))
+RUTAS_CACHE = REGISTRO.counter(
+    "geo_rutas_cache_total", "Resolución de rutas: acierto exacto, aproximado o fallo (OSRM).", ("resultado",))
+# OSRM
+OSRM_PETICIONES = REGISTRO.counter(
+    "geo_osrm_peticiones_total", "Peticiones a OSRM por resultado (ok, http_4xx, http_5xx, timeout, "
+    "conexion, circuito_abierto).", ("resultado",))
+OSRM_SEGUNDOS = REGISTRO.histogram("geo_osrm_segundos", "Latencia de las peticiones a OSRM.")
+# SQLite
+SQLITE_SEGUNDOS = REGISTRO.histogram(
+    "geo_sqlite_consulta_segundos", "Duración de las sentencias SQLite.", ("motor", "sentencia"))
+# ETL
+ETL_FILAS = REGISTRO.counter(
+    "geo_etl_filas_total", "Filas escritas por la ETL por tabla y operación.", ("tabla", "operacion"))
+ETL_SEGUNDOS = REGISTRO.histogram(
+    "geo_etl_segundos", "Duración de la descarga y guardado de cada tabla en la ETL.", ("tabla",),
+    cubetas=(1, 5, 15, 30, 60, 120, 300, 600, 1800))
+ETL_ULTIMA_EJECUCION = REGISTRO.gauge(
+    "geo_etl_ultima_ejecucion_timestamp", "Marca de tiempo Unix de la última ETL terminada.")
@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from logger import setup_logger
+from metrics import OSRM_PETICIONES, OSRM_SEGUNDOS
+
+logger = setup_logger("osrm_client")
+
+OSRM_URL_PUBLICA = "http://router.project-osrm.org/route/v1/driving/"
+
+
+class CircuitoAbiertoError(requests.exceptions.RequestException):
+    """Se lanza cuando el circuito está abierto y no se contacta con OSRM."""
+
+
+class CircuitBreaker:
+    """Circuit breaker simple (cerrado -> abierto -> semiabierto).
+
+    Tras ``umbral_fallos`` fallos consecutivos el circuito se abre y rechaza
+    peticiones durante ``tiempo_reset`` segundos. Pasado ese tiempo deja pasar
+    una única petición de prueba: si funciona se cierra, si no vuelve a abrirse.
+    """
+
+    def __init__(self, umbral_fallos=5, tiempo_reset=30.0) -> None:
+        self.umbral_fallos = umbral_fallos
+        self.tiempo_reset = tiempo_reset
+        self.estado = "cerrado"
+        self._fallos = 0
+        self._abierto_en = 0.0
+        self._lock = threading.Lock()
+
+    def permitir(self) -> bool:
+        with self._lock:
+            if self.estado == "cerrado":
+                return True
+            if self.estado == "abierto" and time.monotonic() - self._abierto_en >= self.tiempo_reset:
+                self.estado = "semiabierto"
+                return True
+            # Abierto, o semiabierto con la petición de prueba aún en curso
+            return False
+
+    def registrar_exito(self) -> None:
+        with self._lock:
+            self._fallos = 0
+            self.estado = "cerrado"
+
+    def registrar_fallo(self) -> None:
+        with self._lock:
+            self._fallos += 1
+            if self.estado == "semiabierto" or self._fallos >= self.umbral_fallos:
+                if self.estado != "abierto":
+                    logger.warning(f"Circuito OSRM abierto tras {self._fallos} fallos consecutivos.")
+                self.estado = "abierto"
+                self._abierto_en = time.monotonic()
+
+
+class OSRMClient:
+    """Cliente HTTP persistente para OSRM.
+
+    Mantiene una ``requests.Session`` con pool de conexiones keep-alive, timeouts
+    separados de conexión/lectura y circuit breaker; las latencias se registran
+    en ``metrics.OSRM_SEGUNDOS``. La URL base se toma de ``OSRM_BASE_URL`` si no
+    se indica, para poder apuntar a un OSRM propio o a un servidor simulado en
+    pruebas.
+    """
+
+    def __init__(self, base_url=None, pool_maxsize=16, connect_timeout=3.05,
+                 read_timeout=10, breaker: CircuitBreaker = None) -> None:
+        self.base_url = base_url or os.getenv("OSRM_BASE_URL", OSRM_URL_PUBLICA)
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.session = requests.Session()
+        # Sin reintentos a nivel de urllib3: los reintentos los decide el llamador
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @property
+    def base_url(self) -> str:
+        return self._base_url
+
+    @base_url.setter
+    def base_url(self, url: str) -> None:
+        # Normalizamos para poder concatenar las coordenadas directamente
+        self._base_url = url if url.endswith("/") else f"{url}/"
+
+    def route(self, lon_origen, lat_origen, lon_destino, lat_destino, params=None) -> dict:
+        """Pide una ruta a OSRM y devuelve el JSON de respuesta.
+
+        Raises:
+            CircuitoAbiertoError si el circuito está abierto.
+            requests.exceptions.RequestException si falla la petición.
+        """
+        if not self.breaker.permitir():
+            OSRM_PETICIONES.inc(resultado="circuito_abierto")
+            raise CircuitoAbiertoError("Circuito OSRM abierto: petición descartada.")
+
+        url = f"{self.base_url}{lon_origen},{lat_origen};{lon_destino},{lat_destino}"
+        inicio = time.perf_counter()
+        try:
+            response = self.session.get(url, params=params, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            self.breaker.registrar_fallo()
+            OSRM_PETICIONES.inc(resultado="timeout" if isinstance(e, requests.exceptions.Timeout) else "conexion")
+            raise
+        finally:
+            OSRM_SEGUNDOS.observe(time.perf_counter() - inicio)
+
+        # Los 4xx (p.ej. coordenadas inválidas) no indican que OSRM esté caído
+        if response.status_code >= 500:
+            self.breaker.registrar_fallo()
+            OSRM_PETICIONES.inc(resultado="http_5xx")
+        else:
+            self.breaker.registrar_exito()
+            OSRM_PETICIONES.inc(resultado="http_4xx" if response.status_code >= 400 else "ok")
+        response.raise_for_status()
+        return response.json()
+
+    def close(self) -> None:
+        self.session.close()
@@ -1,33 +1,237 @@
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING
 from database import DatabaseManager
-import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
 from logger import setup_logger
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 logger = setup_logger("process_manager")
 
-def procesar_rutas(cod_pedido: str) -> pd.DataFrame:
-    """""" 
-    query = """
-    SELECT p.pedido, p.codigoPlanta, p.codigoCargadero,
-           o.longitud as longitud_origen, o.latitud as latitud_origen, 
-           d.longitud as longitud_destino, d.latitud as latitud_destino
-    FROM planificaciones p
-    LEFT JOIN maestro_origenes o ON p.codigoCargadero = o.codigo
-    LEFT JOIN maestro_destinos d ON p.codigoPlanta = d.codigoPlanta
-    WHERE p.pedido = :cp
+# Engine compartido: no se crea uno nuevo en cada callback
+_db_manager = DatabaseManager()
+
+_QUERY_PEDIDO_MATERIALIZADA = """
+SELECT pedido, codigoPlanta, codigoCargadero,
+       longitud_origen, latitud_origen, longitud_destino, latitud_destino
+FROM pedido_coordenadas
+WHERE pedido = :cp
+"""
+_QUERY_PEDIDO = """
+SELECT p.pedido, p.codigoPlanta, p.codigoCargadero,
+       o.longitud as longitud_origen, o.latitud as latitud_origen, 
+       d.longitud as longitud_destino, d.latitud as latitud_destino
+FROM planificaciones p
+LEFT JOIN maestro_origenes o ON p.codigoCargadero = o.codigo
+LEFT JOIN maestro_destinos d ON p.codigoPlanta = d.codigoPlanta
+WHERE p.pedido = :cp
+"""
+
+
+def coordenadas_pedido(cod_pedido: str, db_manager: DatabaseManager = None) -> list:
+    """Coordenadas de origen y destino de las planificaciones de un pedido, sin pandas.
+
+    Camino del dashboard: lee la tabla materializada ``pedido_coordenadas``
+    (lectura indexada por pedido) o, si aún no existe (base de datos sin
+    refrescar tras la ETL), el cruce con los maestros.
+
+    Returns:
+        list de dicts con pedido, codigoPlanta, codigoCargadero y las cuatro
+        coordenadas (vacía si el pedido no existe).
+    """
+    db_manager = db_manager or _db_manager
+    params = {"cp": str(cod_pedido)}
+    with db_manager.read_engine.connect() as conn:
+        try:
+            filas = conn.execute(text(_QUERY_PEDIDO_MATERIALIZADA), params).mappings().all()
+        except OperationalError:
+            filas = conn.execute(text(_QUERY_PEDIDO), params).mappings().all()
+    return [dict(fila) for fila in filas]
+
+
+def procesar_rutas(cod_pedido: str, db_manager: DatabaseManager = None) -> "pd.DataFrame":
+    """Coordenadas de origen y destino de las planificaciones de un pedido.
+
+    Como ``coordenadas_pedido``, pero devuelve un DataFrame (vacío si no hay datos).
     """
+    import pandas as pd
+
     try:
-        db_manager = DatabaseManager()
-        pedidos_df = pd.read_sql(query, con=db_manager.engine, params={"cp": str(cod_pedido)})
-        if pedidos_df.empty:
+        filas = coordenadas_pedido(cod_pedido, db_manager)
+        if not filas:
             logger.warning(f"No se encontraron datos para el pedido: {cod_pedido}")
             return pd.DataFrame()
-        logger.info(f"Procesando rutas para cod_pedido: {cod_pedido} con {len(pedidos_df)} registros.")
-        return pedidos_df
+        logger.info(f"Procesando rutas para cod_pedido: {cod_pedido} con {len(filas)} registros.")
+        return pd.DataFrame(filas)
 
     except Exception as e:
         logger.error(f"Error al leer datos de la base de datos: {e}")
         return pd.DataFrame()
     
+def procesar_flota(fecha: str = None, cod_planta: str = None, pedidos: list = None,
+                   db_manager: DatabaseManager = None, limite: int = 5000) -> "pd.DataFrame":
+    """Planificaciones con coordenadas de origen/destino filtradas por fecha, planta y/o pedidos.
+
+    Args:
+        fecha: fecha prevista en formato de la API (``dd/mm/aaaa``).
+        cod_planta: código de planta de destino.
+        pedidos: lista de pedidos concretos.
+        limite: máximo de planificaciones devueltas.
+    Returns:
+        DataFrame con las columnas de ``procesar_rutas`` (vacío si no hay filtros o datos).
+    """
+    # pandas solo se carga con la primera vista de flota, no al arrancar el dashboard
+    import pandas as pd
+
+    condiciones = []
+    params = {"n": limite}
+    if fecha:
+        condiciones.append("p.fechaPrevista = :fecha")
+        params["fecha"] = fecha
+    if cod_planta:
+        condiciones.append("p.codigoPlanta = :planta")
+        params["planta"] = str(cod_planta)
+    if pedidos:
+        marcadores = []
+        for i, pedido in enumerate(pedidos):
+            params[f"p{i}"] = str(pedido)
+            marcadores.append(f":p{i}")
+        condiciones.append(f"p.pedido IN ({', '.join(marcadores)})")
+    if not condiciones:
+        return pd.DataFrame()
+
+    query = f"""
+    SELECT p.pedido, p.codigoPlanta, p.codigoCargadero,
+           o.longitud as longitud_origen, o.latitud as latitud_origen,
+           d.longitud as longitud_destino, d.latitud as latitud_destino
+    FROM planificaciones p
+    LEFT JOIN maestro_origenes o ON p.codigoCargadero = o.codigo
+    LEFT JOIN maestro_destinos d ON p.codigoPlanta = d.codigoPlanta
+    WHERE {' AND '.join(condiciones)}
+    LIMIT :n
+    """
+    try:
+        db_manager = db_manager or _db_manager
+        flota_df = pd.read_sql(query, con=db_manager.read_engine, params=params)
+        logger.info(f"Vista de flota: {len(flota_df)} planificaciones (fecha={fecha}, planta={cod_planta}).")
+        return flota_df
+    except Exception as e:
+        logger.error(f"Error al leer la flota de la base de datos: {e}")
+        return pd.DataFrame()
+
+
+def agrupar_pares_flota(flota_df: "pd.DataFrame") -> list:
+    """Agrupa las planificaciones de la flota por par (cargadero, planta) con coordenadas.
+
+    Cada par se dibuja una sola vez en el mapa con su número de cargas.
+
+    Returns:
+        list de dicts con coords (lon_o, lat_o, lon_d, lat_d), codigoCargadero,
+        codigoPlanta, cargas y pedidos.
+    """
+    columnas = ["longitud_origen", "latitud_origen", "longitud_destino", "latitud_destino"]
+    validas = flota_df.dropna(subset=columnas)
+    if validas.empty:
+        return []
+    grupos = validas.groupby(columnas + ["codigoCargadero", "codigoPlanta"], sort=False)["pedido"]
+    return [
+        {
+            "coords": (lo_o, la_o, lo_d, la_d),
+            "codigoCargadero": cargadero,
+            "codigoPlanta": planta,
+            "cargas": len(pedidos),
+            "pedidos": pedidos.astype(str).tolist(),
+        }
+        for (lo_o, la_o, lo_d, la_d, cargadero, planta), pedidos in grupos
+    ]
+
+
+def buscar_plantas(texto: str = "", limite: int = 50, db_manager: DatabaseManager = None) -> list:
+    """Plantas de destino cuyo código o nombre contiene ``texto``.
+
+    Returns:
+        list de tuplas (codigoPlanta, planta).
+    """
+    db_manager = db_manager or _db_manager
+    query = """
+    SELECT codigoPlanta, planta FROM maestro_destinos
+    WHERE codigoPlanta LIKE :t OR planta LIKE :t
+    ORDER BY codigoPlanta LIMIT :n
+    """
+    try:
+        with db_manager.read_engine.connect() as conn:
+            return [tuple(f) for f in conn.execute(text(query), {"t": f"%{texto or ''}%", "n": limite})]
+    except Exception as e:
+        logger.error(f"Error al buscar plantas: {e}")
+        return []
+
+
+class _CachePedidos:
+    """Caché pequeña de búsquedas de pedidos, invalidada por la versión de planificaciones."""
+
+    def __init__(self, max_entradas=256) -> None:
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, clave, version):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None or entrada[0] != version:
+                return None
+            self._datos.move_to_end(clave)
+            return entrada[1]
+
+    def put(self, clave, version, valor) -> None:
+        with self._lock:
+            self._datos[clave] = (version, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+
+_cache_pedidos = _CachePedidos()
+
+
+def buscar_pedidos(prefijo: str = "", limite: int = 50, db_manager: DatabaseManager = None) -> list:
+    """Pedidos distintos que empiezan por ``prefijo`` (como mucho ``limite``).
+
+    Usa un rango sobre el índice de ``planificaciones.pedido`` en lugar de leer
+    la tabla completa. Los resultados se cachean hasta que la ETL cambia la
+    versión de la tabla.
+    """
+    db_manager = db_manager or _db_manager
+    prefijo = (prefijo or "").strip()
+    version = db_manager.version_tabla("planificaciones")
+    clave = (db_manager.db_name, prefijo, limite)
+    pedidos = _cache_pedidos.get(clave, version)
+    if pedidos is not None:
+        return pedidos
+
+    if prefijo:
+        # pedido >= 'abc' AND pedido < 'abd': búsqueda por prefijo con el índice
+        query = """
+        SELECT DISTINCT pedido FROM planificaciones
+        WHERE pedido >= :inicio AND pedido < :fin
+        ORDER BY pedido LIMIT :n
+        """
+        params = {"inicio": prefijo, "fin": prefijo[:-1] + chr(ord(prefijo[-1]) + 1), "n": limite}
+    else:
+        query = "SELECT DISTINCT pedido FROM planificaciones ORDER BY pedido LIMIT :n"
+        params = {"n": limite}
+    try:
+        with db_manager.read_engine.connect() as conn:
+            pedidos = [str(fila[0]) for fila in conn.execute(text(query), params) if fila[0] is not None]
+    except Exception as e:
+        logger.error(f"Error al buscar pedidos: {e}")
+        return []
+    _cache_pedidos.put(clave, version, pedidos)
+    return pedidos
+
+
 if __name__ == "__main__":
     # Ejemplo de uso
     df =procesar_rutas("2800759255040")
@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logger import setup_logger
+
+logger = setup_logger("resolucion_rutas")
+
+
+class ResolutorRutas:
+    """Resuelve en segundo plano las rutas que no están en caché.
+
+    El callback del dashboard responde en cuanto encola la ruta y el navegador
+    sondea su estado, de modo que un fallo de caché (hasta el timeout de OSRM)
+    no ocupa el hilo que atiende la petición. Las rutas se guardan en
+    cache_rutas, así que cualquier worker puede recoger el resultado; los
+    envíos repetidos de la misma ruta se agrupan en un único futuro.
+    """
+
+    def __init__(self, route_provider, max_workers=4, retencion=120.0) -> None:
+        self.route_provider = route_provider
+        self.max_workers = max_workers
+        self.retencion = retencion
+        self._pool = None
+        self._pid = None
+        self._tareas = {}  # route_id -> (futuro, inicio)
+        self._lock = threading.Lock()
+
+    def _pool_del_proceso(self) -> ThreadPoolExecutor:
+        # Los hilos no sobreviven al fork de Gunicorn: un pool por worker
+        if self._pid != os.getpid():
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ruta")
+            self._tareas = {}
+            self._pid = os.getpid()
+        return self._pool
+
+    def enviar(self, route_id, coords, nivel=0) -> None:
+        """Encola la resolución de ``route_id`` si no está ya en curso en este proceso."""
+        with self._lock:
+            pool = self._pool_del_proceso()
+            tarea = self._tareas.get(route_id)
+            if tarea is not None and not tarea[0].done():
+                return
+            # Las terminadas se conservan un rato para que el sondeo vea su estado
+            ahora = time.monotonic()
+            for rid, (f, inicio) in list(self._tareas.items()):
+                if f.done() and ahora - inicio > self.retencion:
+                    del self._tareas[rid]
+            futuro = pool.submit(self.route_provider.get_route, *coords, nivel=nivel)
+            self._tareas[route_id] = (futuro, ahora)
+
+    def estado(self, route_id) -> str:
+        """``"en_cola"``, ``"calculando"``, ``"error"``, ``"terminada"`` o None si este proceso no la conoce."""
+        with self._lock:
+            tarea = self._tareas.get(route_id) if self._pid == os.getpid() else None
+        if tarea is None:
+            return None
+        futuro = tarea[0]
+        if futuro.running():
+            return "calculando"
+        if not futuro.done():
+            return "en_cola"
+        if futuro.cancelled() or futuro.exception() is not None or futuro.result() is None:
+            return "error"
+        return "terminada"
+
+    def cancelar(self, route_id) -> bool:
+        """Cancela la tarea si aún está en cola.
+
+        Una consulta a OSRM ya en curso no se interrumpe: termina y se guarda
+        en caché para la próxima vez.
+        """
+        with self._lock:
+            tarea = self._tareas.pop(route_id, None) if self._pid == os.getpid() else None
+        if tarea is None:
+            return False
+        cancelada = tarea[0].cancel()
+        logger.info(f"Ruta {route_id} {'cancelada' if cancelada else 'abandonada (ya en curso)'}.")
+        return cancelada
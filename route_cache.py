@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from logger import setup_logger
+
+logger = setup_logger("route_cache")
+
+
+class RouteCache:
+    """Caché LRU en memoria para rutas ya decodificadas.
+
+    Se sitúa delante de la tabla ``cache_rutas``: guarda el diccionario de
+    geometría ya convertido (sin ``json.loads``) indexado por el ``route_id``
+    de ``RouteProvider._generar_id_ruta``. El tamaño se limita tanto por número
+    de entradas como por bytes aproximados, y cada entrada caduca ``ttl``
+    segundos después de su ``updated_at`` en la base de datos. Con ``ttl=None``
+    las entradas no caducan, igual que las filas de ``cache_rutas``.
+
+    Con ``servir_caducadas=True`` las entradas caducadas se conservan y se
+    devuelven marcadas (``get_con_estado``) para que el llamador las refresque
+    mientras las sigue sirviendo (stale-while-revalidate).
+    """
+
+    def __init__(self, max_entradas=512, max_bytes=64 * 1024 * 1024, ttl=None, servir_caducadas=False) -> None:
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.servir_caducadas = servir_caducadas
+        self._datos = OrderedDict()  # route_id -> (ruta, bytes, expira_en)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _a_timestamp(updated_at) -> float:
+        """Convierte el ``updated_at`` de SQLite (texto o datetime) a epoch."""
+        if updated_at is None:
+            return time.time()
+        if isinstance(updated_at, datetime):
+            return updated_at.timestamp()
+        if isinstance(updated_at, (int, float)):
+            return float(updated_at)
+        try:
+            return datetime.fromisoformat(str(updated_at)).timestamp()
+        except ValueError:
+            return time.time()
+
+    def get(self, route_id):
+        """Devuelve la ruta cacheada o None si no existe (o ha caducado y no se sirven caducadas)."""
+        return self.get_con_estado(route_id)[0]
+
+    def get_con_estado(self, route_id) -> tuple:
+        """Como ``get``, pero devuelve ``(ruta, caducada)``."""
+        with self._lock:
+            entrada = self._datos.get(route_id)
+            if entrada is None:
+                self.misses += 1
+                return None, False
+            ruta, _, expira_en = entrada
+            caducada = expira_en <= time.time()
+            if caducada and not self.servir_caducadas:
+                self._eliminar(route_id)
+                self.misses += 1
+                return None, False
+            self._datos.move_to_end(route_id)
+            self.hits += 1
+            return ruta, caducada
+
+    def put(self, route_id, ruta: dict, tamano: int, updated_at=None) -> None:
+        """Inserta una ruta con su tamaño aproximado en bytes (p.ej. longitud del GeoJSON)."""
+        if self.ttl is None:
+            expira_en = float("inf")
+        else:
+            expira_en = self._a_timestamp(updated_at) + self.ttl
+        if tamano > self.max_bytes or (expira_en <= time.time() and not self.servir_caducadas):
+            return
+        with self._lock:
+            if route_id in self._datos:
+                self._eliminar(route_id)
+            self._datos[route_id] = (ruta, tamano, expira_en)
+            self._bytes += tamano
+            while len(self._datos) > self.max_entradas or self._bytes > self.max_bytes:
+                _, (_, tamano_viejo, _) = self._datos.popitem(last=False)
+                self._bytes -= tamano_viejo
+                self.evictions += 1
+
+    def _eliminar(self, route_id) -> None:
+        _, tamano, _ = self._datos.pop(route_id)
+        self._bytes -= tamano
+
+    def invalidar(self, route_id=None) -> None:
+        """Elimina una ruta concreta (con todos sus niveles) o vacía la caché completa."""
+        with self._lock:
+            if route_id is None:
+                self._datos.clear()
+                self._bytes = 0
+                return
+            prefijo = f"{route_id}:"
+            for clave in [c for c in self._datos if c == route_id or c.startswith(prefijo)]:
+                self._eliminar(clave)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entradas": len(self._datos),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
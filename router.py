@@ -1,19 +1,82 @@
-import requests
-import json
 import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import pandas as pd
+import numpy as np
+from sqlalchemy import text
+from geometry import (
+    NIVELES_SIMPLIFICACION, comprimir_geometria, descomprimir_geometria,
+    douglas_peucker, niveles_simplificados, tamano_en_memoria,
+)
+from distancias import celda_grid, celdas_vecinas, haversine
 from logger import setup_logger
+from metrics import ETAPA_SEGUNDOS, RUTAS_CACHE
+from route_cache import RouteCache
+from osrm_client import OSRMClient
+from single_flight import SingleFlight, SQLiteLease
 
 
 logger = setup_logger("route_provider")
 
+# Días tras los que una ruta de cache_rutas se considera caducada: se sigue
+# sirviendo pero se vuelve a pedir a OSRM en segundo plano (0 = nunca caduca)
+TTL_RUTAS_DIAS = float(os.getenv("RUTAS_TTL_DIAS", "30"))
+# Los accesos a rutas cacheadas se acumulan en memoria y se escriben en bloque
+INTERVALO_ACCESOS = 30.0
+
 
 
 class RouteProvider:
-    def __init__(self, db_manager):
+    def __init__(self, db_manager, cache: RouteCache = None, osrm: OSRMClient = None, tolerancia_m=None,
+                 ttl_dias=None):
+        """
+        Args:
+            tolerancia_m: radio (metros) dentro del cual se reutiliza una ruta
+                cacheada cuyos extremos no coinciden exactamente con los pedidos.
+                Por defecto ``RUTAS_TOLERANCIA_M``; 0 desactiva el modo aproximado.
+            ttl_dias: antigüedad a partir de la cual una ruta se refresca en
+                segundo plano (stale-while-revalidate). Por defecto ``RUTAS_TTL_DIAS``.
+        """
         self.db_manager = db_manager
-        self.base_url = "http://router.project-osrm.org/route/v1/driving/"
+        self.ttl = (TTL_RUTAS_DIAS if ttl_dias is None else ttl_dias) * 86400 or None
+        self._refrescando = set()  # route_id con un refresco en curso en este proceso
+        self._pool_refresco = None
+        self._pid_refresco = None
+        self._accesos = {}  # route_id -> (último acceso, aciertos pendientes de escribir)
+        self._ultimo_volcado_accesos = time.monotonic()
+        self._lock_accesos = threading.Lock()
+        if tolerancia_m is None:
+            tolerancia_m = float(os.getenv("RUTAS_TOLERANCIA_M", "0"))
+        self.tolerancia_m = tolerancia_m
+        self._contadores = {"aciertos_exactos": 0, "aciertos_aproximados": 0, "consultas_osrm": 0}
+        self._lock_contadores = threading.Lock()
+        # Cliente HTTP persistente (keep-alive, timeouts y circuit breaker)
+        self.osrm = osrm if osrm is not None else OSRMClient()
+        # Capa en memoria delante de cache_rutas (geometría ya decodificada). Sus
+        # entradas caducan con el mismo TTL pero se siguen sirviendo mientras se
+        # refrescan; el refresco las invalida para que se lea la ruta nueva
+        self.cache = cache if cache is not None else RouteCache(ttl=self.ttl, servir_caducadas=True)
+        # Coalescencia de fallos de caché: entre hilos (SingleFlight) y entre workers (lease)
+        self._coalescer = SingleFlight()
+        self.lease = None
+        self.intervalo_espera = 0.05
+        # La tabla de caché se crea al arrancar, no en cada consulta
+        if self.db_manager is not None:
+            self.db_manager.crear_tablas_cache()
+            self.lease = SQLiteLease(db_manager, duracion=sum(self.osrm.timeout) + 5)
+            self.lease.crear_tabla()
+            if self.tolerancia_m:
+                self.indexar_extremos()
+
+    @property
+    def base_url(self) -> str:
+        return self.osrm.base_url
+
+    @base_url.setter
+    def base_url(self, url: str) -> None:
+        self.osrm.base_url = url
 
     def _generar_id_ruta(self, lon1, lat1, lon2, lat2):
         """Crea un ID único para un par de coordenadas (redondeando a 5 decimales)."""
@@ -21,82 +84,550 @@ class RouteProvider:
         s = f"{round(lon1,5)},{round(lat1,5)}-{round(lon2,5)},{round(lat2,5)}"
         return hashlib.md5(s.encode()).hexdigest()
 
-    def get_route(self, lon_origen, lat_origen, lon_destino, lat_destino):
-        route_id = self._generar_id_ruta(lon_origen, lat_origen, lon_destino, lat_destino)
-        self.db_manager.crear_tablas_cache()
-        # 1. Intentar buscar en la base de datos local
-        query = "SELECT * FROM cache_rutas WHERE route_id = :rid"
+    def get_route(self, lon_origen, lat_origen, lon_destino, lat_destino, nivel=0):
+        """Devuelve la ruta entre dos puntos (memoria -> cache_rutas -> OSRM).
+
+        Args:
+            nivel: nivel de simplificación de la geometría (0 = completa, ver
+                ``geometry.NIVELES_SIMPLIFICACION`` y ``geometry.nivel_para_zoom``).
+        """
         try:
-            cache = pd.read_sql(query, con=self.db_manager.engine, params={"rid": route_id})
-            if not cache.empty:
-                logger.info(">>> Ruta recuperada de la CACHÉ local.")
-                res = cache.iloc[0]
-                return {
-                    "geometria": json.loads(res['geometria']), # Convertir string a diccionario
-                    "distancia_km": res['distancia_km'],
-                    "duracion_min": res['duracion_min']
-                }
+            ruta = self.buscar_en_cache(lon_origen, lat_origen, lon_destino, lat_destino, nivel)
         except Exception as e:
             logger.error(f"Error consultando caché: {e}")
             return None
-        
-        # 2. Si no está en caché, llamar a OSRM (lo que ya tenías)
-        logger.info(">>> Ruta no encontrada. Consultando OSRM...")
-        coords = f"{lon_origen},{lat_origen};{lon_destino},{lat_destino}"
-        url = f"{self.base_url}{coords}"
-        
-        # Pedimos explícitamente el resumen y la geometría en formato geojson
-        params = {
-            "overview": "full",
-            "geometries": "geojson"
-        }
+        if ruta is not None:
+            return ruta
+
+        route_id = self._generar_id_ruta(lon_origen, lat_origen, lon_destino, lat_destino)
+        clave_cache = route_id if not nivel else f"{route_id}:{nivel}"
+        # 2. Si no está en caché, llamar a OSRM. Los fallos simultáneos de la misma
+        # ruta (hilos de este proceso y otros workers) se resuelven con una sola llamada.
         try:
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
+            with ETAPA_SEGUNDOS.tiempo(etapa="osrm"):
+                info = self._coalescer.do(
+                    route_id, lambda: self._resolver_fallo(route_id, lon_origen, lat_origen, lon_destino, lat_destino)
+                )
         except Exception as e:
             logger.error(f"Error llamando a OSRM: {e}")
             return None
 
-        if data.get("code") == "Ok":
-            route = data["routes"][0]
-            info = {
-                "route_id": route_id,
-                "geometria": json.dumps(route["geometry"]), # Convertir diccionario a string
-                "distancia_km": round(route["distance"] / 1000, 2),
-                "duracion_min": round(route["duration"] / 60, 2),
-                "updated_at": datetime.now()
-            }
-            
-            # 3. Guardar en SQLite para la próxima vez
-            df_save = pd.DataFrame([info])
-            df_save.to_sql("cache_rutas", con=self.db_manager.engine, if_exists='append', index=False)
-            
+        if info is not None:
             # Devolver formato limpio
-            logger.info(">>> Ruta guardada en la CACHÉ local.")
-            return {
-                "geometria": route["geometry"],
+            geometria = info["geometria"]
+            if nivel:
+                coords = douglas_peucker(geometria["coordinates"], NIVELES_SIMPLIFICACION[nivel]).tolist()
+                geometria = {"type": geometria["type"], "coordinates": coords}
+            ruta = {
+                "geometria": geometria,
                 "distancia_km": info["distancia_km"],
                 "duracion_min": info["duracion_min"]
             }
+            self.cache.put(clave_cache, ruta, tamano_en_memoria(geometria), info["updated_at"])
+            return dict(ruta)
         logger.error("Error: OSRM no devolvió una ruta válida.")
         return None
-        
-if __name__ == "__main__":    
+
+    def buscar_en_cache(self, lon_origen, lat_origen, lon_destino, lat_destino, nivel=0):
+        """Ruta desde la caché en memoria o cache_rutas, sin llegar a consultar OSRM.
+
+        Returns:
+            dict de la ruta, o None si no está cacheada.
+        """
+        route_id = self._generar_id_ruta(lon_origen, lat_origen, lon_destino, lat_destino)
+        clave_cache = route_id if not nivel else f"{route_id}:{nivel}"
+        # 0. Caché en memoria: sin SQLite ni pandas
+        ruta, caducada = self.cache.get_con_estado(clave_cache)
+        if ruta is not None:
+            logger.debug(">>> Ruta recuperada de la CACHÉ en memoria.")
+            self._servida_de_memoria(route_id, ruta, caducada, (lon_origen, lat_origen, lon_destino, lat_destino))
+            return dict(ruta)
+
+        # 1. Intentar buscar en la base de datos local
+        query = """
+        SELECT COALESCE(n.geometria, c.geometria), c.formato, c.distancia_km, c.duracion_min, c.updated_at
+        FROM cache_rutas c
+        LEFT JOIN cache_rutas_niveles n ON n.route_id = c.route_id AND n.nivel = :nivel
+        WHERE c.route_id = :rid
+        """
+        with ETAPA_SEGUNDOS.tiempo(etapa="cache_sqlite"), self.db_manager.read_engine.connect() as conn:
+            res = conn.execute(text(query), {"rid": route_id, "nivel": nivel}).first()
+        if res is not None:
+            logger.info(">>> Ruta recuperada de la CACHÉ local.")
+            geometria, formato, distancia_km, duracion_min, updated_at = res
+            ruta = {
+                "geometria": descomprimir_geometria(geometria, formato),
+                "distancia_km": distancia_km,
+                "duracion_min": duracion_min
+            }
+            self.cache.put(clave_cache, ruta, tamano_en_memoria(ruta["geometria"]), updated_at)
+            self._contar("aciertos_exactos")
+            self._registrar_acceso(route_id)
+            if self._caducada(updated_at):
+                # Stale-while-revalidate: se sirve la ruta antigua y se refresca aparte
+                self._refrescar_en_segundo_plano(route_id, (lon_origen, lat_origen, lon_destino, lat_destino))
+            return dict(ruta)
+        # 1b. Modo con tolerancia: ruta cacheada con extremos cercanos
+        if self.tolerancia_m:
+            with ETAPA_SEGUNDOS.tiempo(etapa="cache_aproximada"):
+                ruta, updated_at = self._buscar_aproximada(lon_origen, lat_origen, lon_destino, lat_destino, nivel)
+            if ruta is not None:
+                logger.info(f">>> Ruta aproximada de la CACHÉ local (desvío {ruta['desvio_m']} m).")
+                self.cache.put(clave_cache, ruta, tamano_en_memoria(ruta["geometria"]), updated_at)
+                self._contar("aciertos_aproximados")
+                self._registrar_acceso(ruta["route_id_cache"])
+                return dict(ruta)
+        return None
+
+    def get_routes(self, pares, nivel=0, max_workers=8, resolver_fallos=True) -> dict:
+        """Resuelve muchas rutas a la vez (vista de flota).
+
+        Primero la caché en memoria, después una consulta ``WHERE route_id IN
+        (...)`` por bloques sobre cache_rutas y, para las que falten, llamadas
+        en paralelo a ``get_route`` (con su coalescencia de fallos).
+
+        Args:
+            pares: iterable de tuplas (lon_origen, lat_origen, lon_destino, lat_destino).
+            resolver_fallos: si es False no se consulta OSRM; las rutas que no
+                estén en caché quedan fuera del resultado (el dashboard las
+                envía a ``ResolutorRutas``).
+        Returns:
+            dict route_id -> ruta (sin las que no se hayan podido obtener).
+        """
+        pendientes = {}
+        for par in pares:
+            pendientes.setdefault(self._generar_id_ruta(*par), par)
+
+        rutas = {}
+        for route_id in list(pendientes):
+            ruta, caducada = self.cache.get_con_estado(route_id if not nivel else f"{route_id}:{nivel}")
+            if ruta is not None:
+                self._servida_de_memoria(route_id, ruta, caducada, pendientes[route_id])
+                rutas[route_id] = dict(ruta)
+                del pendientes[route_id]
+
+        ids = list(pendientes)
+        query = """
+        SELECT c.route_id, COALESCE(n.geometria, c.geometria), c.formato,
+               c.distancia_km, c.duracion_min, c.updated_at
+        FROM cache_rutas c
+        LEFT JOIN cache_rutas_niveles n ON n.route_id = c.route_id AND n.nivel = :nivel
+        WHERE c.route_id IN ({marcadores})
+        """
+        try:
+            with self.db_manager.read_engine.connect() as conn:
+                for inicio in range(0, len(ids), 500):
+                    bloque = ids[inicio:inicio + 500]
+                    params = {f"r{i}": rid for i, rid in enumerate(bloque)}
+                    params["nivel"] = nivel
+                    sql = query.format(marcadores=", ".join(f":r{i}" for i in range(len(bloque))))
+                    for route_id, geometria, formato, distancia_km, duracion_min, updated_at in conn.execute(text(sql), params):
+                        ruta = {
+                            "geometria": descomprimir_geometria(geometria, formato),
+                            "distancia_km": distancia_km,
+                            "duracion_min": duracion_min
+                        }
+                        clave_cache = route_id if not nivel else f"{route_id}:{nivel}"
+                        self.cache.put(clave_cache, ruta, tamano_en_memoria(ruta["geometria"]), updated_at)
+                        self._contar("aciertos_exactos")
+                        self._registrar_acceso(route_id)
+                        if self._caducada(updated_at):
+                            self._refrescar_en_segundo_plano(route_id, pendientes[route_id])
+                        rutas[route_id] = dict(ruta)
+                        del pendientes[route_id]
+        except Exception as e:
+            logger.error(f"Error consultando caché: {e}")
+
+        if pendientes and resolver_fallos:
+            logger.info(f">>> {len(pendientes)} rutas de la flota no están en caché. Consultando OSRM...")
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                resultados = pool.map(lambda par: self.get_route(*par, nivel=nivel), pendientes.values())
+                for route_id, ruta in zip(list(pendientes), resultados):
+                    if ruta is not None:
+                        rutas[route_id] = ruta
+        return rutas
+
+    _RESULTADOS_METRICA = {
+        "aciertos_exactos": "exacto", "aciertos_aproximados": "aproximado", "consultas_osrm": "fallo",
+    }
+
+    def _contar(self, contador: str) -> None:
+        with self._lock_contadores:
+            self._contadores[contador] += 1
+        RUTAS_CACHE.inc(resultado=self._RESULTADOS_METRICA[contador])
+
+    def estadisticas(self) -> dict:
+        """Aciertos exactos/aproximados, consultas a OSRM y estado de la caché en memoria."""
+        with self._lock_contadores:
+            resumen = dict(self._contadores)
+        aciertos = resumen["aciertos_exactos"] + resumen["aciertos_aproximados"]
+        total = aciertos + resumen["consultas_osrm"]
+        resumen["tasa_aciertos"] = round(aciertos / total, 4) if total else 0.0
+        resumen["memoria"] = self.cache.stats()
+        return resumen
+
+    def _servida_de_memoria(self, route_id, ruta, caducada, coords) -> None:
+        self._contar("aciertos_aproximados" if ruta.get("aproximada") else "aciertos_exactos")
+        self._registrar_acceso(ruta.get("route_id_cache", route_id))
+        # Las aproximadas son de otra ruta (sin sus extremos): se refrescan al leerse de SQLite
+        if caducada and not ruta.get("aproximada"):
+            self._refrescar_en_segundo_plano(route_id, coords)
+
+    def _caducada(self, updated_at) -> bool:
+        return self.ttl is not None and time.time() - RouteCache._a_timestamp(updated_at) > self.ttl
+
+    def _refrescar_en_segundo_plano(self, route_id, coords) -> None:
+        """Vuelve a pedir a OSRM una ruta caducada sin hacer esperar al llamador."""
+        with self._lock_accesos:
+            if route_id in self._refrescando:
+                return  # ya en curso
+            self._refrescando.add(route_id)
+            # Los hilos no sobreviven al fork de Gunicorn: un pool por proceso
+            if self._pid_refresco != os.getpid():
+                self._pool_refresco = ThreadPoolExecutor(max_workers=2, thread_name_prefix="refresco")
+                self._pid_refresco = os.getpid()
+            pool = self._pool_refresco
+        pool.submit(self.refrescar_ruta, route_id, coords)
+
+    def refrescar_ruta(self, route_id, coords) -> bool:
+        """Sustituye una ruta de cache_rutas por la respuesta actual de OSRM.
+
+        Solo la refresca un proceso a la vez (lease de ``route_id``); si otro
+        ya lo hizo, basta con descartar la copia en memoria. Si OSRM falla se
+        sigue sirviendo la ruta antigua y el siguiente acceso lo reintenta (con
+        OSRM caído, el circuit breaker de ``OSRMClient`` corta esos reintentos).
+
+        Returns:
+            True si la ruta de cache_rutas está al día.
+        """
+        try:
+            if self.lease is not None and not self.lease.adquirir(route_id):
+                return False
+            try:
+                if self._caducada(self._updated_at_cache(route_id)):
+                    info = self.consultar_osrm(*coords)
+                    if info is None:
+                        return False
+                    self.guardar_rutas([info])
+                    logger.info(f">>> Ruta {route_id} caducada refrescada desde OSRM.")
+                self.cache.invalidar(route_id)
+            finally:
+                if self.lease is not None:
+                    self.lease.liberar(route_id)
+        except Exception as e:
+            logger.warning(f"No se pudo refrescar la ruta {route_id}: {e}")
+            return False
+        finally:
+            with self._lock_accesos:
+                self._refrescando.discard(route_id)
+        return True
+
+    def _updated_at_cache(self, route_id):
+        """``updated_at`` actual de la ruta en cache_rutas (None si no está)."""
+        if self.db_manager is None:
+            return None
+        with self.db_manager.read_engine.connect() as conn:
+            return conn.execute(text("SELECT updated_at FROM cache_rutas WHERE route_id = :rid"),
+                                {"rid": route_id}).scalar()
+
+    def _registrar_acceso(self, route_id) -> None:
+        ahora = time.time()
+        with self._lock_accesos:
+            _, aciertos = self._accesos.get(route_id, (0.0, 0))
+            self._accesos[route_id] = (ahora, aciertos + 1)
+            volcar = time.monotonic() - self._ultimo_volcado_accesos >= INTERVALO_ACCESOS
+            if volcar:
+                self._ultimo_volcado_accesos = time.monotonic()
+        if volcar:
+            threading.Thread(target=self.volcar_accesos, daemon=True).start()
+
+    def volcar_accesos(self) -> int:
+        """Escribe en cache_rutas los accesos acumulados (último acceso y aciertos).
+
+        Returns:
+            Número de rutas actualizadas.
+        """
+        with self._lock_accesos:
+            accesos, self._accesos = self._accesos, {}
+        if not accesos or self.db_manager is None:
+            return 0
+        try:
+            with self.db_manager.engine.begin() as conn:
+                conn.execute(text("""
+                UPDATE cache_rutas
+                SET ultimo_acceso = MAX(COALESCE(ultimo_acceso, 0), :t),
+                    aciertos = COALESCE(aciertos, 0) + :n
+                WHERE route_id = :rid
+                """), [{"rid": rid, "t": t, "n": n} for rid, (t, n) in accesos.items()])
+        except Exception as e:
+            logger.warning(f"No se pudieron guardar los accesos a la caché: {e}")
+            return 0
+        return len(accesos)
+
+    def _buscar_aproximada(self, lon_origen, lat_origen, lon_destino, lat_destino, nivel=0):
+        """Ruta cacheada cuyos extremos estén a menos de ``tolerancia_m`` de los pedidos.
+
+        Busca candidatas por las celdas de la rejilla vecinas de ambos extremos,
+        elige la de menor desvío máximo y empalma tramos rectos desde el origen
+        pedido hasta el inicio de la ruta y desde su final hasta el destino.
+
+        Returns:
+            tuple (ruta, updated_at), o (None, None) si no hay ninguna dentro del radio.
+        """
+        celdas_o = celdas_vecinas(lon_origen, lat_origen, self.tolerancia_m)
+        celdas_d = celdas_vecinas(lon_destino, lat_destino, self.tolerancia_m)
+        params = {f"o{i}": c for i, c in enumerate(celdas_o)}
+        params.update({f"d{i}": c for i, c in enumerate(celdas_d)})
+        params["nivel"] = nivel
+        query = f"""
+        SELECT c.lon_origen, c.lat_origen, c.lon_destino, c.lat_destino,
+               COALESCE(n.geometria, c.geometria), c.formato, c.distancia_km, c.duracion_min, c.updated_at,
+               c.route_id
+        FROM cache_rutas c
+        LEFT JOIN cache_rutas_niveles n ON n.route_id = c.route_id AND n.nivel = :nivel
+        WHERE c.celda_origen IN ({", ".join(f":o{i}" for i in range(len(celdas_o)))})
+          AND c.celda_destino IN ({", ".join(f":d{i}" for i in range(len(celdas_d)))})
+        """
+        with self.db_manager.read_engine.connect() as conn:
+            candidatas = conn.execute(text(query), params).all()
+        if not candidatas:
+            return None, None
+
+        extremos = np.array([fila[:4] for fila in candidatas], dtype=float)
+        desvios = 1000 * np.maximum(
+            haversine(lon_origen, lat_origen, extremos[:, 0], extremos[:, 1]),
+            haversine(lon_destino, lat_destino, extremos[:, 2], extremos[:, 3]),
+        )
+        mejor = int(np.argmin(desvios))
+        if desvios[mejor] > self.tolerancia_m:
+            return None, None
+
+        geometria, formato, distancia_km, duracion_min, updated_at, route_id_cache = candidatas[mejor][4:]
+        coords = descomprimir_geometria(geometria, formato)["coordinates"]
+        # Conectores rectos entre los puntos pedidos y los extremos de la ruta
+        inicio, fin = [lon_origen, lat_origen], [lon_destino, lat_destino]
+        conectores_km = float(haversine(*inicio, *coords[0]) + haversine(*coords[-1], *fin)) if coords else 0.0
+        ruta = {
+            "geometria": {"type": "LineString", "coordinates": [inicio] + coords + [fin]},
+            "distancia_km": round(distancia_km + conectores_km, 2) if distancia_km is not None else None,
+            "duracion_min": duracion_min,
+            "aproximada": True,
+            "desvio_m": round(float(desvios[mejor]), 1),
+            "route_id_cache": route_id_cache,
+        }
+        return ruta, updated_at
+
+    def indexar_extremos(self) -> int:
+        """Rellena extremos y celdas de las rutas cacheadas que aún no los tienen.
+
+        Las filas anteriores al modo con tolerancia solo guardan el hash; sus
+        coordenadas se recuperan de los pares de ``pedido_coordenadas``.
+
+        Returns:
+            Número de rutas indexadas.
+        """
+        with self.db_manager.engine.connect() as conn:
+            sin_indice = {r[0] for r in conn.execute(text("SELECT route_id FROM cache_rutas WHERE celda_origen IS NULL"))}
+            if not sin_indice or not self.db_manager._existe_tabla(conn, "pedido_coordenadas"):
+                return 0
+            pares = conn.execute(text("""
+            SELECT DISTINCT longitud_origen, latitud_origen, longitud_destino, latitud_destino
+            FROM pedido_coordenadas
+            WHERE longitud_origen IS NOT NULL AND latitud_origen IS NOT NULL
+              AND longitud_destino IS NOT NULL AND latitud_destino IS NOT NULL
+            """)).all()
+
+        filas = []
+        for par in pares:
+            route_id = self._generar_id_ruta(*par)
+            if route_id in sin_indice:
+                sin_indice.discard(route_id)
+                filas.append({"route_id": route_id, **self._columnas_extremos(par)})
+        if filas:
+            with self.db_manager.engine.begin() as conn:
+                conn.execute(text("""
+                UPDATE cache_rutas SET lon_origen = :lon_origen, lat_origen = :lat_origen,
+                    lon_destino = :lon_destino, lat_destino = :lat_destino,
+                    celda_origen = :celda_origen, celda_destino = :celda_destino
+                WHERE route_id = :route_id
+                """), filas)
+            logger.info(f"Extremos indexados para {len(filas)} rutas de la caché.")
+        return len(filas)
+
+    @staticmethod
+    def _columnas_extremos(extremos) -> dict:
+        """Columnas de extremos y celdas de cache_rutas (todas None si no se conocen)."""
+        if extremos is None:
+            return dict.fromkeys(("lon_origen", "lat_origen", "lon_destino", "lat_destino",
+                                  "celda_origen", "celda_destino"))
+        lon_o, lat_o, lon_d, lat_d = extremos
+        return {
+            "lon_origen": lon_o, "lat_origen": lat_o, "lon_destino": lon_d, "lat_destino": lat_d,
+            "celda_origen": celda_grid(lon_o, lat_o), "celda_destino": celda_grid(lon_d, lat_d),
+        }
+
+    def _resolver_fallo(self, route_id, lon_origen, lat_origen, lon_destino, lat_destino):
+        """Obtiene una ruta ausente de la caché coordinándose con otros procesos.
+
+        Quien consigue el lease de ``route_id`` consulta OSRM y guarda el
+        resultado; el resto espera a que la ruta aparezca en ``cache_rutas``. Si
+        el propietario del lease falla o tarda más que el lease, se consulta OSRM
+        directamente.
+        """
+        coords = (lon_origen, lat_origen, lon_destino, lat_destino)
+        if self.lease is None:
+            return self._consultar_y_guardar(*coords)
+
+        plazo = time.monotonic() + self.lease.duracion
+        while True:
+            if self.lease.adquirir(route_id):
+                try:
+                    # Otro worker pudo guardarla justo antes de liberar su lease
+                    info = self._leer_cache(route_id)
+                    return info if info is not None else self._consultar_y_guardar(*coords)
+                finally:
+                    self.lease.liberar(route_id)
+
+            logger.info(">>> Ruta en cálculo por otro proceso. Esperando...")
+            while self.lease.activo(route_id) and time.monotonic() < plazo:
+                time.sleep(self.intervalo_espera)
+            info = self._leer_cache(route_id)
+            if info is not None:
+                return info
+            if time.monotonic() >= plazo:
+                return self._consultar_y_guardar(*coords)
+            # El propietario soltó el lease sin guardar la ruta: lo intentamos nosotros
+
+    def _leer_cache(self, route_id):
+        """Ruta completa de cache_rutas en el formato de ``consultar_osrm`` (o None)."""
+        query = """
+        SELECT geometria, formato, distancia_km, duracion_min, updated_at
+        FROM cache_rutas WHERE route_id = :rid
+        """
+        with self.db_manager.read_engine.connect() as conn:
+            res = conn.execute(text(query), {"rid": route_id}).first()
+        if res is None:
+            return None
+        geometria, formato, distancia_km, duracion_min, updated_at = res
+        return {
+            "route_id": route_id,
+            "geometria": descomprimir_geometria(geometria, formato),
+            "distancia_km": distancia_km,
+            "duracion_min": duracion_min,
+            "updated_at": updated_at,
+        }
+
+    def _consultar_y_guardar(self, lon_origen, lat_origen, lon_destino, lat_destino):
+        logger.info(">>> Ruta no encontrada. Consultando OSRM...")
+        self._contar("consultas_osrm")
+        info = self.consultar_osrm(lon_origen, lat_origen, lon_destino, lat_destino)
+        if info is not None and self.db_manager is not None:
+            # 3. Guardar en SQLite para la próxima vez
+            self.guardar_rutas([info])
+            logger.info(">>> Ruta guardada en la CACHÉ local.")
+        return info
+
+    def consultar_osrm(self, lon_origen, lat_origen, lon_destino, lat_destino):
+        """Consulta OSRM sin pasar por la caché.
+
+        Returns:
+            dict con route_id, geometria (diccionario GeoJSON), distancia_km,
+            duracion_min, updated_at y extremos (coordenadas pedidas), o None
+            si OSRM no encuentra ruta.
+        Raises:
+            requests.exceptions.RequestException si falla la petición HTTP.
+        """
+        # Pedimos explícitamente el resumen y la geometría en formato geojson
+        params = {
+            "overview": "full",
+            "geometries": "geojson"
+        }
+        data = self.osrm.route(lon_origen, lat_origen, lon_destino, lat_destino, params=params)
+
+        if data.get("code") != "Ok":
+            return None
+        route = data["routes"][0]
+        return {
+            "route_id": self._generar_id_ruta(lon_origen, lat_origen, lon_destino, lat_destino),
+            "geometria": route["geometry"],
+            "distancia_km": round(route["distance"] / 1000, 2),
+            "duracion_min": round(route["duration"] / 60, 2),
+            "updated_at": datetime.now(),
+            "extremos": (lon_origen, lat_origen, lon_destino, lat_destino),
+        }
+
+    def guardar_rutas(self, rutas: list) -> int:
+        """Guarda en bloque varias rutas de ``consultar_osrm`` en una sola transacción.
+
+        La geometría se guarda en formato compacto (encoded polyline + zlib)
+        junto con sus niveles simplificados. Las rutas que ya existan (p.ej.
+        guardadas por el dashboard mientras tanto, o un refresco de una
+        caducada) se actualizan: geometría, distancia, duración y
+        ``updated_at`` nuevos, conservando accesos, aciertos y los extremos ya
+        conocidos si la ruta nueva no los trae.
+
+        Returns:
+            Número de rutas escritas, nuevas o actualizadas.
+        """
+        if not rutas:
+            return 0
+        filas = []
+        niveles = []
+        for r in rutas:
+            blob, formato = comprimir_geometria(r["geometria"])
+            filas.append({
+                "route_id": r["route_id"],
+                "geometria": blob,
+                "formato": formato,
+                "distancia_km": r["distancia_km"],
+                "duracion_min": r["duracion_min"],
+                "updated_at": r["updated_at"].isoformat(sep=" "),
+                **self._columnas_extremos(r.get("extremos")),
+            })
+            niveles.extend(
+                {"route_id": r["route_id"], "nivel": nivel, "geometria": g}
+                for nivel, (g, _) in niveles_simplificados(r["geometria"]).items()
+            )
+        # Upsert en vez de REPLACE: un refresco conserva los accesos y los extremos ya conocidos
+        query = text("""
+        INSERT INTO cache_rutas (route_id, geometria, formato, distancia_km, duracion_min, updated_at,
+            lon_origen, lat_origen, lon_destino, lat_destino, celda_origen, celda_destino)
+        VALUES (:route_id, :geometria, :formato, :distancia_km, :duracion_min, :updated_at,
+            :lon_origen, :lat_origen, :lon_destino, :lat_destino, :celda_origen, :celda_destino)
+        ON CONFLICT (route_id) DO UPDATE SET
+            geometria = excluded.geometria, formato = excluded.formato,
+            distancia_km = excluded.distancia_km, duracion_min = excluded.duracion_min,
+            updated_at = excluded.updated_at,
+            lon_origen = COALESCE(excluded.lon_origen, lon_origen),
+            lat_origen = COALESCE(excluded.lat_origen, lat_origen),
+            lon_destino = COALESCE(excluded.lon_destino, lon_destino),
+            lat_destino = COALESCE(excluded.lat_destino, lat_destino),
+            celda_origen = COALESCE(excluded.celda_origen, celda_origen),
+            celda_destino = COALESCE(excluded.celda_destino, celda_destino)
+        """)
+        query_niveles = text("""
+        INSERT OR REPLACE INTO cache_rutas_niveles (route_id, nivel, geometria)
+        VALUES (:route_id, :nivel, :geometria)
+        """)
+        with self.db_manager.engine.begin() as conn:
+            resultado = conn.execute(query, filas)
+            conn.execute(query_niveles, niveles)
+        return resultado.rowcount
+
+
+if __name__ == "__main__":
     # Ejemplo de uso
-    from process import procesar_rutas
+    from process import coordenadas_pedido
     from database import DatabaseManager
     db_manager = DatabaseManager()
     rp = RouteProvider(db_manager)
-    df = procesar_rutas("2800759255040")
-    long_origen = df.iloc[0]['longitud_origen']
-    lat_origen = df.iloc[0]['latitud_origen']
-    long_destino = df.iloc[0]['longitud_destino']
-    lat_destino = df.iloc[0]['latitud_destino']
-    ruta = rp.get_route(long_origen, lat_origen, long_destino, lat_destino)
+    filas = coordenadas_pedido("2800759255040", db_manager)
+    ruta = None
+    if filas:
+        fila = filas[0]
+        ruta = rp.get_route(fila["longitud_origen"], fila["latitud_origen"],
+                            fila["longitud_destino"], fila["latitud_destino"])
     if ruta:
         print(f"Distancia: {ruta['distancia_km']} km, Duración: {ruta['duracion_min']} min")
-        #print("Geometría de la ruta (GeoJSON):")
-        #print(ruta["geometria"])
     else:
-        print("No se pudo obtener la ruta.")
\ No newline at end of file
+        print("No se pudo obtener la ruta.")
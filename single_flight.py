@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+import uuid
+from sqlalchemy import text
+from logger import setup_logger
+
+logger = setup_logger("single_flight")
+
+
+class _Llamada:
+    def __init__(self) -> None:
+        self.evento = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalescencia de llamadas concurrentes con la misma clave dentro del proceso.
+
+    El primer hilo que pide una clave ejecuta la función; los que llegan mientras
+    tanto esperan y reciben el mismo resultado (o la misma excepción).
+    """
+
+    def __init__(self) -> None:
+        self._en_curso = {}
+        self._lock = threading.Lock()
+
+    def do(self, clave, funcion):
+        with self._lock:
+            llamada = self._en_curso.get(clave)
+            lider = llamada is None
+            if lider:
+                llamada = self._en_curso[clave] = _Llamada()
+
+        if lider:
+            try:
+                llamada.resultado = funcion()
+            except Exception as e:
+                llamada.error = e
+            finally:
+                with self._lock:
+                    del self._en_curso[clave]
+                llamada.evento.set()
+        else:
+            llamada.evento.wait()
+
+        if llamada.error is not None:
+            raise llamada.error
+        return llamada.resultado
+
+
+class SQLiteLease:
+    """Lease entre procesos sobre una fila de SQLite (``cache_rutas_leases``).
+
+    Permite que varios workers de Gunicorn coalescan el mismo fallo de caché:
+    solo el que obtiene el lease consulta OSRM, el resto espera a que la ruta
+    aparezca en ``cache_rutas``. Un lease caduca tras ``duracion`` segundos por
+    si su propietario muere sin liberarlo.
+    """
+
+    def __init__(self, db_manager, duracion=20.0) -> None:
+        self.db_manager = db_manager
+        self.duracion = duracion
+        self.propietario = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    def crear_tabla(self) -> None:
+        with self.db_manager.engine.begin() as conn:
+            conn.exec_driver_sql("""
+            CREATE TABLE IF NOT EXISTS cache_rutas_leases (
+                route_id TEXT PRIMARY KEY,
+                propietario TEXT NOT NULL,
+                expira_en REAL NOT NULL
+            )
+            """)
+
+    def adquirir(self, route_id) -> bool:
+        ahora = time.time()
+        with self.db_manager.engine.begin() as conn:
+            conn.execute(
+                text("DELETE FROM cache_rutas_leases WHERE route_id = :rid AND expira_en < :ahora"),
+                {"rid": route_id, "ahora": ahora},
+            )
+            resultado = conn.execute(
+                text("INSERT OR IGNORE INTO cache_rutas_leases (route_id, propietario, expira_en) "
+                     "VALUES (:rid, :p, :exp)"),
+                {"rid": route_id, "p": self.propietario, "exp": ahora + self.duracion},
+            )
+        return resultado.rowcount == 1
+
+    def activo(self, route_id) -> bool:
+        """True si otro proceso mantiene un lease vigente sobre ``route_id``."""
+        with self.db_manager.read_engine.connect() as conn:
+            expira_en = conn.execute(
+                text("SELECT expira_en FROM cache_rutas_leases WHERE route_id = :rid"), {"rid": route_id}
+            ).scalar()
+        return expira_en is not None and expira_en >= time.time()
+
+    def liberar(self, route_id) -> None:
+        with self.db_manager.engine.begin() as conn:
+            conn.execute(
+                text("DELETE FROM cache_rutas_leases WHERE route_id = :rid AND propietario = :p"),
+                {"rid": route_id, "p": self.propietario},
+            )
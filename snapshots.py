@@ -0,0 +1,265 @@
+import argparse
+import json
+import os
+import shutil
+import time
+import pandas as pd
+from sqlalchemy import text
+from logger import setup_logger
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    from pyarrow import fs
+except ImportError:  # dependencia opcional: solo la necesitan los snapshots
+    pa = pc = ds = pq = fs = None
+
+logger = setup_logger("snapshots")
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots/planificaciones")
+# Metadatos del snapshot (pyarrow ignora los ficheros que empiezan por "_")
+FICHERO_META = "_snapshot.json"
+FORMATOS = ("parquet", "ipc")
+PARTICIONES = ("fecha", "codigoPlanta")
+# Filas por lectura de SQLite al exportar: la memoria no depende del tamaño de la tabla
+FILAS_POR_LOTE = 100_000
+# Versiones anteriores que se conservan para los lectores que aún las tengan abiertas
+VERSIONES_CONSERVADAS = 2
+
+
+def _requerir_pyarrow() -> None:
+    if pa is None:
+        raise ImportError("Los snapshots necesitan pyarrow (pip install pyarrow).")
+
+
+def _esquema():
+    return pa.schema([
+        ("pedido", pa.string()),
+        ("fecha", pa.date32()),
+        ("codigoPlanta", pa.string()),
+        ("codigoCargadero", pa.string()),
+        ("longitud_origen", pa.float64()),
+        ("latitud_origen", pa.float64()),
+        ("longitud_destino", pa.float64()),
+        ("latitud_destino", pa.float64()),
+        ("distancia_km", pa.float64()),
+        ("duracion_min", pa.float64()),
+    ])
+
+
+def _particionado(particion):
+    # Esquema explícito: sin él, "0000000012" se leería como entero
+    return ds.partitioning(pa.schema([_esquema().field(particion)]), flavor="hive")
+
+
+def leer_planificaciones_con_rutas(db_manager, route_provider, filas_por_lote=FILAS_POR_LOTE):
+    """Planificaciones con coordenadas, fecha y distancia/duración de ``cache_rutas``, por lotes.
+
+    Es el cruce que hasta ahora se hacía a mano con ``leer_tabla``: la ruta de
+    cada planificación se localiza por el ``route_id`` de sus coordenadas
+    (calculado una vez por par distinto).
+
+    Yields:
+        DataFrames con las columnas del esquema del snapshot.
+    """
+    with db_manager.read_engine.connect() as conn:
+        rutas = {rid: (km, minutos) for rid, km, minutos in
+                 conn.execute(text("SELECT route_id, distancia_km, duracion_min FROM cache_rutas"))}
+    conocidos = {}  # par de coordenadas -> (distancia_km, duracion_min), entre lotes
+    query = """
+    SELECT p.pedido, p.fechaPrevista, p.codigoPlanta, p.codigoCargadero,
+           o.longitud as longitud_origen, o.latitud as latitud_origen,
+           d.longitud as longitud_destino, d.latitud as latitud_destino
+    FROM planificaciones p
+    LEFT JOIN maestro_origenes o ON p.codigoCargadero = o.codigo
+    LEFT JOIN maestro_destinos d ON p.codigoPlanta = d.codigoPlanta
+    """
+    coords = ["longitud_origen", "latitud_origen", "longitud_destino", "latitud_destino"]
+    for df in pd.read_sql(query, con=db_manager.read_engine, chunksize=filas_por_lote):
+        for columna in coords:
+            df[columna] = pd.to_numeric(df[columna], errors="coerce")
+        pares = df[coords].drop_duplicates().dropna()
+        valores = []
+        for par in pares.itertuples(index=False, name=None):
+            if par not in conocidos:
+                conocidos[par] = rutas.get(route_provider._generar_id_ruta(*par), (None, None))
+            valores.append(conocidos[par])
+        pares = pares.join(pd.DataFrame(valores, columns=["distancia_km", "duracion_min"],
+                                        index=pares.index, dtype=float))
+        df = df.merge(pares, on=coords, how="left")
+        df["fecha"] = pd.to_datetime(df.pop("fechaPrevista"), format="%d/%m/%Y", errors="coerce").dt.date
+        for columna in ("pedido", "codigoPlanta", "codigoCargadero"):
+            df[columna] = df[columna].astype("string")
+        yield df[_esquema().names]
+
+
+def exportar_snapshot(db_manager, route_provider=None, destino=SNAPSHOT_DIR, particion="fecha",
+                      formato="parquet", filas_por_lote=FILAS_POR_LOTE) -> dict:
+    """Escribe el cruce de planificaciones y rutas como dataset columnar particionado.
+
+    Las particiones siguen el esquema hive (``fecha=2026-01-05/``). Cada
+    exportación se escribe en su propio directorio ``<destino>.v<n>`` y
+    ``destino`` es un enlace simbólico que se cambia a la nueva versión de una
+    sola vez al terminar, de modo que un lector nunca ve uno a medias ni se
+    queda sin snapshot.
+
+    Args:
+        particion: ``"fecha"`` (recomendado) o ``"codigoPlanta"``.
+        formato: ``"parquet"`` (comprimido) o ``"ipc"`` (Arrow sin comprimir,
+            el más rápido de mapear en memoria).
+    Returns:
+        dict con filas, ficheros, bytes y segundos.
+    """
+    _requerir_pyarrow()
+    if particion not in PARTICIONES or formato not in FORMATOS:
+        raise ValueError(f"Partición ({particion}) o formato ({formato}) no soportados.")
+    from router import RouteProvider
+
+    route_provider = route_provider or RouteProvider(db_manager)
+    inicio = time.perf_counter()
+    esquema = _esquema()
+    filas = 0
+
+    def _lotes():
+        nonlocal filas
+        for df in leer_planificaciones_con_rutas(db_manager, route_provider, filas_por_lote):
+            filas += len(df)
+            yield from pa.Table.from_pandas(df, schema=esquema, preserve_index=False).to_batches()
+
+    version = f"{destino}.v{time.time_ns()}"
+    try:
+        ds.write_dataset(
+            ds.Scanner.from_batches(_lotes(), schema=esquema), version, format=formato,
+            partitioning=_particionado(particion), max_partitions=100_000,
+            existing_data_behavior="overwrite_or_ignore",
+        )
+        ficheros = [os.path.join(d, f) for d, _, nombres in os.walk(version) for f in nombres]
+        meta = {"formato": formato, "particion": particion, "filas": filas, "ficheros": len(ficheros),
+                "bytes": sum(os.path.getsize(f) for f in ficheros), "creado": time.time()}
+        with open(os.path.join(version, FICHERO_META), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        _publicar(version, destino)
+    except BaseException:
+        shutil.rmtree(version, ignore_errors=True)
+        raise
+    _limpiar_versiones(destino)
+    meta["segundos"] = round(time.perf_counter() - inicio, 3)
+    logger.info(f"Snapshot exportado en {destino}: {meta}")
+    return meta
+
+
+def _publicar(version: str, destino: str) -> None:
+    """Apunta ``destino`` a ``version`` sustituyendo el enlace con un único ``os.replace``."""
+    if os.path.isdir(destino) and not os.path.islink(destino):
+        # Snapshot de una versión anterior del exportador (directorio real): se
+        # convierte en una versión más; solo en esta migración hay un instante sin destino
+        os.replace(destino, f"{destino}.v0")
+    enlace = f"{destino}.lnk-{os.getpid()}"
+    if os.path.lexists(enlace):
+        os.remove(enlace)
+    os.symlink(os.path.basename(version), enlace, target_is_directory=True)
+    os.replace(enlace, destino)
+
+
+def _limpiar_versiones(destino: str) -> None:
+    """Borra las versiones más antiguas salvo la publicada y las ``VERSIONES_CONSERVADAS`` previas."""
+    actual = os.path.realpath(destino)
+    prefijo = f"{os.path.basename(destino)}.v"
+    carpeta = os.path.dirname(actual)
+    versiones = sorted((n for n in os.listdir(carpeta) if n.startswith(prefijo) and n[len(prefijo):].isdigit()),
+                       key=lambda n: int(n[len(prefijo):]))
+    antiguas = [os.path.join(carpeta, n) for n in versiones if os.path.join(carpeta, n) != actual]
+    for ruta in antiguas[:-VERSIONES_CONSERVADAS or None]:
+        shutil.rmtree(ruta, ignore_errors=True)
+
+
+def abrir_snapshot(ruta=SNAPSHOT_DIR):
+    """``pyarrow.dataset.Dataset`` del snapshot, con los ficheros mapeados en memoria."""
+    _requerir_pyarrow()
+    # Se resuelve el enlace una vez: metadatos y ficheros son de la misma versión
+    ruta = os.path.realpath(ruta)
+    with open(os.path.join(ruta, FICHERO_META), encoding="utf-8") as f:
+        meta = json.load(f)
+    return ds.dataset(ruta, schema=_esquema(), format=meta["formato"],
+                      partitioning=_particionado(meta["particion"]),
+                      filesystem=fs.LocalFileSystem(use_mmap=True))
+
+
+def cargar_snapshot(ruta=SNAPSHOT_DIR, columnas=None, filtros=None, como_tabla=False):
+    """Lee del snapshot solo las columnas y filas pedidas.
+
+    Los filtros se aplican al escanear: las particiones que no cumplen la
+    condición ni se abren y, en Parquet, se descartan los grupos de filas por
+    sus estadísticas.
+
+    Args:
+        columnas: lista de columnas (por defecto todas).
+        filtros: lista de tuplas ``(columna, operador, valor)`` como en
+            ``pandas.read_parquet`` (p.ej. ``[("fecha", ">=", date(2026, 1, 1))]``)
+            o una expresión de ``pyarrow.dataset``.
+        como_tabla: devuelve la ``pyarrow.Table`` en lugar de un DataFrame.
+    """
+    dataset = abrir_snapshot(ruta)
+    if filtros is not None and not isinstance(filtros, ds.Expression):
+        filtros = pq.filters_to_expression(filtros)
+    tabla = dataset.to_table(columns=columnas, filter=filtros)
+    return tabla if como_tabla else tabla.to_pandas()
+
+
+def km_por_planta_dia(ruta=SNAPSHOT_DIR, filtros=None) -> pd.DataFrame:
+    """Kilómetros, horas y planificaciones por planta y día, agregados sobre el snapshot.
+
+    Returns:
+        DataFrame con codigoPlanta, fecha, planificaciones, sin_ruta (sin ruta
+        en caché, no suman km), km y horas, ordenado por planta y fecha.
+    """
+    tabla = cargar_snapshot(ruta, ["codigoPlanta", "fecha", "pedido", "distancia_km", "duracion_min"],
+                            filtros, como_tabla=True)
+    suma = pc.ScalarAggregateOptions(min_count=0)  # grupo sin rutas: 0 km, como en pandas
+    agregada = tabla.group_by(["codigoPlanta", "fecha"]).aggregate([
+        ("pedido", "count"), ("distancia_km", "count", pc.CountOptions(mode="only_null")),
+        ("distancia_km", "sum", suma), ("duracion_min", "sum", suma)])
+    df = agregada.to_pandas().rename(columns={
+        "pedido_count": "planificaciones", "distancia_km_count": "sin_ruta",
+        "distancia_km_sum": "km", "duracion_min_sum": "horas"})
+    df["horas"] = df["horas"] / 60
+    return _ordenar_informe(df)
+
+
+def km_por_planta_dia_sqlite(db_manager, route_provider=None) -> pd.DataFrame:
+    """El mismo informe que ``km_por_planta_dia`` leyendo de SQLite (sin snapshot)."""
+    from router import RouteProvider
+
+    route_provider = route_provider or RouteProvider(db_manager)
+    df = pd.concat(leer_planificaciones_con_rutas(db_manager, route_provider), ignore_index=True)
+    df["sin_ruta"] = df["distancia_km"].isna()
+    df = df.groupby(["codigoPlanta", "fecha"], dropna=False).agg(
+        planificaciones=("pedido", "count"), sin_ruta=("sin_ruta", "sum"),
+        km=("distancia_km", "sum"), horas=("duracion_min", "sum"),
+    ).reset_index()
+    df["horas"] = df["horas"] / 60
+    return _ordenar_informe(df)
+
+
+def _ordenar_informe(df: pd.DataFrame) -> pd.DataFrame:
+    columnas = ["codigoPlanta", "fecha", "planificaciones", "sin_ruta", "km", "horas"]
+    return df[columnas].sort_values(["codigoPlanta", "fecha"]).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    from database import DatabaseManager
+
+    parser = argparse.ArgumentParser(description="Snapshots columnares de planificaciones y rutas")
+    parser.add_argument("accion", choices=["exportar", "informe"])
+    parser.add_argument("--destino", default=SNAPSHOT_DIR)
+    parser.add_argument("--particion", choices=PARTICIONES, default="fecha")
+    parser.add_argument("--formato", choices=FORMATOS, default="parquet")
+    args = parser.parse_args()
+
+    if args.accion == "exportar":
+        print(exportar_snapshot(DatabaseManager(), destino=args.destino, particion=args.particion,
+                                formato=args.formato))
+    else:
+        print(km_por_planta_dia(args.destino).to_string(index=False))
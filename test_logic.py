@@ -7,4 +7,783 @@ def test_id_ruta_consistencia():
     id1 = router._generar_id_ruta(-3.7, 40.4, -0.3, 39.4)
     id2 = router._generar_id_ruta(-3.7, 40.4, -0.3, 39.4)
     
-    assert id1 == id2  # El ID debe ser idéntico para las mismas coordenadas
\ No newline at end of file
+    assert id1 == id2  # El ID debe ser idéntico para las mismas coordenadas
+
+def test_route_cache_lru_y_ttl():
+    from datetime import datetime, timedelta
+    from route_cache import RouteCache
+
+    cache = RouteCache(max_entradas=2, max_bytes=100, ttl=60)
+    cache.put("a", {"distancia_km": 1}, 10)
+    cache.put("b", {"distancia_km": 2}, 10)
+    assert cache.get("a") is not None  # "a" pasa a ser la más reciente
+    cache.put("c", {"distancia_km": 3}, 10)
+    assert cache.get("b") is None      # se expulsa la menos usada
+    cache.put("d", {"distancia_km": 4}, 95)
+    assert cache.stats()["bytes"] <= 100
+
+    # Una ruta con updated_at más antiguo que el TTL no se sirve
+    cache.put("vieja", {"distancia_km": 5}, 1, datetime.now() - timedelta(seconds=120))
+    assert cache.get("vieja") is None
+    assert cache.stats()["hits"] == 1
+
+
+def _crear_bd_planificaciones(db_path):
+    import pandas as pd
+    from database import DatabaseManager
+
+    db = DatabaseManager(str(db_path))
+    db.guardar_datos(pd.DataFrame({
+        "codigo": ["C1", "C2"], "longitud": [-3.70, -0.37], "latitud": [40.41, 39.47],
+    }), "maestro_origenes")
+    db.guardar_datos(pd.DataFrame({
+        "codigoPlanta": ["P1", "P2"], "longitud": [-5.98, 2.17], "latitud": [37.38, 41.38],
+    }), "maestro_destinos")
+    db.guardar_datos(pd.DataFrame({
+        "pedido": ["100", "101", "102", "103"],
+        "codigoCargadero": ["C1", "C1", "C2", "C2"],
+        "codigoPlanta": ["P1", "P1", "P2", "P9"],  # P9 no tiene coordenadas
+    }), "planificaciones")
+    return db
+
+
+def test_precalcular_rutas_con_osrm_falso(tmp_path):
+    from benchmarks.fake_servers import FakeOSRM
+    from warmup import precalcular_rutas
+
+    db = _crear_bd_planificaciones(tmp_path / "test.db")
+    rp = RouteProvider(db)
+    with FakeOSRM(fallos=1) as osrm:
+        rp.base_url = osrm.url
+        resumen = precalcular_rutas(db, rp, peticiones_por_segundo=0, backoff=0.01)
+        # Pares distintos con coordenadas: C1->P1 y C2->P2 (uno con reintento)
+        assert resumen["pendientes"] == 2
+        assert resumen["insertadas"] == 2
+        assert osrm.peticiones == 3
+
+        # Una segunda pasada no vuelve a llamar a OSRM
+        assert precalcular_rutas(db, rp)["pendientes"] == 0
+        assert rp.get_route(-3.70, 40.41, -5.98, 37.38)["distancia_km"] > 0
+        assert osrm.peticiones == 3
+
+
+def test_precalcular_rutas_no_reintenta_errores_no_recuperables(tmp_path):
+    import requests
+    from warmup import precalcular_rutas
+
+    db = _crear_bd_planificaciones(tmp_path / "test.db")
+    rp = RouteProvider(db)
+    llamadas = []
+
+    def _consultar(lon_o, lat_o, lon_d, lat_d):
+        llamadas.append(lon_o)
+        if lon_o == -3.70:
+            respuesta = requests.Response()
+            respuesta.status_code = 400
+            raise requests.exceptions.HTTPError("400 NoRoute", response=respuesta)
+        raise ValueError("respuesta sin 'routes'")
+
+    rp.consultar_osrm = _consultar
+    # Un 4xx y una respuesta mal formada: se descartan sin reintentos ni cortar el resto
+    resumen = precalcular_rutas(db, rp, peticiones_por_segundo=0, reintentos=3, backoff=0.01)
+    assert resumen["pendientes"] == 2
+    assert resumen["fallidas"] == 2
+    assert len(llamadas) == 2
+
+
+def test_osrm_client_circuit_breaker():
+    import requests
+    from benchmarks.fake_servers import FakeOSRM
+    from metrics import OSRM_SEGUNDOS
+    from osrm_client import CircuitBreaker, CircuitoAbiertoError, OSRMClient
+
+    previas = OSRM_SEGUNDOS.resumen()["peticiones"]
+    with FakeOSRM(fallos=2) as osrm:
+        cliente = OSRMClient(osrm.url, breaker=CircuitBreaker(umbral_fallos=2, tiempo_reset=0.05))
+        for _ in range(2):
+            with pytest.raises(requests.exceptions.HTTPError):
+                cliente.route(-3.7, 40.4, -0.3, 39.4)
+        # Circuito abierto: no se llega a contactar con el servidor
+        with pytest.raises(CircuitoAbiertoError):
+            cliente.route(-3.7, 40.4, -0.3, 39.4)
+        assert osrm.peticiones == 2
+
+        import time
+        time.sleep(0.06)
+        assert cliente.route(-3.7, 40.4, -0.3, 39.4)["code"] == "Ok"
+        assert cliente.breaker.estado == "cerrado"
+        # El circuito abierto no llega a medir latencia
+        resumen = OSRM_SEGUNDOS.resumen()
+        assert resumen["peticiones"] - previas == 3
+        assert 0 < resumen["p50_s"] <= resumen["p99_s"]
+
+
+def test_engine_compartido_wal_y_solo_lectura(tmp_path):
+    import sqlalchemy
+    from sqlalchemy import text
+    from database import DatabaseManager
+
+    db = _crear_bd_planificaciones(tmp_path / "wal.db")
+    assert DatabaseManager(str(tmp_path / "wal.db")).engine is db.engine
+
+    with db.read_engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        with pytest.raises(sqlalchemy.exc.OperationalError):
+            conn.execute(text("DELETE FROM planificaciones"))
+
+    # Un lector no queda bloqueado mientras la ETL tiene una escritura abierta
+    with db.engine.begin() as escritura:
+        escritura.execute(text("DELETE FROM planificaciones"))
+        with db.read_engine.connect() as lectura:
+            assert lectura.execute(text("SELECT COUNT(*) FROM planificaciones")).scalar() == 4
+
+
+def test_guardar_datos_upsert_incremental(tmp_path):
+    import pandas as pd
+    from database import DatabaseManager
+
+    db = DatabaseManager(str(tmp_path / "upsert.db"))
+    df = pd.DataFrame({"pedido": ["1", "1", "2", "3"], "estado": ["A", "A", "B", "C"]})
+    primera = db.guardar_datos(df, "planificaciones", if_exists="upsert", clave="pedido")
+    assert primera["nuevas"] == 3
+
+    # Sin cambios: no se toca ninguna fila
+    assert db.guardar_datos(df, "planificaciones", if_exists="upsert", clave="pedido")["filas_cambiadas"] == 0
+
+    # Cambia una fila del pedido 1, desaparece el 3 y aparece el 4
+    df2 = pd.DataFrame({"pedido": ["1", "1", "2", "4"], "estado": ["A", "X", "B", "D"]})
+    res = db.guardar_datos(df2, "planificaciones", if_exists="upsert", clave="pedido")
+    assert (res["nuevas"], res["actualizadas"], res["eliminadas"]) == (1, 1, 1)
+    assert res["claves_afectadas"] == {"1", "3", "4"}
+
+    guardado = db.leer_tabla("planificaciones").sort_values(["pedido", "estado"]).reset_index(drop=True)
+    esperado = df2.sort_values(["pedido", "estado"]).reset_index(drop=True)
+    pd.testing.assert_frame_equal(guardado, esperado)
+
+    # Las filas sin clave se descartan: no se duplican en cada carga
+    for estado in ("P", "Q", "R"):
+        df3 = pd.concat([df2, pd.DataFrame({"pedido": [None], "estado": [estado]})], ignore_index=True)
+        res = db.guardar_datos(df3, "planificaciones", if_exists="upsert", clave="pedido")
+        assert res["descartadas"] == 1
+    assert db.leer_tabla("planificaciones")["pedido"].notna().all()
+    assert len(db.leer_tabla("planificaciones")) == len(df2)
+    assert db.guardar_datos(pd.DataFrame({"pedido": [None], "estado": ["S"]}), "planificaciones",
+                            if_exists="upsert", clave="pedido") is None
+    assert len(db.leer_tabla("planificaciones")) == len(df2)
+
+
+def test_procesar_rutas_con_pedido_coordenadas(tmp_path):
+    from process import procesar_rutas
+
+    db = _crear_bd_planificaciones(tmp_path / "indices.db")
+    antes = procesar_rutas("100", db)  # sin tabla materializada: cruce directo
+    db.crear_indices()
+    assert db.refrescar_pedido_coordenadas() == 4
+
+    despues = procesar_rutas("100", db)
+    assert despues.to_dict("records") == antes.to_dict("records")
+    assert despues.iloc[0]["longitud_destino"] == -5.98
+    assert procesar_rutas("103", db).iloc[0]["longitud_destino"] is None
+
+
+def test_fetch_all_en_paralelo_con_relogin():
+    import time
+    from benchmarks.fake_servers import FakeMoplan
+    from data_fetcher import DataFetcher
+
+    datos = {
+        "p_manCargaderos": [{"codigo": "C1", "longitud": "-3.7", "latitud": "40.4"}],
+        "p_manPlantas": [{"codigoPlanta": "P1", "longitud": "-5.9", "latitud": "37.3"}],
+        "p_planificaciones": [{"pedido": "1", "codigoCargadero": "C1", "codigoPlanta": "P1"}],
+    }
+    with FakeMoplan(datos, retraso=0.3, token_valido_para=2) as api:
+        fetcher = DataFetcher(base_url=api.url, backoff=0.01)
+        inicio = time.perf_counter()
+        resultados = fetcher.fetch_all()
+        # Las tres descargas se solapan: ~0.3 s (+ reintento por token caducado), no 0.9 s
+        assert time.perf_counter() - inicio < 0.85
+        assert all(r.ok for r in resultados.values())
+        assert api.logins == 2  # login inicial + un único re-login
+        assert resultados["cargaderos"].df["longitud"].dtype.kind == "f"
+        assert len(resultados["planificaciones"].df) == 1
+
+
+def test_fetch_planificaciones_stream_por_lotes(tmp_path):
+    import json
+    from benchmarks.fake_servers import FakeMoplan
+    from data_fetcher import DataFetcher
+    from database import DatabaseManager
+
+    registros = [{"pedido": str(i // 2), "estado": "PLAN", "cantidad": i} for i in range(25)]
+    fichero = tmp_path / "planificaciones.json"
+    fichero.write_text(json.dumps(registros))
+    db = DatabaseManager(str(tmp_path / "stream.db"))
+
+    with FakeMoplan({"p_planificaciones": fichero}) as api:
+        resumen = DataFetcher(base_url=api.url).fetch_planificaciones_stream(db, tamano_lote=4)
+        assert resumen["filas"] == 25 and resumen["nuevas"] == 13
+
+        # Segunda carga idéntica: el merge no cambia ninguna fila
+        resumen = DataFetcher(base_url=api.url).fetch_planificaciones_stream(db, tamano_lote=7)
+        assert resumen["filas_cambiadas"] == 0
+
+    df = db.leer_tabla("planificaciones")
+    assert len(df) == 25 and df["cantidad"].tolist()[:3] == ["0", "1", "2"]
+
+
+def test_geometria_compacta_y_migracion(tmp_path):
+    import json
+    from sqlalchemy import text
+    from database import DatabaseManager
+    from geometry import codificar_polyline, decodificar_polyline
+
+    # Ejemplo de referencia del formato encoded polyline (precisión 5)
+    coords = [[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]]
+    assert codificar_polyline(coords, 5) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    assert decodificar_polyline("_p~iF~ps|U_ulLnnqC_mqNvxq`@", 5) == coords
+
+    # Fila antigua con GeoJSON en texto, anterior a la columna formato
+    db = DatabaseManager(str(tmp_path / "migracion.db"))
+    linea = {"type": "LineString", "coordinates": [[-3.7 + i * 1e-4, 40.4 + (i % 7) * 1e-5] for i in range(500)]}
+    rp = RouteProvider(None)
+    route_id = rp._generar_id_ruta(-3.7, 40.4, -0.3, 39.4)
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE cache_rutas (route_id TEXT PRIMARY KEY, geometria TEXT NOT NULL, "
+            "distancia_km REAL, duracion_min REAL, updated_at DATETIME DEFAULT CURRENT_TIMESTAMP)"
+        )
+        conn.execute(text("INSERT INTO cache_rutas VALUES (:r, :g, 300.5, 200, CURRENT_TIMESTAMP)"),
+                     {"r": route_id, "g": json.dumps(linea)})
+
+    rp = RouteProvider(db)  # crear_tablas_cache migra al arrancar
+    with db.engine.connect() as conn:
+        blob, formato = conn.execute(text("SELECT geometria, formato FROM cache_rutas")).first()
+    assert formato == "polyline6+zlib" and len(blob) < len(json.dumps(linea)) / 4
+
+    completa = rp.get_route(-3.7, 40.4, -0.3, 39.4)
+    assert completa["geometria"]["coordinates"] == [[round(x, 6), round(y, 6)] for x, y in linea["coordinates"]]
+    simplificada = rp.get_route(-3.7, 40.4, -0.3, 39.4, nivel=3)
+    assert len(simplificada["geometria"]["coordinates"]) < 10
+    assert simplificada["distancia_km"] == 300.5
+
+
+def test_buscar_pedidos_por_prefijo_con_invalidacion(tmp_path):
+    import pandas as pd
+    from process import buscar_pedidos
+
+    db = _crear_bd_planificaciones(tmp_path / "pedidos.db")
+    db.crear_indices()
+    assert buscar_pedidos("10", db_manager=db) == ["100", "101", "102", "103"]
+    assert buscar_pedidos("102", db_manager=db) == ["102"]
+    assert buscar_pedidos("", limite=2, db_manager=db) == ["100", "101"]
+
+    # Tras una carga de la ETL la caché deja de servir el resultado anterior
+    nuevas = pd.DataFrame({"pedido": ["104"], "codigoCargadero": ["C1"], "codigoPlanta": ["P1"]})
+    db.guardar_datos(nuevas, "planificaciones", if_exists="append")
+    assert buscar_pedidos("10", db_manager=db)[-1] == "104"
+
+
+def test_fallos_concurrentes_una_sola_llamada_a_osrm(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    from benchmarks.fake_servers import FakeOSRM
+    from database import DatabaseManager
+
+    db = DatabaseManager(str(tmp_path / "coalescencia.db"))
+    # Dos proveedores independientes simulan dos workers de Gunicorn
+    workers = [RouteProvider(db), RouteProvider(db)]
+    with FakeOSRM(retraso=0.3) as osrm:
+        for rp in workers:
+            rp.base_url = osrm.url
+        with ThreadPoolExecutor(max_workers=20) as pool:
+            rutas = list(pool.map(
+                lambda i: workers[i % 2].get_route(-3.7, 40.4, -0.3, 39.4), range(20)
+            ))
+        assert osrm.peticiones == 1
+    assert all(r is not None and r["distancia_km"] == rutas[0]["distancia_km"] for r in rutas)
+
+
+def test_vista_flota_get_routes_en_bloque(tmp_path):
+    from benchmarks.fake_servers import FakeOSRM
+    from process import agrupar_pares_flota, procesar_flota
+
+    db = _crear_bd_planificaciones(tmp_path / "flota.db")
+    assert procesar_flota(db_manager=db).empty  # sin filtros no se devuelve la tabla entera
+
+    flota = procesar_flota(pedidos=["100", "101", "102", "103"], db_manager=db)
+    pares = agrupar_pares_flota(flota)
+    # 100 y 101 comparten trayecto; 103 no tiene coordenadas de planta
+    assert sorted((p["codigoCargadero"], p["codigoPlanta"], p["cargas"]) for p in pares) == [
+        ("C1", "P1", 2), ("C2", "P2", 1)]
+    assert len(procesar_flota(cod_planta="P1", db_manager=db)) == 2
+
+    rp = RouteProvider(db)
+    with FakeOSRM() as osrm:
+        rp.base_url = osrm.url
+        coords = [p["coords"] for p in pares]
+        # Modo del dashboard: solo caché, sin esperar a OSRM
+        assert rp.get_routes(coords, nivel=2, resolver_fallos=False) == {}
+        assert osrm.peticiones == 0
+        rutas = rp.get_routes(coords, nivel=2)
+        assert len(rutas) == 2 and osrm.peticiones == 2
+        # Segunda vez: todo sale de caché sin tocar OSRM
+        rp.cache.invalidar()
+        assert rp.get_routes(coords).keys() == rutas.keys()
+        assert osrm.peticiones == 2
+
+
+def test_distancias_vecino_mas_cercano_y_desviaciones(tmp_path):
+    from datetime import datetime
+    import numpy as np
+    from distancias import cargadero_mas_cercano, detectar_desviaciones, haversine, matriz_distancias
+
+    # Madrid - Barcelona ~505 km
+    assert abs(float(haversine(-3.7038, 40.4168, 2.1734, 41.3851)) - 505) < 2
+    origenes, destinos = np.random.default_rng(0).uniform(-9, 3, (2, 300, 2))
+    matriz = matriz_distancias(origenes, destinos, tamano_bloque=64)
+    assert np.allclose(matriz[7], haversine(*origenes[7], destinos[:, 0], destinos[:, 1]), atol=1e-3)
+
+    db = _crear_bd_planificaciones(tmp_path / "distancias.db")
+    cercanos = cargadero_mas_cercano(db)
+    assert dict(zip(cercanos["codigoPlanta"], cercanos["codigoCargadero"])) == {"P1": "C1", "P2": "C2"}
+
+    db.refrescar_pedido_coordenadas()
+    rp = RouteProvider(db)
+    linea = {"type": "LineString", "coordinates": [[0.0, 0.0], [1.0, 1.0]]}
+    rp.guardar_rutas([
+        {"route_id": rp._generar_id_ruta(-3.70, 40.41, -5.98, 37.38), "geometria": linea,
+         "distancia_km": 530.0, "duracion_min": 300, "updated_at": datetime.now()},
+        # Valencia - Barcelona en 40 km: imposible por carretera
+        {"route_id": rp._generar_id_ruta(-0.37, 39.47, 2.17, 41.38), "geometria": linea,
+         "distancia_km": 40.0, "duracion_min": 30, "updated_at": datetime.now()},
+    ])
+    desviadas = detectar_desviaciones(db, rp)
+    assert desviadas["pedido"].tolist() == ["102"]
+    # Tras una ETL solo se revisan los pedidos de las claves que cambiaron
+    assert detectar_desviaciones(db, rp, afectadas={"maestro_destinos": ["P1"]}).empty
+    assert detectar_desviaciones(db, rp, afectadas={"maestro_origenes": ["C2"]})["pedido"].tolist() == ["102"]
+
+
+def test_cache_con_tolerancia_reutiliza_rutas_cercanas(tmp_path):
+    from benchmarks.fake_servers import FakeOSRM
+    from database import DatabaseManager
+
+    db = DatabaseManager(str(tmp_path / "tolerancia.db"))
+    rp = RouteProvider(db, tolerancia_m=150)
+    with FakeOSRM() as osrm:
+        rp.base_url = osrm.url
+        exacta = rp.get_route(-3.70, 40.41, -0.37, 39.47)
+        # Otro muelle de la misma planta (~60 m) y origen desplazado (~40 m)
+        cercana = rp.get_route(-3.7004, 40.4102, -0.3707, 39.4702)
+        assert osrm.peticiones == 1
+        assert cercana["aproximada"] and 0 < cercana["desvio_m"] <= 150
+        assert cercana["geometria"]["coordinates"][0] == [-3.7004, 40.4102]
+        assert cercana["distancia_km"] >= exacta["distancia_km"]
+        assert "aproximada" not in exacta
+
+        # Fuera del radio se consulta OSRM
+        rp.get_route(-3.71, 40.41, -0.37, 39.47)
+        assert osrm.peticiones == 2
+
+        rp.get_route(-3.7004, 40.4102, -0.3707, 39.4702)  # desde memoria
+        stats = rp.estadisticas()
+        assert (stats["aciertos_exactos"], stats["aciertos_aproximados"], stats["consultas_osrm"]) == (0, 2, 2)
+
+    # Sin tolerancia no se reutilizan rutas de otros extremos
+    with FakeOSRM() as osrm:
+        estricto = RouteProvider(db, tolerancia_m=0)
+        estricto.base_url = osrm.url
+        estricto.get_route(-3.7001, 40.4101, -0.37, 39.47)
+        assert osrm.peticiones == 1
+
+
+def test_metricas_prometheus_combinan_workers(tmp_path):
+    from metrics import Registro
+
+    def worker():
+        registro = Registro(str(tmp_path))
+        contador = registro.counter("geo_prueba_total", "Prueba.", ("resultado",))
+        histograma = registro.histogram("geo_prueba_segundos", "Prueba.", cubetas=(0.1, 1.0))
+        return registro, contador, histograma
+
+    # Dos "workers": uno ya volcó su fichero, el otro expone
+    otro, contador, histograma = worker()
+    contador.inc(resultado="exacto")
+    histograma.observe(0.05)
+    otro.volcar("1001")
+
+    propio, contador, histograma = worker()
+    contador.inc(2, resultado="exacto")
+    contador.inc(resultado="fallo")
+    with histograma.tiempo():
+        pass
+    histograma.observe(5)
+
+    texto = propio.exponer()
+    assert "# TYPE geo_prueba_total counter" in texto
+    assert 'geo_prueba_total{resultado="exacto"} 3' in texto
+    assert 'geo_prueba_total{resultado="fallo"} 1' in texto
+    assert 'geo_prueba_segundos_bucket{le="0.1"} 2' in texto
+    assert 'geo_prueba_segundos_bucket{le="+Inf"} 3' in texto
+    assert "geo_prueba_segundos_count 3" in texto
+
+    # El worker 1001 termina: sus valores pasan al acumulado y un pid reutilizado
+    # empieza de cero sin que los totales retrocedan
+    propio.retirar(1001)
+    assert not (tmp_path / "metricas_1001.json").exists()
+    assert 'geo_prueba_total{resultado="exacto"} 3' in propio.exponer()
+    nuevo, contador, _ = worker()
+    contador.inc(resultado="exacto")
+    nuevo.volcar("1001")
+    assert 'geo_prueba_total{resultado="exacto"} 4' in propio.exponer()
+    propio.retirar(1001)
+    assert 'geo_prueba_total{resultado="exacto"} 4' in propio.exponer()
+    assert "geo_prueba_segundos_count 3" in propio.exponer()
+
+    propio.limpiar()
+    assert 'geo_prueba_total{resultado="exacto"} 2' in propio.exponer()
+
+
+def test_tail_de_logs_hacia_atras_con_filtro_de_nivel(tmp_path):
+    from logger import leer_ultimas_lineas
+
+    ruta = tmp_path / "logs.log"
+    with open(ruta, "w", encoding="utf-8") as f:
+        for i in range(5000):
+            nivel = "ERROR" if i % 1000 == 999 else "INFO"
+            f.write(f"2026-01-01 10:00:00,000 - app - {nivel} - mensaje {i}\n")
+            if nivel == "ERROR":
+                f.write("Traceback (most recent call last):\n  ValueError: fallo\n")
+
+    assert leer_ultimas_lineas(ruta, 3, tamano_bloque=100) == [
+        "2026-01-01 10:00:00,000 - app - ERROR - mensaje 4999",
+        "Traceback (most recent call last):",
+        "  ValueError: fallo",
+    ]
+    assert leer_ultimas_lineas(ruta, 2) == ["Traceback (most recent call last):", "  ValueError: fallo"]
+    errores = leer_ultimas_lineas(ruta, 6, nivel_minimo=40, tamano_bloque=512)
+    assert [l for l in errores if " - ERROR - " in l] == [
+        "2026-01-01 10:00:00,000 - app - ERROR - mensaje 3999",
+        "2026-01-01 10:00:00,000 - app - ERROR - mensaje 4999",
+    ]
+    assert len(errores) == 6 and errores[1] == "Traceback (most recent call last):"
+    assert len(leer_ultimas_lineas(ruta, 10 ** 6)) == 5000 + 5 * 2
+    vacio = tmp_path / "vacio.log"
+    vacio.write_text("")
+    assert leer_ultimas_lineas(vacio, 10) == []
+
+
+def test_log_con_rotacion_externa_por_defecto(tmp_path, monkeypatch):
+    import logging.handlers
+    import logger
+
+    monkeypatch.setattr(logger, "LOG_FILENAME", str(tmp_path / "logs.log"))
+    archivo, _ = logger._handlers_destino()
+    try:
+        # Varios procesos escriben en el mismo fichero: ninguno lo rota, todos lo reabren
+        assert logger.LOG_ROTACION == "externa"
+        assert type(archivo) is logging.handlers.WatchedFileHandler
+    finally:
+        archivo.close()
+
+
+def test_resolucion_en_segundo_plano_y_cancelacion(tmp_path):
+    import time
+    from benchmarks.fake_servers import FakeOSRM
+    from database import DatabaseManager
+    from resolucion_rutas import ResolutorRutas
+
+    db = DatabaseManager(str(tmp_path / "segundo_plano.db"))
+    rp = RouteProvider(db)
+    resolutor = ResolutorRutas(rp, max_workers=1)
+    a, b = (-3.70, 40.41, -0.37, 39.47), (-3.70, 40.41, 2.17, 41.38)
+    id_a, id_b = rp._generar_id_ruta(*a), rp._generar_id_ruta(*b)
+    with FakeOSRM(retraso=0.3) as osrm:
+        rp.base_url = osrm.url
+        assert rp.buscar_en_cache(*a) is None and osrm.peticiones == 0  # sin OSRM
+
+        inicio = time.perf_counter()
+        resolutor.enviar(id_a, a)
+        resolutor.enviar(id_a, a)  # repetida: se agrupa
+        resolutor.enviar(id_b, b)  # en cola detrás de la primera
+        assert time.perf_counter() - inicio < 0.1
+        assert resolutor.estado(id_b) == "en_cola"
+        assert resolutor.cancelar(id_b)
+        assert resolutor.estado(id_b) is None
+
+        while resolutor.estado(id_a) != "terminada":
+            assert time.perf_counter() - inicio < 5
+            time.sleep(0.05)
+        assert rp.buscar_en_cache(*a) is not None
+        assert osrm.peticiones == 1
+
+
+def test_mantenimiento_cache_ttl_lru_y_estadisticas(tmp_path):
+    import time
+    from benchmarks.fake_servers import FakeOSRM
+    from database import DatabaseManager
+    from mantenimiento_cache import estadisticas_cache, purgar_lru
+    from sqlalchemy import text
+
+    db = DatabaseManager(str(tmp_path / "mantenimiento.db"))
+    rp = RouteProvider(db, ttl_dias=1)
+    a, b = (-3.70, 40.41, -0.37, 39.47), (-3.70, 40.41, 2.17, 41.38)
+    id_a, id_b = rp._generar_id_ruta(*a), rp._generar_id_ruta(*b)
+    with FakeOSRM() as osrm:
+        rp.base_url = osrm.url
+        rp.get_route(*a, nivel=2)
+        rp.get_route(*b)
+        with db.engine.begin() as conn:
+            conn.execute(text("UPDATE cache_rutas SET updated_at = '2000-01-01 00:00:00'"))
+        rp.cache.invalidar()
+
+        # Caducada: se sirve al momento y se refresca en segundo plano
+        assert rp.buscar_en_cache(*a) is not None
+        while estadisticas_cache(db, ttl_dias=1)["caducadas"] != 1:
+            assert osrm.peticiones < 5
+            time.sleep(0.05)
+        assert osrm.peticiones == 3
+        assert rp.cache.get(f"{id_a}:2") is None  # niveles invalidados con la ruta
+
+    assert rp.volcar_accesos() == 1
+    estadisticas = estadisticas_cache(db, ttl_dias=1)
+    assert estadisticas["entradas"] == 2 and estadisticas["aciertos"] == 1
+    assert estadisticas["sin_accesos"] == 1 and estadisticas["antiguedad"][">90d"] == 1
+    resoluciones = estadisticas["resoluciones"]
+    assert resoluciones["exacto"] >= 1 and resoluciones["fallo"] >= 2
+    assert estadisticas["tasa_aciertos"] == round(
+        (resoluciones["exacto"] + resoluciones["aproximado"]) / sum(resoluciones.values()), 4)
+
+    # La purga conserva la ruta usada más recientemente, con sus niveles
+    assert purgar_lru(db, max_filas=1) == 1
+    with db.read_engine.connect() as conn:
+        assert [r[0] for r in conn.execute(text("SELECT route_id FROM cache_rutas"))] == [id_a]
+        assert conn.execute(text("SELECT COUNT(*) FROM cache_rutas_niveles WHERE route_id = :r"),
+                            {"r": id_b}).scalar() == 0
+
+
+def test_ruta_caducada_se_sirve_de_memoria_con_un_solo_refresco(tmp_path):
+    import time
+    from benchmarks.fake_servers import FakeOSRM
+    from database import DatabaseManager
+    from sqlalchemy import text
+
+    db = DatabaseManager(str(tmp_path / "caducada.db"))
+    rp = RouteProvider(db, ttl_dias=1)
+    par = (-3.70, 40.41, -0.37, 39.47)
+    with FakeOSRM(retraso=0.3) as osrm:
+        rp.base_url = osrm.url
+        rp.get_route(*par)
+        with db.engine.begin() as conn:
+            conn.execute(text("UPDATE cache_rutas SET updated_at = '2000-01-01 00:00:00'"))
+        rp.cache.invalidar()
+
+        # La primera lectura va a SQLite; la segunda, con el refresco en curso, a memoria
+        assert rp.buscar_en_cache(*par) is not None
+        memoria = rp.cache.stats()
+        assert rp.buscar_en_cache(*par) is not None
+        assert rp.cache.stats()["hits"] == memoria["hits"] + 1
+        while rp._refrescando:
+            time.sleep(0.05)
+        assert osrm.peticiones == 2  # la ruta original y un único refresco
+
+        # Tras el refresco la ruta vuelve a leerse de SQLite, ya al día
+        assert rp.buscar_en_cache(*par) is not None
+        assert rp.buscar_en_cache(*par) is not None
+        time.sleep(0.1)
+        assert osrm.peticiones == 2 and not rp._refrescando
+
+
+def test_refresco_fallido_no_deja_estado_y_se_reintenta(tmp_path):
+    import time
+    from benchmarks.fake_servers import FakeOSRM
+    from database import DatabaseManager
+    from sqlalchemy import text
+
+    db = DatabaseManager(str(tmp_path / "refresco.db"))
+    rp = RouteProvider(db, ttl_dias=1)
+    par = (-3.70, 40.41, -0.37, 39.47)
+    with FakeOSRM() as osrm:
+        rp.base_url = osrm.url
+        rp.get_route(*par)
+    with db.engine.begin() as conn:
+        conn.execute(text("UPDATE cache_rutas SET updated_at = '2000-01-01 00:00:00'"))
+    rp.cache.invalidar()
+    intentos = []
+
+    def _fallar(*coords):
+        intentos.append(coords)
+        raise RuntimeError("OSRM respondió algo inesperado")
+
+    rp.consultar_osrm = _fallar
+    for esperados in (1, 2):
+        # Se sigue sirviendo la ruta caducada y cada fallo libera su estado
+        assert rp.buscar_en_cache(*par) is not None
+        while rp._refrescando:
+            time.sleep(0.01)
+        assert len(intentos) == esperados
+
+
+def test_etl_omite_respuestas_sin_cambios_y_refresca_solo_lo_afectado(tmp_path, monkeypatch):
+    from benchmarks.fake_servers import FakeMoplan, FakeOSRM
+    from data_fetcher import DataFetcher
+    from database import DatabaseManager
+    from main_interfaz_datos import integrar_datos
+
+    datos = {
+        "p_manCargaderos": [{"codigo": "C1", "longitud": "-3.70", "latitud": "40.41"}],
+        "p_manPlantas": [{"codigoPlanta": "P1", "longitud": "-0.37", "latitud": "39.47"},
+                         {"codigoPlanta": "P2", "longitud": "2.17", "latitud": "41.38"}],
+        "p_planificaciones": [{"pedido": "1", "codigoCargadero": "C1", "codigoPlanta": "P1"},
+                              {"pedido": "2", "codigoCargadero": "C1", "codigoPlanta": "P2"}],
+    }
+    db = DatabaseManager(str(tmp_path / "etl.db"))
+    with FakeMoplan(datos) as api, FakeOSRM() as osrm:
+        monkeypatch.setenv("OSRM_BASE_URL", osrm.url)
+        fetcher = DataFetcher(base_url=api.url)
+        primera = integrar_datos(fetcher=fetcher, db=db)
+        assert primera["claves_afectadas"] == {"maestro_origenes": 1, "maestro_destinos": 2,
+                                               "planificaciones": 2}
+        assert osrm.peticiones == 2
+
+        # Misma respuesta: ninguna tabla se compara ni se escribe, nada aguas abajo
+        version = db.version_tabla("planificaciones")
+        segunda = integrar_datos(fetcher=fetcher, db=db)
+        assert all(r["omitida"] for r in segunda["tablas"].values())
+        assert segunda["claves_afectadas"] == {} and osrm.peticiones == 2
+        assert db.version_tabla("planificaciones") == version
+
+        # Se mueve P2: solo se recalculan sus pedidos y su ruta
+        datos["p_manPlantas"][1]["longitud"] = "2.20"
+        tercera = integrar_datos(fetcher=fetcher, db=db)
+        assert tercera["claves_afectadas"] == {"maestro_destinos": 1}
+        assert tercera["tablas"]["planificaciones"]["omitida"]
+        assert osrm.peticiones == 3
+    coords = db.leer_tabla("pedido_coordenadas").set_index("pedido")["longitud_destino"]
+    assert coords.to_dict() == {"1": -0.37, "2": 2.20}
+
+
+def test_snapshot_columnar_y_informe_por_planta(tmp_path):
+    pytest.importorskip("pyarrow")
+    from datetime import date, datetime
+    import pandas as pd
+    from database import DatabaseManager
+    import os
+    from snapshots import (VERSIONES_CONSERVADAS, cargar_snapshot, exportar_snapshot, km_por_planta_dia,
+                           km_por_planta_dia_sqlite)
+
+    db = DatabaseManager(str(tmp_path / "snapshot.db"))
+    db.guardar_datos(pd.DataFrame({"codigo": ["C1"], "longitud": [-3.70], "latitud": [40.41]}), "maestro_origenes")
+    db.guardar_datos(pd.DataFrame({"codigoPlanta": ["0001", "0002"], "longitud": [-0.37, 2.17],
+                                   "latitud": [39.47, 41.38]}), "maestro_destinos")
+    db.guardar_datos(pd.DataFrame({
+        "pedido": ["1", "2", "3", "4"], "codigoCargadero": ["C1"] * 4,
+        "codigoPlanta": ["0001", "0001", "0002", "0002"],
+        "fechaPrevista": ["05/01/2026", "05/01/2026", "05/01/2026", "06/01/2026"],
+    }), "planificaciones")
+    rp = RouteProvider(db)
+    rp.guardar_rutas([{
+        "route_id": rp._generar_id_ruta(-3.70, 40.41, -0.37, 39.47),
+        "geometria": {"type": "LineString", "coordinates": [[-3.70, 40.41], [-0.37, 39.47]]},
+        "distancia_km": 350.0, "duracion_min": 210.0, "updated_at": datetime(2026, 1, 1),
+    }])
+
+    for particion in ("fecha", "codigoPlanta"):
+        destino = tmp_path / f"snap_{particion}"
+        assert exportar_snapshot(db, rp, str(destino), particion=particion)["filas"] == 4
+        informe = km_por_planta_dia(str(destino))
+        pd.testing.assert_frame_equal(informe, km_por_planta_dia_sqlite(db, rp), check_dtype=False)
+    assert informe[["codigoPlanta", "planificaciones", "km"]].values.tolist()[0] == ["0001", 2, 700.0]
+
+    # Solo las columnas y particiones pedidas; los códigos conservan los ceros
+    dia = cargar_snapshot(str(tmp_path / "snap_fecha"), ["pedido", "codigoPlanta"],
+                          [("fecha", "=", date(2026, 1, 6))])
+    assert dia.to_dict("records") == [{"pedido": "4", "codigoPlanta": "0002"}]
+
+    # Cada exportación es una versión nueva y el enlace cambia de una vez; un
+    # snapshot antiguo (directorio real) se migra y las versiones viejas se purgan
+    destino = tmp_path / "snap_versiones"
+    destino.mkdir()
+    (destino / "_snapshot.json").write_text("{}")
+    for _ in range(VERSIONES_CONSERVADAS + 2):
+        exportar_snapshot(db, rp, str(destino))
+    assert os.path.islink(destino)
+    versiones = sorted(p.name for p in tmp_path.glob("snap_versiones.v*"))
+    assert len(versiones) == VERSIONES_CONSERVADAS + 1
+    assert os.path.realpath(destino) == str(tmp_path / versiones[-1])
+    assert len(cargar_snapshot(str(destino))) == 4
+
+
+def test_app_arranca_sin_pandas_y_pedido_sin_filas(tmp_path):
+    import os
+    import subprocess
+    import sys
+
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    script = (
+        "import sys, app\n"
+        "assert 'pandas' not in sys.modules, 'app importa pandas al arrancar'\n"
+        "alerta = app.actualizar_mapa('no-existe')[2]\n"
+        "assert type(alerta).__name__ == 'Alert' and 'no-existe' in str(alerta.children)\n"
+        "assert 'pandas' not in sys.modules\n"
+    )
+    resultado = subprocess.run([sys.executable, "-c", script], cwd=tmp_path, capture_output=True, text=True,
+                               env={**os.environ, "PYTHONPATH": raiz}, timeout=120)
+    assert resultado.returncode == 0, resultado.stderr[-2000:]
+
+
+def test_zoom_cambia_el_nivel_de_la_ruta_pintada(tmp_path):
+    import os
+    import subprocess
+    import sys
+    from datetime import datetime
+
+    db = _crear_bd_planificaciones(tmp_path / "logistica.db")
+    rp = RouteProvider(db)
+    # Zigzag de ~100 m: desaparece en el nivel 3 y se conserva en la geometría completa
+    coordenadas = [[-3.70 - 0.01 * i, 40.41 - 0.01 * i + (0.001 if i % 2 else 0)] for i in range(100)]
+    rp.guardar_rutas([{
+        "route_id": rp._generar_id_ruta(-3.70, 40.41, -5.98, 37.38),
+        "geometria": {"type": "LineString", "coordinates": coordenadas},
+        "distancia_km": 350.0, "duracion_min": 210.0, "updated_at": datetime.now(),
+    }])
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    script = (
+        "import dash, app\n"
+        "puntos = lambda capa: len(capa[0].data['geometry']['coordinates'])\n"
+        "salida = app.actualizar_mapa('100', 6)\n"
+        "mostrada = salida[-1]\n"
+        "assert mostrada['nivel'] == 3 and puntos(salida[1]) < 100, mostrada\n"
+        "capa, mostrada = app.ajustar_nivel_ruta(14, mostrada)\n"
+        "assert mostrada['nivel'] == 0 and puntos(capa) == 100\n"
+        "assert app.ajustar_nivel_ruta(15, mostrada) == (dash.no_update, dash.no_update)\n"
+        "assert app.ajustar_nivel_ruta(14, None) == (dash.no_update, dash.no_update)\n"
+    )
+    resultado = subprocess.run([sys.executable, "-c", script], cwd=tmp_path, capture_output=True, text=True,
+                               env={**os.environ, "PYTHONPATH": raiz}, timeout=120)
+    assert resultado.returncode == 0, resultado.stderr[-2000:]
+
+
+def test_suite_benchmarks_carga_y_comparacion(tmp_path):
+    from sqlalchemy import text
+    from benchmarks import bench_carga
+    from benchmarks.suite import comparar
+
+    db, datos = bench_carga.preparar(300, str(tmp_path), fraccion_cacheada=0.5)
+    with db.read_engine.connect() as conn:
+        cacheadas = conn.execute(text("SELECT COUNT(*) FROM cache_rutas")).scalar()
+        pares = conn.execute(text("SELECT COUNT(*) FROM (SELECT DISTINCT longitud_origen, latitud_origen, "
+                                  "longitud_destino, latitud_destino FROM pedido_coordenadas)")).scalar()
+    assert 0.3 * pares < cacheadas < 0.7 * pares
+
+    pedidos = datos["planificaciones"]["pedido"].drop_duplicates().head(20).tolist()
+    carga = bench_carga.medir(str(tmp_path), pedidos, peticiones=40, concurrencia=4)
+    assert carga["errores"] == 0 and 0 < carga["en_segundo_plano"] < 40
+    assert carga["p50_ms"] <= carga["p95_ms"] <= carga["p99_ms"] <= carga["max_ms"]
+
+    anterior = {"commit": "a", "resultados": [{"planificaciones": 300, "carga_concurrencia": 4,
+                                                "carga_p99_ms": 10.0, "carga_peticiones_por_segundo": 100.0}]}
+    actual = {"commit": "b", "resultados": [{"planificaciones": 300, "carga_concurrencia": 8,
+                                              "carga_p99_ms": 20.0, "carga_peticiones_por_segundo": 150.0}]}
+    lineas = comparar(anterior, actual)
+    assert len(lineas) == 3
+    assert lineas[1].endswith("PEOR") and lineas[2].endswith("mejor")
@@ -0,0 +1,166 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from sqlalchemy import text
+from database import DatabaseManager
+from router import RouteProvider
+from osrm_client import CircuitoAbiertoError
+from logger import setup_logger
+
+logger = setup_logger("warmup")
+
+
+class LimitadorTasa:
+    """Limita el número de peticiones por segundo compartido entre hilos."""
+
+    def __init__(self, peticiones_por_segundo: float) -> None:
+        self.intervalo = 1.0 / peticiones_por_segundo if peticiones_por_segundo else 0.0
+        self._siguiente = time.monotonic()
+        self._lock = threading.Lock()
+
+    def esperar(self) -> None:
+        if not self.intervalo:
+            return
+        with self._lock:
+            ahora = time.monotonic()
+            turno = max(self._siguiente, ahora)
+            self._siguiente = turno + self.intervalo
+        if turno > ahora:
+            time.sleep(turno - ahora)
+
+
+def obtener_pares_pendientes(db_manager, route_provider, afectadas=None) -> list:
+    """Pares (cargadero, planta) distintos de planificaciones que aún no están en cache_rutas.
+
+    Usa el mismo cruce que ``process.procesar_rutas`` y descarta pares sin coordenadas.
+    Con ``afectadas`` (tabla -> claves cambiadas en la ETL) solo se miran las
+    planificaciones que dependen de esas claves.
+    Returns:
+        list de tuplas (route_id, lon_origen, lat_origen, lon_destino, lat_destino).
+    """
+    query = """
+    SELECT DISTINCT o.longitud as longitud_origen, o.latitud as latitud_origen,
+           d.longitud as longitud_destino, d.latitud as latitud_destino
+    FROM planificaciones p
+    LEFT JOIN maestro_origenes o ON p.codigoCargadero = o.codigo
+    LEFT JOIN maestro_destinos d ON p.codigoPlanta = d.codigoPlanta
+    WHERE o.longitud IS NOT NULL AND o.latitud IS NOT NULL
+      AND d.longitud IS NOT NULL AND d.latitud IS NOT NULL
+    """
+    with db_manager.engine.connect() as conn:
+        if afectadas is not None:
+            query += f" AND ({db_manager.filtro_afectadas(conn, afectadas, alias='p')})"
+        filas = conn.execute(text(query)).all()
+        existentes = {r[0] for r in conn.execute(text("SELECT route_id FROM cache_rutas"))}
+
+    pendientes = {}
+    for lo_o, la_o, lo_d, la_d in filas:
+        route_id = route_provider._generar_id_ruta(lo_o, la_o, lo_d, la_d)
+        # Coordenadas casi idénticas comparten route_id: se piden una sola vez
+        if route_id not in existentes and route_id not in pendientes:
+            pendientes[route_id] = (route_id, lo_o, la_o, lo_d, la_d)
+    return list(pendientes.values())
+
+
+def _es_transitorio(error: requests.exceptions.RequestException) -> bool:
+    """Timeouts, errores de conexión y respuestas 5xx/429: pueden salir bien al reintentar."""
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return True
+    respuesta = getattr(error, "response", None)
+    return respuesta is not None and (respuesta.status_code >= 500 or respuesta.status_code == 429)
+
+
+def _consultar_con_reintentos(route_provider, limitador, par, reintentos, backoff):
+    """Ruta de OSRM para ``par`` o None si no se pudo obtener (nunca lanza).
+
+    Solo se reintentan los fallos transitorios; un 4xx (p.ej. NoRoute o
+    coordenadas inválidas) o una respuesta mal formada se descartan a la
+    primera para no gastar el límite de tasa.
+    """
+    route_id, lo_o, la_o, lo_d, la_d = par
+    for intento in range(reintentos + 1):
+        limitador.esperar()
+        try:
+            return route_provider.consultar_osrm(lo_o, la_o, lo_d, la_d)
+        except CircuitoAbiertoError as e:
+            # OSRM está caído: no tiene sentido seguir reintentando este par
+            logger.error(f"Ruta {route_id} descartada: {e}")
+            return None
+        except requests.exceptions.RequestException as e:
+            if not _es_transitorio(e):
+                logger.error(f"Ruta {route_id} descartada (error no recuperable): {e}")
+                return None
+            if intento == reintentos:
+                logger.error(f"Ruta {route_id} descartada tras {reintentos + 1} intentos: {e}")
+                return None
+            # Backoff exponencial con jitter para no sincronizar los reintentos
+            espera = backoff * (2 ** intento) * (0.5 + random.random())
+            logger.warning(f"Reintentando ruta {route_id} en {espera:.2f}s ({e})")
+            time.sleep(espera)
+        except Exception as e:
+            # Respuesta de OSRM mal formada (KeyError, ValueError...): solo se pierde este par
+            logger.error(f"Ruta {route_id} descartada (respuesta inválida de OSRM): {e!r}")
+            return None
+
+
+def precalcular_rutas(db_manager=None, route_provider=None, max_workers=4,
+                      peticiones_por_segundo=5.0, reintentos=3, backoff=0.5, afectadas=None) -> dict:
+    """Calcula por adelantado las rutas de todas las planificaciones que falten en caché.
+
+    Las consultas a OSRM se lanzan en un pool de hilos acotado, con límite de
+    peticiones por segundo y reintentos con backoff exponencial. Los resultados
+    se insertan en bloque en una única transacción. Con ``afectadas`` solo se
+    revisan las planificaciones que dependen de las claves cambiadas en la ETL.
+
+    Returns:
+        dict con pendientes, calculadas, fallidas, insertadas, segundos y rutas_por_segundo.
+    """
+    db_manager = db_manager or DatabaseManager()
+    route_provider = route_provider or RouteProvider(db_manager)
+
+    inicio = time.perf_counter()
+    pares = obtener_pares_pendientes(db_manager, route_provider, afectadas)
+    total = len(pares)
+    logger.info(f"Precálculo de rutas: {total} pares pendientes.")
+
+    rutas = []
+    fallidas = 0
+    if total:
+        limitador = LimitadorTasa(peticiones_por_segundo)
+        paso = max(1, total // 10)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futuros = [
+                pool.submit(_consultar_con_reintentos, route_provider, limitador, par, reintentos, backoff)
+                for par in pares
+            ]
+            for hechas, futuro in enumerate(as_completed(futuros), start=1):
+                ruta = futuro.result()
+                if ruta is None:
+                    fallidas += 1
+                else:
+                    rutas.append(ruta)
+                if hechas % paso == 0 or hechas == total:
+                    transcurrido = time.perf_counter() - inicio
+                    logger.info(
+                        f"Precálculo: {hechas}/{total} rutas "
+                        f"({hechas / transcurrido:.1f} rutas/s)."
+                    )
+
+    insertadas = route_provider.guardar_rutas(rutas)
+    segundos = time.perf_counter() - inicio
+    resumen = {
+        "pendientes": total,
+        "calculadas": len(rutas),
+        "fallidas": fallidas,
+        "insertadas": insertadas,
+        "segundos": round(segundos, 3),
+        "rutas_por_segundo": round(len(rutas) / segundos, 2) if segundos else 0.0,
+    }
+    logger.info(f"Precálculo de rutas terminado: {resumen}")
+    return resumen
+
+
+if __name__ == "__main__":
+    print(precalcular_rutas())